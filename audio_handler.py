@@ -6,163 +6,173 @@ Task To Do:
 2. Client 2: Receive RTP packets and decode them to play audio in real-time.
 3. Ensure proper buffering and latency management.
 '''
-import socket
-import pyaudio
-import wave
-import queue
-import threading
-import numpy as np
-
-def read_and_encode_audio(audio_file, frame_duration=20):
+import asyncio
+import struct
+import time
+import metrics
+from config import *
+from audio_output import open_sink
+from g711 import PCMU, PCMA, get_codec
+from audio_normalize import iter_normalized, iter_frames, TARGET_RATE
+from recording import CallRecorder
+from rtp_async import RtpReceiveSession
+
+RTP_SEQ = struct.Struct('!H')
+
+PLAYOUT_WRITE_MS = metrics.histogram("audio.playout_write_ms")
+PLAYOUT_FRAMES = metrics.counter("audio.playout_frames")
+
+def read_and_encode_audio(audio_file, frame_duration=20, codec="PCMU"):
     """
     Read and encode .wav audio files for RTP transmission using G.711.
 
+    Any PCM WAV (sample rate, channel count, 8-32 bit samples) is streamed
+    through the normalization stage to 8 kHz mono before encoding.
+
     Args:
         audio_file (str): Path to the .wav file.
         frame_duration (int): Duration of each audio frame in milliseconds.
+        codec (str): G.711 codec name ("PCMU" or "PCMA").
 
     Yields:
         bytes: Encoded audio frames.
     """
-    with wave.open(audio_file, 'rb') as wf:
-        # Get audio properties
-        sample_rate = wf.getframerate()
-        channels = wf.getnchannels()
-        sample_width = wf.getsampwidth()
-        frame_size = int(sample_rate * frame_duration / 1000) * channels * sample_width
+    encoder = get_codec(codec)
+    frame_samples = TARGET_RATE * frame_duration // 1000
 
-        while True:
-            # Read a frame of audio data
-            audio_data = wf.readframes(frame_size)
-            if not audio_data:
-                break
+    for pcm_samples in iter_frames(iter_normalized(audio_file), frame_samples):
+        # Encode audio data using G.711
+        encoded_audio = encoder.encode(pcm_samples)
 
-            # Convert raw PCM data to numpy array
-            pcm_samples = np.frombuffer(audio_data, dtype=np.int16)
+        yield encoded_audio.tobytes()
 
-            # Encode audio data using G.711 μ-law
-            encoded_audio = linear_to_ulaw(pcm_samples)
+def linear_to_ulaw(sample):
+    """
+    Convert linear PCM samples to μ-law using the G.711 lookup table.
+    """
+    return PCMU.encode(sample)
 
-            yield encoded_audio.tobytes()
+def ulaw_to_linear(ulaw_sample):
+    """
+    Convert μ-law samples to linear PCM using the G.711 lookup table.
+    """
+    return PCMU.decode(ulaw_sample)
 
-# Constants for μ-law
-MU = 255
+def linear_to_alaw(sample):
+    """
+    Convert linear PCM samples to A-law using the G.711 lookup table.
+    """
+    return PCMA.encode(sample)
 
-def linear_to_ulaw(sample):
+def alaw_to_linear(alaw_sample):
     """
-    Convert a linear PCM sample to μ-law.
+    Convert A-law samples to linear PCM using the G.711 lookup table.
     """
-    sign = np.sign(sample)
-    magnitude = np.log1p(MU * np.abs(sample) / 32768.0) / np.log1p(MU)
-    ulaw_sample = ((1 + MU) * magnitude).astype(np.int16) - 128
-    return (sign * ulaw_sample).astype(np.uint8)
+    return PCMA.decode(alaw_sample)
 
-def ulaw_to_linear(ulaw_sample):
+def write_frame(sink, frame):
+    """
+    Hand one frame to a push sink, timed into audio.playout_write_ms.
     """
-    Convert a μ-law sample to linear PCM.
+    if not metrics.enabled:
+        sink.write(frame)
+        return
+    start = time.perf_counter()
+    sink.write(frame)
+    PLAYOUT_WRITE_MS.observe_since(start)
+    PLAYOUT_FRAMES.inc()
+
+async def play_rtp_session(session, sink, recorder=None):
     """
-    ulaw_sample = ulaw_sample.astype(np.int16) + 128
-    magnitude = (np.expm1(ulaw_sample / (1 + MU)) * 32768.0).astype(np.int16)
-    return magnitude
+    Play a receive session on an output sink until the session closes.
 
-def receive_and_play_audio(port, buffer_size=2048):
+    Push sinks get one frame per 20 ms playout tick; blocking ones write in
+    the default executor so the event loop keeps receiving. Pull sinks
+    (PyAudio callback mode) take frames from the jitter buffer on the
+    device's clock.
+
+    Args:
+        session (RtpReceiveSession): Opened receive session.
+        sink: Output sink from audio_output.
+        recorder (CallRecorder): Also record every played frame.
+    """
+    loop = asyncio.get_running_loop()
+    if sink.pull:
+        if session.jitter_buffer is None:
+            raise ValueError("A pull sink needs a session with a jitter buffer")
+
+        def source():
+            ready, decoded_audio = session.playout()
+            if ready and recorder is not None:
+                recorder.write_frame(decoded_audio)
+            return decoded_audio
+
+        sink.start(source)
+        await session.wait_closed()
+        return
+
+    if session.jitter_buffer is not None:
+        async for decoded_audio in session.frames():
+            if recorder is not None:
+                recorder.write_frame(decoded_audio)
+            if sink.blocking:
+                await loop.run_in_executor(None, write_frame, sink, decoded_audio)
+            else:
+                write_frame(sink, decoded_audio)
+        return
+
+    async for packet in session.packets():
+        decoded_audio = session.decode(packet)
+        if decoded_audio is None:
+            continue
+        if recorder is not None:
+            # Arrival order: let the recorder fill gaps by sequence number
+            recorder.write_frame(decoded_audio, RTP_SEQ.unpack_from(packet, 2)[0])
+        if sink.blocking:
+            await loop.run_in_executor(None, write_frame, sink, decoded_audio)
+        else:
+            write_frame(sink, decoded_audio)
+
+async def _receive_and_play(port, use_jitter_buffer, rtcp_port=None, output_file=None, sink=None):
+    if sink is None or isinstance(sink, str):
+        sink = open_sink(sink or AUDIO_OUTPUT)
+    recorder = CallRecorder(output_file) if output_file else None
+    try:
+        async with RtpReceiveSession(port, rtcp_port, use_jitter_buffer=use_jitter_buffer) as session:
+            print(f"Listening for RTP packets on port {port}...")
+            await play_rtp_session(session, sink, recorder)
+    finally:
+        # Cleanup
+        sink.close()
+        if recorder is not None:
+            recorder.close()
+            print(f"Recording saved to {output_file}: {recorder.get_stats()}")
+
+def receive_and_play_audio(port, buffer_size=2048, sink=None):
     """
     Receive RTP packets and decode them to play audio in real-time using G.711.
 
     Args:
         port (int): Port to listen for RTP packets.
-        buffer_size (int): Size of the buffer for receiving packets.
-    """
-    # Set up UDP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', port))
-
-    # Set up PyAudio for playback
-    audio = pyaudio.PyAudio()
-    stream = audio.open(format=pyaudio.paInt16,  # 16-bit audio
-                        channels=1,             # Mono
-                        rate=8000,              # 8 kHz sample rate
-                        output=True)
-
-    print(f"Listening for RTP packets on port {port}...")
-
-    while True:
-        data, addr = sock.recvfrom(buffer_size)
-        if data:
-            # Extract RTP payload (audio data)
-            payload = data[12:]  # RTP header is 12 bytes
-
-            # Decode audio data using G.711 μ-law
-            decoded_audio = ulaw_to_linear(np.frombuffer(payload, dtype=np.uint8))
-
-            # Play the decoded audio
-            stream.write(decoded_audio.tobytes())
-
-    # Cleanup
-    stream.stop_stream()
-    stream.close()
-    audio.terminate()
-
-class JitterBuffer:
-    def __init__(self, max_size=50):
-        self.buffer = queue.Queue(maxsize=max_size)
-
-    def add_packet(self, packet):
-        """
-        Add a packet to the jitter buffer.
-        """
-        if not self.buffer.full():
-            self.buffer.put(packet)
-
-    def get_packet(self):
-        """
-        Retrieve a packet from the jitter buffer.
-        """
-        if not self.buffer.empty():
-            return self.buffer.get()
-        return None
-
-def receive_with_jitter_buffer(port, buffer_size=2048):
+        buffer_size (int): Unused; kept for compatibility (the asyncio
+            transport sizes its own receive buffer).
+        sink: Output sink, or a sink name for audio_output.open_sink();
+            config.AUDIO_OUTPUT if None.
+    """
+    asyncio.run(_receive_and_play(port, use_jitter_buffer=False, sink=sink))
+
+def receive_with_jitter_buffer(port, buffer_size=2048, rtcp_port=None, output_file=None, sink=None):
     """
     Receive RTP packets with jitter buffering and play audio in real-time using G.711.
 
     Args:
         port (int): Port to listen for RTP packets.
-        buffer_size (int): Size of the buffer for receiving packets.
+        buffer_size (int): Unused; kept for compatibility (the asyncio
+            transport sizes its own receive buffer).
+        rtcp_port (int): If given, receive RTCP and send Receiver Reports here.
+        output_file (str): If given, record the played audio to this WAV file.
+        sink: Output sink, or a sink name for audio_output.open_sink();
+            config.AUDIO_OUTPUT if None.
     """
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(('', port))
-
-    jitter_buffer = JitterBuffer()
-
-    def receive_packets():
-        while True:
-            data, addr = sock.recvfrom(buffer_size)
-            if data:
-                jitter_buffer.add_packet(data)
-
-    # Start a thread to receive packets
-    threading.Thread(target=receive_packets, daemon=True).start()
-
-    # Set up PyAudio for playback
-    audio = pyaudio.PyAudio()
-    stream = audio.open(format=pyaudio.paInt16,  # 16-bit audio
-                        channels=1,             # Mono
-                        rate=8000,              # 8 kHz sample rate
-                        output=True)
-
-    while True:
-        packet = jitter_buffer.get_packet()
-        if packet:
-            payload = packet[12:]  # RTP header is 12 bytes
-
-            # Decode audio data using G.711 μ-law
-            decoded_audio = ulaw_to_linear(np.frombuffer(payload, dtype=np.uint8))
-
-            # Play the decoded audio
-            stream.write(decoded_audio.tobytes())
-
-    # Cleanup
-    stream.stop_stream()
-    stream.close()
-    audio.terminate()
\ No newline at end of file
+    asyncio.run(_receive_and_play(port, use_jitter_buffer=True, rtcp_port=rtcp_port,
+                                  output_file=output_file, sink=sink))
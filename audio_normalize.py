@@ -0,0 +1,168 @@
+'''
+Streaming audio normalization: any PCM WAV -> 8 kHz mono int16
+
+The file is read in fixed-size chunks, so memory use does not depend on its
+length. Each chunk goes through:
+    1. sample-width conversion (8/16/24/32-bit PCM) to float32
+    2. downmix to mono (channel mean)
+    3. a rational polyphase resampler (e.g. 44.1 kHz -> 8 kHz is 80/441)
+    4. rounding and clipping to int16
+The resampler keeps its filter history and output phase between chunks, so
+the result is the same as resampling the whole file at once. All stages are
+vectorized with NumPy; there is no per-sample Python.
+'''
+
+import math
+import wave
+from fractions import Fraction
+import numpy as np
+
+TARGET_RATE = 8000
+TAPS_PER_PHASE = 16  # per output sample at the output rate
+KAISER_BETA = 8.0
+CUTOFF = 0.9  # fraction of the output Nyquist kept in the passband
+
+def pcm_to_float(raw, sample_width):
+    """
+    Convert little-endian PCM bytes to float32 in int16 scale.
+    """
+    if sample_width == 1:
+        # 8-bit WAV is unsigned
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) * 256.0
+    if sample_width == 2:
+        return np.frombuffer(raw, dtype='<i2').astype(np.float32)
+    if sample_width == 3:
+        # Keep the top 16 bits of each 24-bit sample
+        data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        return data[:, 1:].copy().view('<i2').reshape(-1).astype(np.float32)
+    if sample_width == 4:
+        return np.frombuffer(raw, dtype='<i4').astype(np.float32) / 65536.0
+    raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+
+def downmix(samples, channels):
+    """
+    Average interleaved channels down to mono.
+    """
+    if channels == 1:
+        return samples
+    return samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+def float_to_int16(samples):
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler (upsample by L, low-pass, decimate by M)
+    computed directly from the L polyphase sub-filters.
+    """
+    def __init__(self, in_rate, out_rate=TARGET_RATE, taps_per_phase=TAPS_PER_PHASE):
+        ratio = Fraction(out_rate, in_rate)
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+        # Scale the filter with the decimation ratio so the transition band
+        # stays the same width relative to the output rate
+        self.taps = math.ceil(taps_per_phase * max(self.up, self.down) / self.up)
+        taps_per_phase = self.taps
+
+        # Prototype low-pass at the tighter of the two Nyquist limits
+        num_taps = self.up * taps_per_phase
+        cutoff = CUTOFF * 0.5 / max(self.up, self.down)
+        n = np.arange(num_taps) - (num_taps - 1) / 2
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, KAISER_BETA)
+        # Unity gain per phase (zero stuffing divides the level by L)
+        h *= self.up / h.sum()
+
+        # bank[p, k] = h[p + L*k]: sub-filter for output phase p
+        self.bank = np.ascontiguousarray(h.reshape(taps_per_phase, self.up).T, dtype=np.float32)
+
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._next_t = 0  # next output position, in upsampled samples from chunk start
+        self._tap_offsets = np.arange(taps_per_phase)
+
+    @property
+    def delay(self):
+        """
+        Group delay of the filter in output samples.
+        """
+        return (self.up * self.taps - 1) / 2 / self.down
+
+    def process(self, samples):
+        """
+        Resample one chunk of float32 samples.
+        """
+        n = len(samples)
+        buffer = np.concatenate((self._history, samples))
+        up, down = self.up, self.down
+
+        t = np.arange(self._next_t, n * up, down)
+        if len(t):
+            phase = t % up
+            base = t // up + (self.taps - 1)
+            # Newest input first, matching bank[p, k] = h[p + L*k]
+            idx = base[:, None] - self._tap_offsets[None, :]
+            out = np.einsum('ij,ij->i', buffer[idx], self.bank[phase])
+            self._next_t = int(t[-1]) + down - n * up
+        else:
+            out = np.zeros(0, dtype=np.float32)
+            self._next_t -= n * up
+
+        self._history = buffer[len(buffer) - (self.taps - 1):]
+        return out
+
+    def flush(self):
+        """
+        Push out the tail still held in the filter.
+        """
+        return self.process(np.zeros(int(math.ceil(self.taps / 2)), dtype=np.float32))
+
+def iter_normalized(audio_file, chunk_frames=4096, out_rate=TARGET_RATE):
+    """
+    Stream a WAV file as 8 kHz mono int16 chunks.
+
+    Args:
+        audio_file (str): Path to the .wav file.
+        chunk_frames (int): WAV frames read per chunk.
+        out_rate (int): Output sample rate.
+
+    Yields:
+        np.ndarray: int16 samples.
+    """
+    with wave.open(audio_file, 'rb') as wf:
+        sample_rate = wf.getframerate()
+        channels = wf.getnchannels()
+        sample_width = wf.getsampwidth()
+        resampler = PolyphaseResampler(sample_rate, out_rate) if sample_rate != out_rate else None
+
+        while True:
+            raw = wf.readframes(chunk_frames)
+            if not raw:
+                break
+            samples = downmix(pcm_to_float(raw, sample_width), channels)
+            if resampler is not None:
+                samples = resampler.process(samples)
+            if len(samples):
+                yield float_to_int16(samples)
+
+        if resampler is not None:
+            tail = resampler.flush()
+            if len(tail):
+                yield float_to_int16(tail)
+
+def iter_frames(chunks, frame_samples=160):
+    """
+    Re-chunk a stream of int16 arrays into fixed-size frames. The last
+    partial frame is padded with silence.
+
+    Yields:
+        np.ndarray: Frames of exactly frame_samples int16 samples.
+    """
+    pending = np.zeros(0, dtype=np.int16)
+    for chunk in chunks:
+        if len(pending):
+            chunk = np.concatenate((pending, chunk))
+        usable = len(chunk) - len(chunk) % frame_samples
+        for start in range(0, usable, frame_samples):
+            yield chunk[start:start + frame_samples]
+        pending = chunk[usable:]
+    if len(pending):
+        yield np.concatenate((pending, np.zeros(frame_samples - len(pending), dtype=np.int16)))
@@ -0,0 +1,235 @@
+'''
+Audio output sinks
+
+The receive path hands decoded 8 kHz int16 frames to a sink instead of
+writing to a hard-coded PyAudio stream, so it also runs on machines with
+no sound device.
+
+Push sinks have write(frame). Frames come from the session's 20 ms
+playout clock. If sink.blocking is set, write() runs in an executor so it
+cannot stall the event loop.
+    - PyAudioSink: blocking PyAudio stream (the previous behaviour), with
+      a configurable frames_per_buffer.
+    - NullSink: discards audio, optionally sleeping to keep wall-clock
+      pacing like a real device.
+    - RawFileSink: appends headerless 16-bit PCM to a file.
+
+Pull sinks (sink.pull is True) have start(source) instead. The device
+clock drives playout: every callback pulls just enough frames from
+source(). source() is normally RtpReceiveSession.playout, backed by the
+jitter buffer.
+    - PyAudioCallbackSink: PyAudio callback mode. With
+      frames_per_buffer=160 the device asks for one 20 ms frame at a time,
+      which is the lowest output latency PyAudio exposes.
+
+pyaudio is only imported when a PyAudio sink is opened.
+'''
+
+import time
+from config import *
+
+SAMPLE_RATE = 8000
+FRAME_SAMPLES = 160
+
+class PyAudioSink:
+    pull = False
+    blocking = True
+
+    def __init__(self, frames_per_buffer=None, rate=SAMPLE_RATE):
+        """
+        Args:
+            frames_per_buffer (int): Samples per PortAudio buffer; PyAudio's
+                default if None.
+            rate (int): Sample rate.
+        """
+        import pyaudio
+        self._audio = pyaudio.PyAudio()
+        options = {}
+        if frames_per_buffer:
+            options["frames_per_buffer"] = frames_per_buffer
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=rate,
+                                        output=True, **options)
+        self.stats = {"frames": 0}
+
+    def write(self, frame):
+        self._stream.write(frame.tobytes())
+        self.stats["frames"] += 1
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._audio.terminate()
+
+class PyAudioCallbackSink:
+    pull = True
+    blocking = False
+
+    def __init__(self, frames_per_buffer=FRAME_SAMPLES, rate=SAMPLE_RATE, frame_samples=FRAME_SAMPLES):
+        """
+        Args:
+            frames_per_buffer (int): Samples PortAudio asks for per callback
+                (160 = one 20 ms frame).
+            rate (int): Sample rate.
+            frame_samples (int): Samples per frame returned by source().
+        """
+        self.frames_per_buffer = frames_per_buffer
+        self.rate = rate
+        self.frame_samples = frame_samples
+        self._source = None
+        self._audio = None
+        self._stream = None
+        self._carry = bytearray()  # samples pulled but not yet handed to the device
+        self._silence = bytes(2 * frame_samples)
+        self.stats = {"frames": 0, "concealed": 0, "callbacks": 0, "device_underflows": 0}
+
+    def start(self, source):
+        """
+        Open the stream and start pulling.
+
+        Args:
+            source (callable): Returns the next int16 frame, or None to play
+                silence (lost frame or buffering).
+        """
+        import pyaudio
+        self._pyaudio = pyaudio
+        self._source = source
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=1, rate=self.rate,
+                                        output=True, frames_per_buffer=self.frames_per_buffer,
+                                        stream_callback=self._callback)
+        self._stream.start_stream()
+
+    def fill(self, samples):
+        """
+        Pull frames from the source until samples are available and return
+        them as bytes. Runs on the PortAudio thread.
+        """
+        needed = 2 * samples
+        carry = self._carry
+        if not carry and samples == self.frame_samples:
+            # Common case: one frame per callback, nothing carried over
+            return self._next_frame()
+        while len(carry) < needed:
+            carry += self._next_frame()
+        data = bytes(carry[:needed])
+        del carry[:needed]
+        return data
+
+    def _next_frame(self):
+        frame = self._source()
+        self.stats["frames"] += 1
+        if frame is None:
+            self.stats["concealed"] += 1
+            return self._silence
+        return frame.tobytes()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        self.stats["callbacks"] += 1
+        if status & self._pyaudio.paOutputUnderflow:
+            self.stats["device_underflows"] += 1
+        return self.fill(frame_count), self._pyaudio.paContinue
+
+    @property
+    def active(self):
+        return self._stream is not None and self._stream.is_active()
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+
+class NullSink:
+    pull = False
+
+    def __init__(self, pace=False, frame_duration=20):
+        """
+        Args:
+            pace (bool): Block in write() so frames are consumed at real-time
+                rate, like a sound device.
+            frame_duration (int): Milliseconds of audio per frame.
+        """
+        self.pace = pace
+        self.blocking = pace
+        self.frame_s = frame_duration / 1000
+        self._deadline = None
+        self.stats = {"frames": 0, "samples": 0, "late": 0}
+
+    def write(self, frame):
+        self.stats["frames"] += 1
+        self.stats["samples"] += len(frame)
+        if not self.pace:
+            return
+        now = time.monotonic()
+        if self._deadline is None:
+            self._deadline = now
+        self._deadline += self.frame_s
+        if self._deadline < now - self.frame_s:
+            # Caller fell behind; restart the clock instead of bursting
+            self.stats["late"] += 1
+            self._deadline = now
+        if self._deadline > now:
+            time.sleep(self._deadline - now)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        pass
+
+class RawFileSink:
+    pull = False
+    blocking = False
+
+    def __init__(self, path, buffering=1 << 16):
+        """
+        Args:
+            path (str): Output file for headerless little-endian int16 PCM.
+            buffering (int): File buffer size in bytes.
+        """
+        self.path = path
+        self._file = open(path, 'wb', buffering=buffering)
+        self.stats = {"frames": 0, "bytes_written": 0}
+
+    def write(self, frame):
+        data = frame.data if frame.flags.c_contiguous else frame.tobytes()
+        self._file.write(data)
+        self.stats["frames"] += 1
+        self.stats["bytes_written"] += frame.nbytes
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        self._file.close()
+
+SINKS = {
+    "pyaudio": PyAudioSink,
+    "pyaudio-callback": PyAudioCallbackSink,
+    "null": NullSink,
+    "file": RawFileSink,
+}
+
+def open_sink(kind=AUDIO_OUTPUT, **options):
+    """
+    Create an output sink by name ("pyaudio", "pyaudio-callback", "null" or
+    "file").
+
+    Args:
+        kind (str): Sink type.
+        **options: Passed to the sink constructor (e.g. frames_per_buffer,
+            pace, path).
+    """
+    sink_class = SINKS.get(kind)
+    if sink_class is None:
+        raise ValueError(f"Unknown audio output: {kind}")
+    return sink_class(**options)
@@ -0,0 +1,4 @@
+'''
+Performance benchmarks. Run each module from the repository root, e.g.
+    python -m benchmarks.bench_g711
+'''
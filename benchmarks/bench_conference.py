@@ -0,0 +1,76 @@
+'''
+Benchmark for the conference mixer
+
+Measures the cost of one 20 ms mixing tick (decode, mix, re-encode for
+every participant) as the room grows, for ConferenceMixer and for a naive
+mixer that decodes per frame and sums every other participant for each
+listener in Python. Also checks that both produce the same output.
+
+Run from the repository root:
+    python -m benchmarks.bench_conference
+'''
+
+import time
+import numpy as np
+from conference import ConferenceMixer
+from g711 import PCMU
+
+FRAME_SAMPLES = 160
+TICK_MS = 20
+
+def make_frames(participants, ticks, seed=0):
+    rng = np.random.default_rng(seed)
+    pcm = rng.integers(-8000, 8000, size=(ticks, participants, FRAME_SAMPLES), dtype=np.int16)
+    return [[PCMU.encode(pcm[t, p]).tobytes() for p in range(participants)] for t in range(ticks)]
+
+def naive_mix(payloads):
+    """
+    Per-listener mixing: decode each frame, then sum everyone else's for
+    every participant (O(N^2) per tick).
+    """
+    decoded = [PCMU.decode(payload).astype(np.int32) for payload in payloads]
+    out = []
+    for i in range(len(decoded)):
+        mixed = np.zeros(FRAME_SAMPLES, dtype=np.int32)
+        for j, frame in enumerate(decoded):
+            if j != i:
+                mixed += frame
+        out.append(PCMU.encode(np.clip(mixed, -32768, 32767).astype(np.int16)).tobytes())
+    return out
+
+def bench_mixer(participants, frames):
+    mixer = ConferenceMixer(FRAME_SAMPLES)
+    for p in range(participants):
+        mixer.add_participant(p)
+    start = time.perf_counter()
+    for tick in frames:
+        for p, payload in enumerate(tick):
+            mixer.put_frame(p, payload)
+        mixer.mix()
+    return (time.perf_counter() - start) / len(frames), mixer
+
+def bench_naive(participants, frames):
+    start = time.perf_counter()
+    for tick in frames:
+        naive_mix(tick)
+    return (time.perf_counter() - start) / len(frames)
+
+def main(sizes=(3, 10, 50, 100, 250, 500, 1000), ticks=50, naive_limit=250):
+    print(f"{'participants':>12} {'mixer us/tick':>14} {'tick %':>8} {'naive us/tick':>14} {'speedup':>8}")
+    for participants in sizes:
+        frames = make_frames(participants, ticks)
+
+        # Same output as the naive mixer on the last tick
+        mixer_s, mixer = bench_mixer(participants, frames)
+        expected = naive_mix(frames[-1])
+        assert all(bytes(mixer.mixed_frame(p)) == expected[p] for p in range(participants))
+
+        if participants <= naive_limit:
+            naive_s = bench_naive(participants, frames[:max(2, ticks // 10)])
+            naive = f"{naive_s * 1e6:>14,.0f} {naive_s / mixer_s:>7.1f}x"
+        else:
+            naive = f"{'skipped':>14} {'':>8}"
+        print(f"{participants:>12} {mixer_s * 1e6:>14,.1f} {mixer_s * 1e3 / TICK_MS:>7.2%} {naive}")
+
+if __name__ == "__main__":
+    main()
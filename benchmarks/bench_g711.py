@@ -0,0 +1,71 @@
+'''
+Micro-benchmark for the G.711 codec
+
+Compares the table-driven codec in g711.py against the previous
+floating-point log1p/expm1 implementation and reports samples/sec for
+encode and decode on 20 ms (160-sample) frames.
+
+Run from the repository root:
+    python -m benchmarks.bench_g711
+'''
+
+import time
+import numpy as np
+from g711 import PCMU, PCMA
+
+MU = 255
+FRAME_SAMPLES = 160
+
+def legacy_linear_to_ulaw(sample):
+    """
+    The original float μ-law encoder from audio_handler, kept for comparison.
+    """
+    sign = np.sign(sample)
+    magnitude = np.log1p(MU * np.abs(sample) / 32768.0) / np.log1p(MU)
+    ulaw_sample = ((1 + MU) * magnitude).astype(np.int16) - 128
+    return (sign * ulaw_sample).astype(np.uint8)
+
+def legacy_ulaw_to_linear(ulaw_sample):
+    """
+    The original float μ-law decoder from audio_handler, kept for comparison.
+    """
+    ulaw_sample = ulaw_sample.astype(np.int16) + 128
+    magnitude = (np.expm1(ulaw_sample / (1 + MU)) * 32768.0).astype(np.int16)
+    return magnitude
+
+def bench(label, func, frames):
+    """
+    Run func over every frame and print the achieved samples/sec.
+    """
+    start = time.perf_counter()
+    for frame in frames:
+        func(frame)
+    elapsed = time.perf_counter() - start
+    samples = len(frames) * FRAME_SAMPLES
+    print(f"{label:<24} {samples / elapsed:>14,.0f} samples/s  "
+          f"{len(frames) / elapsed:>10,.0f} frames/s")
+    return samples / elapsed
+
+def main(num_frames=20000):
+    rng = np.random.default_rng(0)
+    pcm_frames = [rng.integers(-32768, 32768, FRAME_SAMPLES, dtype=np.int16) for _ in range(num_frames)]
+    ulaw_frames = [PCMU.encode(frame) for frame in pcm_frames]
+    alaw_frames = [PCMA.encode(frame) for frame in pcm_frames]
+
+    encode_out = np.empty(FRAME_SAMPLES, dtype=np.uint8)
+    decode_out = np.empty(FRAME_SAMPLES, dtype=np.int16)
+
+    print(f"G.711 benchmark: {num_frames} frames of {FRAME_SAMPLES} samples\n")
+    with np.errstate(all="ignore"):  # the legacy encoder overflows on -32768
+        legacy_enc = bench("legacy ulaw encode", legacy_linear_to_ulaw, pcm_frames)
+    table_enc = bench("table ulaw encode", lambda f: PCMU.encode(f, out=encode_out), pcm_frames)
+    bench("table alaw encode", lambda f: PCMA.encode(f, out=encode_out), pcm_frames)
+    legacy_dec = bench("legacy ulaw decode", legacy_ulaw_to_linear, ulaw_frames)
+    table_dec = bench("table ulaw decode", lambda f: PCMU.decode(f, out=decode_out), ulaw_frames)
+    bench("table alaw decode", lambda f: PCMA.decode(f, out=decode_out), alaw_frames)
+
+    print(f"\nencode speedup: {table_enc / legacy_enc:.1f}x")
+    print(f"decode speedup: {table_dec / legacy_dec:.1f}x")
+
+if __name__ == "__main__":
+    main()
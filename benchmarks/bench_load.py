@@ -0,0 +1,372 @@
+'''
+SIPp-style SIP/RTP load generator
+
+Places calls at a fixed rate with CallManager.place_call (the signaling
+engine behind sip_client.sip_client) against mock_sip_server workers in a
+separate process. Before each call a receive leg is opened: an
+rtp_async.RtpReceiveSession played out to a NullSink, so the media goes
+through the jitter buffer and G.711 decode like a real callee. Once the
+call is answered a prompt is streamed to that leg with send_rtp_stream,
+and the call hangs up when the prompt ends. All streams share one
+RtpScheduler and all legs one asyncio loop. Concurrency is capped; the
+generator waits for a slot before placing the next call.
+
+The report covers:
+    - calls per second attempted and completed
+    - setup latency percentiles
+    - RTP packets sent/received per second, loss and jitter
+    - frames played and concealed by the receive legs
+    - CPU per call for the client and server processes
+It is printed and appended as one JSON line to --output, so runs can be
+compared over time.
+
+Run from the repository root:
+    python -m benchmarks.bench_load --rate 50 --calls 500 --concurrency 200 --hold 5
+'''
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+import numpy as np
+from config import *
+from audio_handler import play_rtp_session
+from audio_output import NullSink
+from call_manager import CallManager
+from media_cache import MediaCache
+from mock_sip_server import run_workers
+from rtp_async import RtpReceiveSession
+from rtp_scheduler import RtpScheduler
+from rtp_stream import send_rtp_stream
+from sip_client import create_call_id, generate_sdp_body
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+class RtpReceivers:
+    """
+    The callee side of the media: one RtpReceiveSession per call, played out
+    to a NullSink on a shared asyncio loop thread.
+    """
+    def __init__(self, host=LOCAL_IP, linger=0.5):
+        """
+        Args:
+            host (str): Address the legs bind to.
+            linger (float): Seconds a leg keeps playing after its call
+                ends, so the jitter buffer drains the last frames.
+        """
+        self.host = host
+        self.linger = linger
+        self.loop = asyncio.new_event_loop()
+        self.sessions = []
+        self._thread = threading.Thread(target=self.loop.run_forever, name="rtp-receivers", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def open_leg(self):
+        """
+        Open a receive leg on a free port. Safe to call from any thread.
+
+        Returns:
+            RtpReceiveSession: The open session; send to its .port.
+        """
+        return asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        session = RtpReceiveSession(0, host=self.host)
+        await session.open()
+        session.port = session.rtp_transport.get_extra_info('sockname')[1]
+        self.loop.create_task(play_rtp_session(session, NullSink()))
+        self.sessions.append(session)
+        return session
+
+    def close_leg(self, session):
+        self.loop.call_soon_threadsafe(self.loop.call_later, self.linger, session.close)
+
+    def stop(self):
+        async def close_all():
+            for session in self.sessions:
+                session.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def totals(self):
+        totals = {"packets_received": 0, "frames_played": 0, "frames_concealed": 0, "underruns": 0}
+        jitters = []
+        for session in self.sessions:
+            stats = session.jitter_buffer.stats
+            totals["packets_received"] += session.packets_received
+            totals["frames_played"] += stats["played"]
+            totals["frames_concealed"] += stats["lost"]
+            totals["underruns"] += stats["underruns"]
+            if session.packets_received:
+                jitters.append(session.jitter_buffer.jitter_ms)
+        totals["jitter_ms_mean"] = sum(jitters) / len(jitters) if jitters else 0.0
+        return totals
+
+def percentiles(values):
+    """
+    Nearest-rank summary of a list of latencies (ms).
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+    return {
+        "min": values[0],
+        "p50": rank(50),
+        "p90": rank(90),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+def write_prompt(path, seconds):
+    t = np.arange(int(8000 * seconds)) / 8000
+    samples = (8000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(8000)
+        wf.writeframes(samples.tobytes())
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def free_port(host=LOCAL_IP):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def _serve(workers, port, stop_event, results, server_options):
+    results.put(run_workers(workers, stop_event, host=LOCAL_IP, port=port, **server_options))
+
+class LoadGenerator:
+    def __init__(self, rate, calls, concurrency, hold, sip_addr, audio_file=None, cache=None):
+        """
+        Args:
+            rate (float): Call attempts per second.
+            calls (int): Total calls to place.
+            concurrency (int): Most calls allowed up at once.
+            hold (float): Call hold time in seconds (the prompt length).
+            sip_addr (tuple): (ip, port) of the SIP server.
+            audio_file (str): Prompt to stream; no media if None.
+            cache (MediaCache): Serve the prompt pre-encoded.
+        """
+        self.rate = rate
+        self.calls = calls
+        self.concurrency = concurrency
+        self.hold = hold
+        self.sip_addr = sip_addr
+        self.audio_file = audio_file
+        self.cache = cache
+
+        self.manager = CallManager()
+        self.scheduler = RtpScheduler()
+        self.receivers = RtpReceivers()
+        self.dialogs = []
+        self.handles = []
+        self._legs = {}  # Call-ID -> receive leg
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def _on_established(self, dialog, ssrc, leg):
+        # CallManager thread: must not block, so the leg is already open
+        if leg is None:
+            return
+        handle = send_rtp_stream(self.audio_file, LOCAL_IP, leg.port, scheduler=self.scheduler,
+                                 cache=self.cache, ssrc=ssrc,
+                                 on_complete=lambda handle: self.manager.hangup(dialog))
+        self.handles.append(handle)
+
+    def _on_ended(self, dialog):
+        leg = self._legs.pop(dialog.call_id, None)
+        if leg is not None:
+            self.receivers.close_leg(leg)
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def run(self):
+        """
+        Place every call and wait for all of them to end.
+
+        Returns:
+            dict: Raw measurements for report().
+        """
+        self.manager.start()
+        self.scheduler.start()
+        self.receivers.start()
+        sdp = generate_sdp_body()
+        duration = None if self.audio_file else self.hold
+
+        cpu_start = time.process_time()
+        start = time.monotonic()
+        for i in range(self.calls):
+            delay = start + i / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cond:
+                while self._active >= self.concurrency:
+                    self._cond.wait()
+                self._active += 1
+            ssrc = 0x10000 + i
+            call_id = create_call_id()
+            leg = None
+            if self.audio_file is not None:
+                leg = self._legs[call_id] = self.receivers.open_leg()
+            dialog = self.manager.place_call(
+                "load", "bench", self.sip_addr, call_id=call_id, sdp=sdp,
+                on_established=lambda dialog, ssrc=ssrc, leg=leg: self._on_established(dialog, ssrc, leg),
+                on_ended=self._on_ended, duration=duration)
+            self.dialogs.append(dialog)
+        placed = time.monotonic() - start
+
+        for dialog in self.dialogs:
+            dialog.wait(self.hold + 64)
+        elapsed = time.monotonic() - start
+        time.sleep(self.receivers.linger + 0.2)  # let the last legs play out
+        cpu = time.process_time() - cpu_start
+
+        self.receivers.stop()
+        self.scheduler.stop()
+        manager_stats = self.manager.get_stats()
+        self.manager.stop()
+        return {
+            "placed_s": placed,
+            "elapsed_s": elapsed,
+            "client_cpu_s": cpu,
+            "manager": manager_stats,
+        }
+
+    def report(self, measured, server_stats=None, server_cpu=None):
+        established = [d for d in self.dialogs if d.established_at is not None]
+        sent = sum(handle.stats["packets_sent"] for handle in self.handles)
+        receive = self.receivers.totals()
+        received = receive["packets_received"]
+        frames = receive["frames_played"] + receive["frames_concealed"]
+        manager = measured["manager"]
+        calls = len(self.dialogs)
+        return {
+            "calls_attempted": calls,
+            "calls_established": len(established),
+            "calls_failed": manager["failed"],
+            "sip_timeouts": manager["timeouts"],
+            "sip_retransmissions": manager["retransmissions"],
+            "elapsed_s": measured["elapsed_s"],
+            "attempted_cps": calls / measured["placed_s"] if measured["placed_s"] else None,
+            "completed_cps": len(established) / measured["elapsed_s"],
+            "setup_latency_ms": percentiles([d.setup_latency * 1000 for d in established]),
+            "rtp": {
+                "packets_sent": sent,
+                "packets_received": received,
+                "loss_fraction": 1 - received / sent if sent else 0.0,
+                "packets_per_second": received / measured["elapsed_s"],
+                "jitter_ms_mean": receive["jitter_ms_mean"],
+                "frames_played": receive["frames_played"],
+                "frames_concealed": receive["frames_concealed"],
+                "concealed_fraction": receive["frames_concealed"] / frames if frames else 0.0,
+                "underruns": receive["underruns"],
+                "send_lateness_ms_max": max((h.stats["late_max_ms"] for h in self.handles), default=0.0),
+            },
+            "cpu": {
+                "client_s": measured["client_cpu_s"],
+                "client_ms_per_call": measured["client_cpu_s"] * 1000 / calls if calls else None,
+                "server_s": server_cpu,
+                "server_ms_per_call": server_cpu * 1000 / calls if calls and server_cpu is not None else None,
+            },
+            "server": server_stats,
+        }
+
+def children_cpu():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SIP/RTP load generator")
+    parser.add_argument("--rate", type=float, default=20.0, help="call attempts per second")
+    parser.add_argument("--calls", type=int, default=200, help="total calls")
+    parser.add_argument("--concurrency", type=int, default=100, help="max simultaneous calls")
+    parser.add_argument("--hold", type=float, default=3.0, help="hold time / prompt length (s)")
+    parser.add_argument("--workers", type=int, default=1, help="mock server processes")
+    parser.add_argument("--no-media", action="store_true", help="signaling only")
+    parser.add_argument("--no-cache", action="store_true", help="encode the prompt per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="mock server INVITE failure rate")
+    parser.add_argument("--delay", type=float, default=0.0, help="mock server response delay (s)")
+    parser.add_argument("--label", default="", help="free-form tag stored with the results")
+    parser.add_argument("--output", default="load_results.jsonl", help="JSON lines file to append to")
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    stop_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    server_options = {"error_rate": args.error_rate, "delay": args.delay}
+    cpu_before = children_cpu()
+    server = multiprocessing.Process(target=_serve,
+                                     args=(args.workers, port, stop_event, results, server_options))
+    server.start()
+    time.sleep(0.5)  # let the workers bind
+
+    with tempfile.TemporaryDirectory() as tmp:
+        audio_file = None
+        cache = None
+        if not args.no_media:
+            audio_file = os.path.join(tmp, "prompt.wav")
+            write_prompt(audio_file, args.hold)
+            if not args.no_cache:
+                cache = MediaCache(os.path.join(tmp, "cache"))
+                cache.get(audio_file)  # warm it before the clock starts
+
+        generator = LoadGenerator(args.rate, args.calls, args.concurrency, args.hold,
+                                  (LOCAL_IP, port), audio_file, cache)
+        print(f"Load test: {args.calls} calls at {args.rate}/s, concurrency {args.concurrency}, "
+              f"hold {args.hold} s, {args.workers} server worker(s)")
+        measured = generator.run()
+
+        stop_event.set()
+        server_stats = results.get()
+        server.join()
+        cpu_after = children_cpu()
+        server_cpu = cpu_after - cpu_before if cpu_before is not None else None
+        report = generator.report(measured, server_stats, server_cpu)
+
+    record = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "label": args.label,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "label")},
+        "results": report,
+    }
+    print(json.dumps(record, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"Appended results to {args.output}")
+    return record
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
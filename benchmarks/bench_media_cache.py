@@ -0,0 +1,73 @@
+'''
+Benchmark for the pre-encoded media cache
+
+Measures playback setup time (getting the first frame ready) and the cost
+of producing every frame of a prompt for:
+    - no cache: read_and_encode_audio per playback
+    - cold cache: encode to a payload file and map it
+    - disk hit: payload file exists, map it
+    - warm cache: already mapped
+
+Run from the repository root:
+    python -m benchmarks.bench_media_cache
+'''
+
+import os
+import tempfile
+import time
+import wave
+import numpy as np
+from audio_handler import read_and_encode_audio
+from media_cache import MediaCache
+
+def write_prompt(path, seconds):
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-8000, 8000, 8000 * seconds, dtype=np.int16)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(8000)
+        wf.writeframes(samples.tobytes())
+
+def timed(label, setup, repeat):
+    """
+    Time setup() to the first frame and to the last frame.
+    """
+    first_total = 0.0
+    full_total = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frames = iter(setup())
+        next(frames)
+        first_total += time.perf_counter() - start
+        for _ in frames:
+            pass
+        full_total += time.perf_counter() - start
+    print(f"{label:<14} first frame {first_total / repeat * 1000:>8.3f} ms   "
+          f"all frames {full_total / repeat * 1000:>8.3f} ms")
+
+def main(seconds=30, repeat=20):
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt = os.path.join(tmp, "prompt.wav")
+        write_prompt(prompt, seconds)
+        cache_dir = os.path.join(tmp, "cache")
+
+        print(f"Media cache benchmark: {seconds} s prompt, {repeat} playbacks\n")
+        timed("no cache", lambda: read_and_encode_audio(prompt), repeat)
+
+        def cold():
+            cache = MediaCache(cache_dir)
+            for name in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, name))
+            return cache.get(prompt).frames()
+        timed("cold cache", cold, repeat)
+
+        timed("disk hit", lambda: MediaCache(cache_dir).get(prompt).frames(), repeat)
+
+        cache = MediaCache(cache_dir)
+        cache.get(prompt)
+        timed("warm cache", lambda: cache.get(prompt).frames(), repeat)
+        print(f"\ncache stats: {cache.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''
+Scaling benchmark for the media worker pool
+
+For each worker count it starts a MediaWorkerPool and opens
+streams-per-worker receive sessions per worker. The pool then streams a
+prompt into every one of them, with both directions placed by the pool.
+From the shared-memory stats it reports:
+    - packets/s handled
+    - the fraction of frames concealed (rises when workers are overloaded)
+    - CPU per worker
+With enough cores, total packets/s should grow about linearly with the
+worker count while per-worker CPU stays flat.
+
+Run from the repository root:
+    python -m benchmarks.bench_media_workers --workers 1,2,4 --streams-per-worker 50
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from config import *
+from media_workers import MediaWorkerPool
+from benchmarks.bench_load import write_prompt
+
+def run(workers, streams_per_worker, seconds, prompt):
+    pool = MediaWorkerPool(workers)
+    pool.start()
+    streams = workers * streams_per_worker
+    receivers = [pool.open_receive(rtcp=False) for _ in range(streams)]
+    cpu_before = [worker["cpu_seconds"] for worker in pool.worker_stats()]
+
+    start = time.monotonic()
+    senders = [pool.start_send(prompt, LOCAL_IP, receiver.port, ssrc=0x1000 + i)
+               for i, receiver in enumerate(receivers)]
+    for sender in senders:
+        sender.wait(seconds + 10)
+    elapsed = time.monotonic() - start
+    time.sleep(0.3)  # let the jitter buffers drain
+
+    for receiver in receivers:
+        pool.close_session(receiver)
+    for receiver in receivers:
+        receiver.wait(5)
+    time.sleep(2 * 0.5)  # one more shared-memory update
+    stats = pool.get_stats()
+    pool.stop()
+
+    totals = stats["totals"]
+    cpu = [worker["cpu_seconds"] - before for worker, before in zip(stats["workers"], cpu_before)]
+    frames = totals["frames_played"] + totals["frames_concealed"]
+    return {
+        "workers": workers,
+        "streams": streams,
+        "packets_received_per_s": totals["packets_received"] / elapsed,
+        "concealed_fraction": totals["frames_concealed"] / frames if frames else 0.0,
+        "cpu_percent_per_worker": [100 * c / elapsed for c in cpu],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Media worker pool scaling benchmark")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}",
+                        help="comma-separated worker counts")
+    parser.add_argument("--streams-per-worker", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    counts = sorted({int(count) for count in args.workers.split(",")})
+    print(f"{os.cpu_count()} CPUs, {args.streams_per_worker} streams per worker, {args.seconds} s")
+    print(f"{'workers':>7} {'streams':>8} {'pkt/s':>10} {'concealed':>10}  cpu% per worker")
+    with tempfile.TemporaryDirectory() as tmp:
+        prompt = os.path.join(tmp, "prompt.wav")
+        write_prompt(prompt, args.seconds)
+        results = []
+        for workers in counts:
+            result = run(workers, args.streams_per_worker, args.seconds, prompt)
+            results.append(result)
+            cpu = " ".join(f"{c:.0f}" for c in result["cpu_percent_per_worker"])
+            print(f"{workers:>7} {result['streams']:>8} {result['packets_received_per_s']:>10,.0f} "
+                  f"{result['concealed_fraction']:>10.2%}  {cpu}")
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,101 @@
+'''
+Headless benchmark of the RTP receive path
+
+Runs N RtpReceiveSessions (jitter buffer, decode, 20 ms playout) on one
+event loop, playing into NullSinks, while one sender task feeds every
+session a 20 ms G.711 frame per tick over loopback. Reports CPU per
+stream, frames played and concealed, and the decode, jitter-buffer wait
+and sink write histograms from metrics. No sound device is needed.
+
+Run from the repository root:
+    python -m benchmarks.bench_receive --streams 50 --seconds 5
+'''
+
+import argparse
+import asyncio
+import socket
+import sys
+import time
+import numpy as np
+import metrics
+from config import *
+from audio_handler import play_rtp_session
+from audio_output import NullSink
+from g711 import PCMU
+from rtp_async import RtpReceiveSession
+from rtp_packet import RtpPacketizer
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((LOCAL_IP, 0))
+        return sock.getsockname()[1]
+
+async def send_streams(ports, seconds, frame_s=0.02):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    packetizers = [RtpPacketizer(0x1000 + i, 0, 160) for i in range(len(ports))]
+    t = np.arange(160) / 8000
+    payload = PCMU.encode((8000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)).tobytes()
+    deadline = loop.time()
+    end = deadline + seconds
+    while deadline < end:
+        for port, packetizer in zip(ports, packetizers):
+            try:
+                sock.sendto(packetizer.packetize(payload), (LOCAL_IP, port))
+            except BlockingIOError:
+                pass
+        deadline += frame_s
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+    sock.close()
+
+async def run(streams, seconds):
+    sessions = []
+    sinks = []
+    for _ in range(streams):
+        session = await RtpReceiveSession(free_port(), host=LOCAL_IP).open()
+        sessions.append(session)
+        sinks.append(NullSink())
+    players = [asyncio.ensure_future(play_rtp_session(session, sink))
+               for session, sink in zip(sessions, sinks)]
+
+    cpu_start = time.process_time()
+    await send_streams([session.port for session in sessions], seconds)
+    await asyncio.sleep(0.2)  # drain what is still buffered
+    cpu = time.process_time() - cpu_start
+
+    for session in sessions:
+        session.close()
+    await asyncio.gather(*players, return_exceptions=True)
+
+    played = sum(sink.stats["frames"] for sink in sinks)
+    jb = [session.jitter_buffer.get_stats() for session in sessions]
+    return {
+        "cpu_s": cpu,
+        "cpu_percent_per_stream": 100 * cpu / seconds / streams,
+        "frames_played": played,
+        "frames_expected": int(streams * seconds / 0.02),
+        "concealed": sum(stats["lost"] + stats["underruns"] for stats in jb),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless RTP receive benchmark")
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    metrics.reset()
+    result = asyncio.run(run(args.streams, args.seconds))
+    print(f"{args.streams} streams for {args.seconds} s: "
+          f"{result['frames_played']}/{result['frames_expected']} frames played, "
+          f"{result['concealed']} concealed")
+    print(f"CPU {result['cpu_s']:.2f} s ({result['cpu_percent_per_stream']:.3f}% of a core per stream)")
+    histograms = metrics.snapshot()["histograms"]
+    for name in ("rtp.decode_ms", "jitter_buffer.wait_ms", "audio.playout_write_ms"):
+        h = histograms.get(name)
+        if h and h["count"]:
+            print(f"  {name:<24} mean {h['mean']:.4f} ms  p99 <= {h['p99']} ms  max {h['max']:.3f} ms")
+    return result
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
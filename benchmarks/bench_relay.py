@@ -0,0 +1,109 @@
+'''
+Forwarding benchmark for the RTP media relay
+
+A MediaRelay runs in its own process with --legs two-leg sessions. The
+parent sends 172-byte RTP packets round-robin to the A leg of every
+session, either paced at 50 packets/s per leg (a real call) or as fast as
+it can (--flat-out), and the relay forwards them to a sink socket. From the
+relay process's CPU time it reports:
+    - packets forwarded per second
+    - forwarded packets per CPU-second of the relay (packets/s per core)
+    - relay CPU use, and drops
+With the paced load, legs x 50 / (packets/s per core) is the number of
+cores a relay box needs for that many legs. Each session holds four
+sockets, so raise ulimit -n for large --legs.
+
+Run from the repository root:
+    python -m benchmarks.bench_relay --legs 1000 --seconds 5 [--flat-out]
+'''
+
+import argparse
+import multiprocessing
+import socket
+import sys
+import time
+from config import *
+from media_relay import MediaRelay
+from rtp_packet import RtpPacketizer
+
+def relay_process(legs, sink, ready, stop_event, results):
+    relay = MediaRelay(LOCAL_IP, RELAY_PORT_BASE, max(RELAY_PORT_COUNT, legs * 4 + 2))
+    ports = [relay.create_session(i, remote_b=sink).leg_a.port for i in range(legs)]
+    ready.put(ports)
+    cpu_start = time.process_time()
+    relay.serve_forever(stop_event)
+    results.put((time.process_time() - cpu_start, relay.get_stats()))
+    relay.close()
+
+def send_load(ports, seconds, flat_out):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+    packetizers = [RtpPacketizer(0x1000 + i, 0, 160) for i in range(len(ports))]
+    addrs = [(LOCAL_IP, port) for port in ports]
+    payload = b'\xff' * 160
+    sent = 0
+    start = time.monotonic()
+    end = start + seconds
+    tick = 0
+    while time.monotonic() < end:
+        for packetizer, addr in zip(packetizers, addrs):
+            try:
+                sock.sendto(packetizer.packetize(payload), addr)
+                sent += 1
+            except OSError:
+                pass
+        tick += 1
+        if not flat_out:
+            delay = start + tick * 0.02 - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    sock.close()
+    return sent, time.monotonic() - start
+
+def run(legs, seconds, flat_out):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind((LOCAL_IP, 0))
+    ready = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=relay_process,
+                                      args=(legs, sink.getsockname(), ready, stop_event, results))
+    process.start()
+    ports = ready.get(timeout=30)
+
+    sent, elapsed = send_load(ports, seconds, flat_out)
+    time.sleep(0.2)
+    stop_event.set()
+    cpu, stats = results.get(timeout=30)
+    process.join()
+    sink.close()
+
+    forwarded = stats["totals"]["packets"]
+    return {
+        "legs": legs,
+        "sent": sent,
+        "forwarded": forwarded,
+        "dropped": stats["totals"]["dropped"],
+        "forwarded_per_s": forwarded / elapsed,
+        "per_core": forwarded / cpu if cpu else 0.0,
+        "cpu_percent": 100 * cpu / elapsed,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Media relay forwarding benchmark")
+    parser.add_argument("--legs", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--flat-out", action="store_true", help="send as fast as possible")
+    args = parser.parse_args(argv)
+
+    result = run(args.legs, args.seconds, args.flat_out)
+    print(f"{result['legs']} legs, {'flat out' if args.flat_out else '50 packets/s per leg'}, "
+          f"{args.seconds} s: {result['forwarded']}/{result['sent']} forwarded, {result['dropped']} dropped")
+    print(f"{result['forwarded_per_s']:,.0f} packets/s, {result['per_core']:,.0f} packets/s per core, "
+          f"relay CPU {result['cpu_percent']:.0f}%")
+    if not args.flat_out and result["per_core"]:
+        print(f"one core carries about {result['per_core'] / 50:,.0f} legs")
+    return result
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
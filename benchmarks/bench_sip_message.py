@@ -0,0 +1,98 @@
+'''
+Micro-benchmark for SIP message parsing and building
+
+Compares the previous line-scanning helpers (decode, splitlines and a scan
+per field) against SipMessage.parse, and the previous INVITE builder (SDP
+rebuilt as a str per call) against sip_client.generate_sip_invite (one
+f-string plus encode, SDP built once), and reports messages/sec.
+
+Run from the repository root:
+    python -m benchmarks.bench_sip_message
+'''
+
+import time
+from config import *
+from sip_client import generate_sdp_body, generate_sip_invite
+from sip_message import SipMessage
+
+def legacy_extract_call_id(msg):
+    """
+    The original mock_sip_server helper, kept for comparison.
+    """
+    for line in msg.splitlines():
+        if line.startswith("Call-ID"):
+            return line.split(" ")[1].strip()
+    return "test123"
+
+def legacy_extract_field(msg, field_name):
+    for line in msg.splitlines():
+        if line.startswith(field_name):
+            return line.split(":", 1)[1].strip()
+    return ""
+
+def legacy_parse(data):
+    message = data.decode()
+    return (message.split(" ", 1)[0], legacy_extract_call_id(message),
+            legacy_extract_field(message, "From"), legacy_extract_field(message, "To"),
+            legacy_extract_field(message, "CSeq"), legacy_extract_field(message, "Via"))
+
+def parse(data):
+    msg = SipMessage.parse(data)
+    return (msg.method, msg.call_id, msg.get("From"), msg.get("To"), msg.get("CSeq"),
+            msg.get("Via"))
+
+def legacy_sdp_body():
+    return (f"v=0\r\n"
+            f"o=- 0 0 IN IP4 {LOCAL_IP}\r\n"
+            f"s=Session\r\n"
+            f"c=IN IP4 {LOCAL_IP}\r\n"
+            f"t=0 0\r\n"
+            f"a=tool:libavformat 58.29.100\r\n"
+            f"a=recvonly\r\n"
+            f"m=audio {RTP_PORT} RTP/AVP {AUDIO_CODEC}\r\n"
+            f"a=rtpmap:{AUDIO_CODEC} PCMU/8000\r\n")
+
+def legacy_invite(to, from_, call_id):
+    """
+    The original f-string INVITE + SDP builders from sip_client, kept for
+    comparison.
+    """
+    sdp = legacy_sdp_body()
+    return (f"INVITE sip:{to}@{LOCAL_IP}:{SIP_PORT} SIP/2.0\r\n"
+            f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n"
+            f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"To: <sip:{to}@{LOCAL_IP}>\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: 1 INVITE\r\n"
+            f"Contact: <sip:{from_}@{LOCAL_IP}:{SIP_PORT}>\r\n"
+            f"Content-Type: application/sdp\r\n"
+            f"Content-Length: {len(sdp)}\r\n\r\n"
+            f"{sdp}").encode()
+
+def build_invite(to, from_, call_id):
+    return generate_sip_invite(to, from_, call_id, generate_sdp_body())
+
+def bench(label, func, args, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {count / elapsed:>12,.0f} msg/s")
+    return elapsed
+
+def main(count=100_000):
+    sdp = generate_sdp_body()
+    invite = generate_sip_invite("bob", "alice", "a84b4c76e66710", sdp)
+    assert legacy_parse(invite) == parse(invite)
+
+    print(f"SIP message benchmark: {count:,} messages, {len(invite)}-byte INVITE\n")
+    legacy = bench("parse (legacy)", legacy_parse, (invite,), count)
+    new = bench("parse (SipMessage)", parse, (invite,), count)
+    print(f"{'speedup':<22} {legacy / new:>12.1f}x\n")
+
+    legacy = bench("build (f-string)", legacy_invite, ("bob", "alice", "a84b4c76e66710"), count)
+    new = bench("build (sip_client)", build_invite, ("bob", "alice", "a84b4c76e66710"), count)
+    print(f"{'speedup':<22} {legacy / new:>12.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+Startup benchmark: import time and resident memory per entry point
+
+Each entry point is imported in a fresh interpreter, several times. The
+report gives the median import time, the whole process wall time, the
+resident set size after the import, and which heavy modules were loaded.
+Signaling-only processes should not load numpy, pyaudio or asyncio at all.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup [--runs 10]
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENTRY_POINTS = {
+    "interpreter": "pass",
+    "signaling": "import sip_client, call_manager, mock_sip_server",
+    "sender": "from rtp_stream import send_rtp_stream; from rtp_scheduler import RtpScheduler; "
+              "from media_cache import MediaCache",
+    "receiver": "from audio_handler import receive_with_jitter_buffer",
+}
+
+HEAVY_MODULES = ("numpy", "pyaudio", "asyncio")
+
+CHILD = '''
+import sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+try:
+    with open("/proc/self/statm") as f:
+        rss = int(f.read().split()[1]) * {page_size}
+except OSError:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+import json
+print(json.dumps({{"import_s": elapsed, "rss": rss,
+                  "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+def measure(code, runs):
+    page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    script = CHILD.format(code=code, page_size=page_size, heavy=HEAVY_MODULES)
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                check=True).stdout
+        wall = time.perf_counter() - start
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["wall_s"] = wall
+        samples.append(sample)
+    return {
+        "import_ms": statistics.median(s["import_s"] for s in samples) * 1000,
+        "process_ms": statistics.median(s["wall_s"] for s in samples) * 1000,
+        "rss_mb": statistics.median(s["rss"] for s in samples) / 2 ** 20,
+        "loaded": samples[-1]["loaded"],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time and RSS per entry point")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print(f"{'entry point':<12} {'import ms':>10} {'process ms':>11} {'RSS MB':>8}  heavy modules")
+    results = {}
+    for name, code in ENTRY_POINTS.items():
+        result = results[name] = measure(code, args.runs)
+        print(f"{name:<12} {result['import_ms']:>10.1f} {result['process_ms']:>11.1f} "
+              f"{result['rss_mb']:>8.1f}  {', '.join(result['loaded']) or '-'}")
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
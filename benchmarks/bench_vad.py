@@ -0,0 +1,78 @@
+'''
+Silence suppression benchmark
+
+Builds a synthetic conversation (talkspurts of a voiced tone alternating
+with pauses of low background noise, about half of the time each), encodes
+it with G.711 and runs it through vad.SilenceSuppressor in each mode. For
+each mode it reports:
+    - VAD cost per frame
+    - packets and bytes sent compared with sending every frame
+    - comfort-noise packets and talkspurts (marker bits)
+
+Run from the repository root:
+    python -m benchmarks.bench_vad [--seconds 60]
+'''
+
+import argparse
+import sys
+import time
+import numpy as np
+from g711 import PCMU
+from rtp_packet import RTP_HEADER_SIZE
+from vad import SilenceSuppressor
+
+def conversation(seconds, seed=0):
+    """
+    int16 PCM at 8 kHz: alternating talkspurts and pauses of 0.3-2 s.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * 8000)
+    pcm = (rng.standard_normal(total) * 32768 * 10 ** (-60 / 20)).astype(np.float32)
+    position = 0
+    talking = True
+    while position < total:
+        length = int(rng.uniform(0.3, 2.0) * 8000)
+        if talking:
+            t = np.arange(min(length, total - position)) / 8000
+            pitch = rng.uniform(100, 250)
+            voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+            pcm[position:position + len(t)] += 6000 * voiced * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t))
+        position += length
+        talking = not talking
+    return np.clip(pcm, -32768, 32767).astype(np.int16)
+
+def run(frames, mode):
+    suppressor = SilenceSuppressor(mode)
+    start = time.perf_counter()
+    packets = sent_bytes = 0
+    for frame in suppressor.process(frames):
+        if frame is None:
+            continue
+        payload = frame[0] if frame.__class__ is tuple else frame
+        packets += 1
+        sent_bytes += RTP_HEADER_SIZE + len(payload)
+    elapsed = time.perf_counter() - start
+    stats = suppressor.get_stats()
+    stats.update(packets=packets, bytes=sent_bytes, us_per_frame=elapsed / len(frames) * 1e6)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Silence suppression benchmark")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    pcm = conversation(args.seconds)
+    frames = [PCMU.encode(pcm[i:i + 160]).tobytes() for i in range(0, len(pcm) - 159, 160)]
+    full_bytes = len(frames) * (RTP_HEADER_SIZE + 160)
+    print(f"{args.seconds:.0f} s conversation, {len(frames)} frames, "
+          f"{full_bytes} RTP bytes without suppression")
+    print(f"{'mode':<9} {'us/frame':>9} {'packets':>8} {'bytes':>8} {'saved':>7} {'cn':>5} {'spurts':>7}")
+    results = {}
+    for mode in ("suppress", "cn"):
+        result = results[mode] = run(frames, mode)
+        print(f"{mode:<9} {result['us_per_frame']:>9.2f} {result['packets']:>8} {result['bytes']:>8} "
+              f"{1 - result['bytes'] / full_bytes:>7.1%} {result['cn_packets']:>5} {result['talkspurts']:>7}")
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
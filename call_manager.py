@@ -0,0 +1,603 @@
+'''
+Concurrent SIP user agent: many dialogs over one socket
+
+A CallManager owns a single UDP socket and a single thread. Outgoing calls
+are Dialog objects; every request sent on their behalf is a
+ClientTransaction identified by its Via branch. Incoming datagrams are
+parsed once and dispatched:
+    - responses by Via branch to their transaction (falling back to
+      Call-ID + CSeq method for peers that don't echo Via)
+    - requests by Call-ID and tag to their dialog
+
+Retransmission and timeouts follow RFC 3261 section 17.1 for UDP:
+    Timer A  INVITE retransmit, starts at T1 and doubles
+    Timer B  INVITE transaction timeout, 64*T1
+    Timer D  wait for retransmitted INVITE final responses, 32 s
+    Timer E  non-INVITE retransmit, doubles up to T2
+    Timer F  non-INVITE transaction timeout, 64*T1
+    Timer K  wait for retransmitted non-INVITE responses, T4
+All of them live in one TimerHeap that the socket thread services between
+reads, so no thread ever sleeps on behalf of a call.
+'''
+
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+import uuid
+from config import *
+from sip_message import SipMessage
+
+T1 = 0.5   # RTT estimate
+T2 = 4.0   # maximum non-INVITE retransmit interval
+T4 = 5.0   # maximum time a message stays in the network
+TIMER_B = 64 * T1
+TIMER_D = 32.0
+TIMER_F = 64 * T1
+TIMER_K = T4
+
+MAX_DATAGRAM = 65535
+
+SDP_CONTENT_TYPE = "Content-Type: application/sdp\r\n"
+
+def format_request(method, uri, via_host, branch, from_header, to_header, call_id, cseq, user,
+                   body=b''):
+    """
+    Serialize a request (bytes). body is an SDP payload, or empty.
+    """
+    return (f"{method} {uri} SIP/2.0\r\n"
+            f"Via: SIP/2.0/UDP {via_host};branch={branch}\r\n"
+            f"Max-Forwards: 70\r\n"
+            f"From: {from_header}\r\n"
+            f"To: {to_header}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: {cseq} {method}\r\n"
+            f"Contact: <sip:{user}@{via_host}>\r\n"
+            f"{SDP_CONTENT_TYPE if body else ''}"
+            f"Content-Length: {len(body)}\r\n\r\n").encode('utf-8') + body
+
+def format_response(status_code, reason, via, from_header, to_header, call_id, cseq, body=b''):
+    """
+    Serialize a response (bytes). via holds the complete Via header lines
+    copied from the request; body is an SDP payload, or empty.
+    """
+    return (f"SIP/2.0 {status_code} {reason}\r\n"
+            f"{via}"
+            f"From: {from_header}\r\n"
+            f"To: {to_header}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: {cseq}\r\n"
+            f"{SDP_CONTENT_TYPE if body else ''}"
+            f"Content-Length: {len(body)}\r\n\r\n").encode('utf-8') + body
+
+def build_sdp_offer(ip=LOCAL_IP, rtp_port=RTP_PORT, payload_type=PAYLOAD_TYPE, codec=AUDIO_CODEC):
+    """
+    Build a minimal audio SDP offer (bytes).
+    """
+    return (f"v=0\r\n"
+            f"o=- 0 0 IN IP4 {ip}\r\n"
+            f"s=Session\r\n"
+            f"c=IN IP4 {ip}\r\n"
+            f"t=0 0\r\n"
+            f"m=audio {rtp_port} RTP/AVP {payload_type} {CN_PAYLOAD_TYPE}\r\n"
+            f"a=rtpmap:{payload_type} {codec}/8000\r\n"
+            f"a=rtpmap:{CN_PAYLOAD_TYPE} CN/8000\r\n").encode('utf-8')
+
+def new_branch():
+    return f"z9hG4bK{uuid.uuid4().hex[:16]}"
+
+def new_tag():
+    return uuid.uuid4().hex[:10]
+
+class Timer:
+    """
+    One scheduled callback. Cancelling only flags it; the heap drops it
+    when it comes due.
+    """
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class TimerHeap:
+    """
+    Deadline-ordered timers serviced by whichever thread calls run_due().
+    """
+    def __init__(self):
+        self._heap = []
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, delay, callback, *args):
+        """
+        Run callback(*args) delay seconds from now.
+
+        Returns:
+            Timer: Handle that can be cancelled.
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heapq.heappush(self._heap, (timer.deadline, next(self._ids), timer))
+        return timer
+
+    def run_due(self, now=None):
+        """
+        Fire every timer that is due.
+
+        Returns:
+            float: Seconds until the next timer, or None if there is none.
+        """
+        heap = self._heap
+        if now is None:
+            now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        return max(0.0, heap[0][0] - now) if heap else None
+
+class ClientTransaction:
+    """
+    An INVITE or non-INVITE client transaction over UDP.
+    """
+    def __init__(self, branch, method, request, addr, dialog):
+        self.branch = branch
+        self.method = method
+        self.request = request
+        self.addr = addr
+        self.dialog = dialog
+        self.state = "calling" if method == "INVITE" else "trying"
+        self.interval = T1
+        self.ack = None  # ACK for a non-2xx final response (same branch)
+        self.retransmit_timer = None
+        self.timeout_timer = None
+
+    @property
+    def is_invite(self):
+        return self.method == "INVITE"
+
+class Dialog:
+    """
+    One outgoing call, from INVITE to the end of the dialog.
+
+    States: calling -> proceeding -> confirmed -> terminating -> terminated,
+    or calling/proceeding -> failed.
+    """
+    def __init__(self, to, from_, remote_addr, call_id=None, sdp=None,
+                 on_established=None, on_ended=None, duration=None):
+        self.to = to
+        self.from_ = from_
+        self.remote_addr = remote_addr
+        self.call_id = call_id or str(uuid.uuid4())
+        self.local_tag = new_tag()
+        self.remote_tag = None
+        self.cseq = 1
+        self.sdp = sdp
+        self.remote_sdp = b''
+        self.on_established = on_established
+        self.on_ended = on_ended
+        self.duration = duration
+
+        self.state = "calling"
+        self.status_code = None
+        self.reason = None
+        self.ack = None
+        self.hangup_pending = False
+        self.hangup_timer = None
+
+        self.invite_sent_at = None
+        self.established_at = None
+        self.ended_at = None
+        self.ended = threading.Event()
+
+    @property
+    def setup_latency(self):
+        """
+        Seconds from the first INVITE to the 2xx, or None if not established.
+        """
+        if self.established_at is None:
+            return None
+        return self.established_at - self.invite_sent_at
+
+    @property
+    def request_uri(self):
+        return f"sip:{self.to}@{self.remote_addr[0]}:{self.remote_addr[1]}"
+
+    @property
+    def from_header(self):
+        return f"<sip:{self.from_}@{LOCAL_IP}>;tag={self.local_tag}"
+
+    @property
+    def to_header(self):
+        to = f"<sip:{self.to}@{self.remote_addr[0]}>"
+        return f"{to};tag={self.remote_tag}" if self.remote_tag else to
+
+    def wait(self, timeout=None):
+        """
+        Block until the dialog has ended (or failed).
+        """
+        return self.ended.wait(timeout)
+
+class CallManager:
+    def __init__(self, local_ip=LOCAL_IP, port=0, sock=None):
+        """
+        Args:
+            local_ip (str): Address to bind and advertise in Via/Contact.
+            port (int): SIP port to bind; 0 picks a free one.
+            sock (socket.socket): Already bound UDP socket to use instead.
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((local_ip, port))
+        sock.setblocking(False)
+        self.sock = sock
+        self.local_ip = local_ip
+        self.port = sock.getsockname()[1]
+        self.via_host = f"{local_ip}:{self.port}"
+
+        self.timers = TimerHeap()
+        self._transactions = {}  # branch -> ClientTransaction
+        self._dialogs = {}       # Call-ID -> Dialog
+        self._lock = threading.RLock()
+        self._running = False
+        self._thread = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+
+        self.stats = {
+            "calls": 0,
+            "established": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "retransmissions": 0,
+            "messages_received": 0,
+            "unmatched": 0,
+        }
+        self.setup_latencies = []  # seconds, one per established dialog
+
+    def start(self):
+        """
+        Start the socket/timer thread.
+        """
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="sip-call-manager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the thread and close the socket. Dialogs are left as they are.
+        """
+        with self._lock:
+            self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+        self.sock.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def place_call(self, to, from_, remote_addr=(LOCAL_IP, SIP_PORT), call_id=None, sdp=None,
+                   on_established=None, on_ended=None, duration=None):
+        """
+        Send an INVITE and return the new dialog immediately.
+
+        Args:
+            to (str): User part of the request URI.
+            from_ (str): Local user name.
+            remote_addr (tuple): (ip, port) of the remote SIP endpoint.
+            call_id (str): Call-ID to use; generated if None.
+            sdp (bytes): SDP offer; a default PCMU offer if None.
+            on_established (callable): Called with the dialog on 2xx.
+            on_ended (callable): Called with the dialog once it is over.
+            duration (float): Hang up this many seconds after the 2xx.
+
+        Callbacks run on the manager thread and must not block.
+
+        Returns:
+            Dialog: The dialog, in state "calling".
+        """
+        dialog = Dialog(to, from_, remote_addr, call_id, sdp or build_sdp_offer(self.local_ip),
+                        on_established, on_ended, duration)
+        with self._lock:
+            self._dialogs[dialog.call_id] = dialog
+            self.stats["calls"] += 1
+            dialog.invite_sent_at = time.monotonic()
+            self._send_request(dialog, "INVITE", dialog.sdp)
+        self._wake()
+        return dialog
+
+    def hangup(self, dialog):
+        """
+        Send BYE for an established dialog. A dialog still being set up is
+        hung up as soon as it is established.
+        """
+        with self._lock:
+            if dialog.state == "confirmed":
+                self._send_bye(dialog)
+            elif dialog.state in ("calling", "proceeding"):
+                dialog.hangup_pending = True
+        self._wake()
+
+    def active_dialogs(self):
+        with self._lock:
+            return len(self._dialogs)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["active_dialogs"] = len(self._dialogs)
+            stats["active_transactions"] = len(self._transactions)
+            return stats
+
+    # --- sending ---------------------------------------------------------
+
+    def _sendto(self, data, addr):
+        try:
+            self.sock.sendto(data, addr)
+        except OSError as e:
+            # Retransmission timers cover a dropped send
+            print(f"Error sending SIP message to {addr}: {e}")
+
+    def _build_request(self, dialog, method, branch, cseq, body=b''):
+        return format_request(method, dialog.request_uri, self.via_host, branch, dialog.from_header,
+                              dialog.to_header, dialog.call_id, cseq, dialog.from_, body)
+
+    def _send_request(self, dialog, method, body=b''):
+        branch = new_branch()
+        request = self._build_request(dialog, method, branch, dialog.cseq, body)
+        tx = ClientTransaction(branch, method, request, dialog.remote_addr, dialog)
+        self._transactions[branch] = tx
+        self._sendto(request, tx.addr)
+        tx.retransmit_timer = self.timers.schedule(T1, self._on_retransmit, tx)
+        tx.timeout_timer = self.timers.schedule(TIMER_B if tx.is_invite else TIMER_F,
+                                                self._on_timeout, tx)
+        return tx
+
+    def _send_bye(self, dialog):
+        if dialog.hangup_timer is not None:
+            dialog.hangup_timer.cancel()
+        dialog.state = "terminating"
+        dialog.cseq += 1
+        self._send_request(dialog, "BYE")
+
+    def _wake(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except OSError:
+            pass
+
+    # --- timers ----------------------------------------------------------
+
+    def _on_retransmit(self, tx):
+        # Timer A (INVITE, calling) or Timer E (non-INVITE, trying/proceeding)
+        if tx.is_invite:
+            if tx.state != "calling":
+                return
+            tx.interval *= 2
+        else:
+            if tx.state not in ("trying", "proceeding"):
+                return
+            tx.interval = T2 if tx.state == "proceeding" else min(tx.interval * 2, T2)
+        self._sendto(tx.request, tx.addr)
+        self.stats["retransmissions"] += 1
+        tx.retransmit_timer = self.timers.schedule(tx.interval, self._on_retransmit, tx)
+
+    def _on_timeout(self, tx):
+        # Timer B / Timer F
+        if tx.state in ("completed", "terminated"):
+            return
+        self._terminate_transaction(tx)
+        self.stats["timeouts"] += 1
+        dialog = tx.dialog
+        if tx.is_invite:
+            self._fail(dialog, 408, "Request Timeout")
+        else:
+            self._end(dialog)
+
+    def _terminate_transaction(self, tx):
+        tx.state = "terminated"
+        if tx.retransmit_timer is not None:
+            tx.retransmit_timer.cancel()
+        if tx.timeout_timer is not None:
+            tx.timeout_timer.cancel()
+        self._transactions.pop(tx.branch, None)
+
+    # --- dialog state ----------------------------------------------------
+
+    def _established(self, dialog, response):
+        dialog.state = "confirmed"
+        dialog.remote_tag = response.to_tag
+        dialog.remote_sdp = response.raw_body
+        dialog.status_code = response.status_code
+        dialog.established_at = time.monotonic()
+        self.stats["established"] += 1
+        self.setup_latencies.append(dialog.setup_latency)
+
+        # The ACK for a 2xx is its own transaction-less request
+        dialog.ack = self._build_request(dialog, "ACK", new_branch(), dialog.cseq)
+        self._sendto(dialog.ack, dialog.remote_addr)
+
+        if dialog.on_established:
+            dialog.on_established(dialog)
+        if dialog.hangup_pending:
+            self._send_bye(dialog)
+        elif dialog.duration is not None and dialog.state == "confirmed":
+            dialog.hangup_timer = self.timers.schedule(dialog.duration, self.hangup, dialog)
+
+    def _fail(self, dialog, status_code, reason):
+        if dialog.state in ("failed", "terminated"):
+            return
+        dialog.status_code = status_code
+        dialog.reason = reason
+        self.stats["failed"] += 1
+        self._finish(dialog, "failed")
+
+    def _end(self, dialog):
+        if dialog.state in ("failed", "terminated"):
+            return
+        self._finish(dialog, "terminated")
+
+    def _finish(self, dialog, state):
+        dialog.state = state
+        dialog.ended_at = time.monotonic()
+        if dialog.hangup_timer is not None:
+            dialog.hangup_timer.cancel()
+        # Keep the dialog around long enough to re-ACK a retransmitted 2xx
+        self.timers.schedule(TIMER_B, self._forget, dialog)
+        dialog.ended.set()
+        if dialog.on_ended:
+            dialog.on_ended(dialog)
+
+    def _forget(self, dialog):
+        if self._dialogs.get(dialog.call_id) is dialog:
+            del self._dialogs[dialog.call_id]
+
+    # --- receiving -------------------------------------------------------
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        try:
+            while True:
+                with self._lock:
+                    if not self._running:
+                        return
+                    timeout = self.timers.run_due()
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is self._wakeup_r:
+                        try:
+                            while self._wakeup_r.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self._drain_socket()
+        finally:
+            selector.close()
+
+    def _drain_socket(self):
+        # Read the whole burst before going back to select()
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # e.g. ICMP port unreachable reported on Windows
+                print(f"Error receiving SIP message: {e}")
+                return
+            with self._lock:
+                self.stats["messages_received"] += 1
+                try:
+                    message = SipMessage.parse(data)
+                except ValueError as e:
+                    print(f"Dropping malformed SIP message from {addr}: {e}")
+                    continue
+                if message.is_response:
+                    self._on_response(message)
+                else:
+                    self._on_request(message, addr)
+
+    def _match_transaction(self, response):
+        tx = self._transactions.get(response.branch)
+        if tx is not None:
+            return tx
+        # Peer didn't echo our Via; fall back to Call-ID + CSeq method
+        dialog = self._dialogs.get(response.call_id)
+        if dialog is None:
+            return None
+        _, method = response.cseq
+        for tx in self._transactions.values():
+            if tx.dialog is dialog and tx.method == method:
+                return tx
+        return None
+
+    def _on_response(self, response):
+        tx = self._match_transaction(response)
+        code = response.status_code
+        if tx is None:
+            dialog = self._dialogs.get(response.call_id)
+            if dialog is not None and dialog.ack is not None and 200 <= code < 300:
+                # Retransmitted 2xx: the ACK was lost, send it again
+                self._sendto(dialog.ack, dialog.remote_addr)
+            else:
+                self.stats["unmatched"] += 1
+            return
+
+        dialog = tx.dialog
+        if tx.is_invite:
+            self._on_invite_response(tx, dialog, response, code)
+        elif code >= 200 and tx.state in ("trying", "proceeding"):
+            tx.state = "completed"
+            tx.retransmit_timer.cancel()
+            tx.timeout_timer.cancel()
+            self.timers.schedule(TIMER_K, self._terminate_transaction, tx)
+            if tx.method == "BYE":
+                self._end(dialog)
+        elif code < 200 and tx.state == "trying":
+            # A provisional after the final response must not reopen the
+            # transaction (RFC 3261 17.1.2.2)
+            tx.state = "proceeding"
+
+    def _on_invite_response(self, tx, dialog, response, code):
+        if code < 200:
+            if tx.state == "calling":
+                tx.state = "proceeding"
+                tx.retransmit_timer.cancel()  # Timer A stops on any provisional
+                dialog.state = "proceeding"
+        elif code < 300:
+            # 2xx ends the client transaction; the dialog takes over
+            self._terminate_transaction(tx)
+            self._established(dialog, response)
+        elif tx.state in ("calling", "proceeding"):
+            tx.state = "completed"
+            tx.retransmit_timer.cancel()
+            tx.timeout_timer.cancel()
+            dialog.remote_tag = response.to_tag
+            tx.ack = self._build_request(dialog, "ACK", tx.branch, dialog.cseq)
+            self._sendto(tx.ack, tx.addr)
+            self.timers.schedule(TIMER_D, self._terminate_transaction, tx)
+            self._fail(dialog, code, response.reason)
+        elif tx.ack is not None:
+            # Retransmitted final response while completed
+            self._sendto(tx.ack, tx.addr)
+
+    def _on_request(self, request, addr):
+        method = request.method
+        if method == "ACK":
+            return
+        dialog = self._dialogs.get(request.call_id)
+        if method == "BYE" and dialog is not None and request.to_tag == dialog.local_tag:
+            self._respond(request, addr, 200, "OK")
+            self._end(dialog)
+        elif method == "OPTIONS":
+            self._respond(request, addr, 200, "OK")
+        elif method == "INVITE" and dialog is None:
+            # Outbound-only user agent
+            self._respond(request, addr, 486, "Busy Here")
+        else:
+            self._respond(request, addr, 481, "Call/Transaction Does Not Exist")
+
+    def _respond(self, request, addr, status_code, reason):
+        to_header = request.get("To", "")
+        if request.to_tag is None:
+            to_header = f"{to_header};tag={new_tag()}"
+        via = "".join(f"Via: {value}\r\n" for value in request.get_all("Via"))
+        response = format_response(status_code, reason, via, request.get("From", ""), to_header,
+                                   request.call_id or "", request.get("CSeq", ""))
+        self._sendto(response, addr)
@@ -0,0 +1,293 @@
+'''
+N-party conference mixing
+
+ConferenceMixer does one 20 ms tick for all participants with a handful of
+whole-matrix NumPy operations:
+    1. every participant's G.711 payload is a row of one uint8 matrix,
+       decoded in a single np.take (participants without a frame are zero
+       rows)
+    2. the total mix is one column sum (int32, no overflow)
+    3. each participant's "everyone but me" mix is total - own row,
+       saturated to int16
+    4. all outputs are re-encoded in one batched np.take
+The cost is O(N) per tick instead of the O(N^2) of summing every other
+participant per listener.
+
+ConferenceBridge puts the mixer on the network: one UDP socket on the
+asyncio loop, a jitter buffer per participant (keyed by source address),
+and a 20 ms tick against absolute deadlines that sends every participant
+its own mix.
+'''
+
+import asyncio
+import random
+import time
+import numpy as np
+from config import *
+from g711 import get_codec
+from jitter_buffer import JitterBuffer
+from rtp_async import open_endpoint
+from rtp_packet import RtpPacket, RtpPacketizer
+
+class ConferenceMixer:
+    def __init__(self, frame_samples=160, capacity=16, codec=AUDIO_CODEC):
+        """
+        Args:
+            frame_samples (int): Samples per 20 ms frame.
+            capacity (int): Initial number of participant rows (grows as needed).
+            codec (str): Default G.711 codec for participants.
+        """
+        self.frame_samples = frame_samples
+        self.codec = get_codec(codec)
+        self._rows = {}        # participant id -> row
+        self._free_rows = []
+        self._used = 0         # rows [0, _used) have ever been assigned
+        self._single_codec = True
+        self._allocate(capacity)
+        self.ticks = 0
+
+    def _allocate(self, capacity):
+        fs = self.frame_samples
+        old_used = getattr(self, '_used', 0)
+        encoded = np.zeros((capacity, fs), dtype=np.uint8)        # input payloads
+        has_frame = np.zeros(capacity, dtype=bool)
+        if old_used:
+            # Growing mid-tick: keep the frames already put
+            encoded[:old_used] = self._encoded[:old_used]
+            has_frame[:old_used] = self._has_frame[:old_used]
+        self._encoded = encoded
+        self._has_frame = has_frame
+        self._pcm = np.zeros((capacity, fs), dtype=np.int16)      # decoded input
+        self._mixed = np.zeros((capacity, fs), dtype=np.int32)    # total - own row
+        self._out = np.zeros((capacity, fs), dtype=np.int16)      # saturated mix
+        self._out_encoded = np.zeros((capacity, fs), dtype=np.uint8)
+        row_codecs = getattr(self, '_row_codecs', [])
+        self._row_codecs = row_codecs + [None] * (capacity - len(row_codecs))
+        self.capacity = capacity
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add_participant(self, participant_id, codec=None):
+        """
+        Give a participant a row. Returns the row index.
+        """
+        if participant_id in self._rows:
+            return self._rows[participant_id]
+        codec = get_codec(codec) if codec is not None else self.codec
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            if self._used == self.capacity:
+                self._allocate(self.capacity * 2)
+            row = self._used
+            self._used += 1
+        self._rows[participant_id] = row
+        self._row_codecs[row] = codec
+        self._has_frame[row] = False
+        self._update_codec_groups()
+        return row
+
+    def remove_participant(self, participant_id):
+        row = self._rows.pop(participant_id, None)
+        if row is None:
+            return
+        self._row_codecs[row] = None
+        self._has_frame[row] = False
+        self._free_rows.append(row)
+        self._update_codec_groups()
+
+    def _update_codec_groups(self):
+        codecs = {codec for codec in self._row_codecs[:self._used] if codec is not None}
+        self._single_codec = len(codecs) <= 1
+        if self._single_codec:
+            self._groups = None
+            if codecs:
+                self.codec = codecs.pop()
+        else:
+            groups = {}
+            for row, codec in enumerate(self._row_codecs[:self._used]):
+                if codec is not None:
+                    groups.setdefault(codec, []).append(row)
+            self._groups = [(codec, np.array(rows)) for codec, rows in groups.items()]
+
+    def put_frame(self, participant_id, payload):
+        """
+        Set a participant's encoded frame for this tick. Participants that
+        send nothing this tick are mixed as silence.
+        """
+        row = self._rows[participant_id]
+        self._encoded[row] = np.frombuffer(payload, dtype=np.uint8)
+        self._has_frame[row] = True
+
+    def mix(self):
+        """
+        Mix one tick. Afterwards mixed_frame() returns each participant's
+        encoded mix; all input frames are cleared.
+        """
+        n = self._used
+        if n == 0:
+            return
+        pcm = self._pcm[:n]
+        has_frame = self._has_frame[:n]
+
+        # 1. Decode every row at once
+        if self._single_codec:
+            self.codec.decode(self._encoded[:n], out=pcm)
+        else:
+            for codec, rows in self._groups:
+                pcm[rows] = codec.decode(self._encoded[rows])
+        pcm[~has_frame] = 0
+
+        # 2-3. Total once, then everyone-but-me with saturation
+        total = pcm.sum(axis=0, dtype=np.int32)
+        mixed = self._mixed[:n]
+        np.subtract(total, pcm, out=mixed)
+        np.clip(mixed, -32768, 32767, out=mixed)
+        out = self._out[:n]
+        np.copyto(out, mixed, casting='unsafe')
+
+        # 4. Re-encode every row at once
+        if self._single_codec:
+            self.codec.encode(out, out=self._out_encoded[:n])
+        else:
+            for codec, rows in self._groups:
+                self._out_encoded[rows] = codec.encode(out[rows])
+
+        has_frame[:] = False
+        self.ticks += 1
+
+    def mixed_frame(self, participant_id):
+        """
+        The participant's encoded mix from the last tick, as a memoryview
+        (valid until the next mix()).
+        """
+        return self._out_encoded[self._rows[participant_id]].data
+
+    def mixed_pcm(self, participant_id):
+        return self._out[self._rows[participant_id]]
+
+class Participant:
+    def __init__(self, addr, ssrc, codec, frame_duration):
+        self.addr = addr
+        self.codec = codec
+        self.jitter_buffer = JitterBuffer(frame_duration=frame_duration)
+        self.packetizer = RtpPacketizer(ssrc, codec.payload_type, frame_duration * 8)
+        self.packets_received = 0
+        self.packets_sent = 0
+
+class ConferenceBridge:
+    def __init__(self, port, host='0.0.0.0', codec=AUDIO_CODEC, frame_duration=20, auto_join=True):
+        """
+        Args:
+            port (int): RTP port every participant sends to.
+            host (str): Local address to bind.
+            codec (str): Default G.711 codec.
+            frame_duration (int): Tick length in milliseconds.
+            auto_join (bool): Add unknown source addresses as participants.
+        """
+        self.port = port
+        self.host = host
+        self.codec = get_codec(codec)
+        self.frame_duration = frame_duration
+        self.auto_join = auto_join
+        self.mixer = ConferenceMixer(frame_duration * 8, codec=self.codec.name)
+        self.participants = {}  # (ip, port) -> Participant
+        self.transport = None
+        self._packet = RtpPacket()
+        self._closed = False
+
+        self.stats = {
+            "ticks": 0,
+            "late_ticks": 0,
+            "mix_ms_max": 0.0,
+            "mix_ms_total": 0.0,
+            "unknown_sources": 0,
+        }
+
+    async def open(self):
+        self.transport = await open_endpoint(self._on_rtp, (self.host, self.port), name="conference")
+        return self
+
+    def add_participant(self, addr, codec=None, ssrc=None):
+        """
+        Add a participant sending from (and receiving at) addr.
+        """
+        codec = get_codec(codec) if codec is not None else self.codec
+        participant = Participant(addr, ssrc if ssrc is not None else random.getrandbits(32),
+                                  codec, self.frame_duration)
+        self.participants[addr] = participant
+        self.mixer.add_participant(addr, codec.name)
+        return participant
+
+    def remove_participant(self, addr):
+        if self.participants.pop(addr, None) is not None:
+            self.mixer.remove_participant(addr)
+
+    def _on_rtp(self, data, addr):
+        participant = self.participants.get(addr)
+        if participant is None:
+            if not self.auto_join:
+                self.stats["unknown_sources"] += 1
+                return
+            participant = self.add_participant(addr)
+        participant.packets_received += 1
+        participant.jitter_buffer.add_packet(data)
+
+    def tick(self, now=None):
+        """
+        Pull one frame per participant, mix, and send every participant its mix.
+        """
+        mixer = self.mixer
+        packet = self._packet
+        for addr, participant in self.participants.items():
+            ready, data = participant.jitter_buffer.poll(now)
+            if ready and data is not None:
+                try:
+                    mixer.put_frame(addr, packet.unpack(data).payload)
+                except ValueError:
+                    pass
+
+        mix_start = time.perf_counter()
+        mixer.mix()
+        mix_ms = (time.perf_counter() - mix_start) * 1000
+        self.stats["mix_ms_total"] += mix_ms
+        if mix_ms > self.stats["mix_ms_max"]:
+            self.stats["mix_ms_max"] = mix_ms
+
+        if self.transport is not None:
+            for addr, participant in self.participants.items():
+                self.transport.sendto(participant.packetizer.packetize(mixer.mixed_frame(addr)), addr)
+                participant.packets_sent += 1
+        self.stats["ticks"] += 1
+
+    async def run(self):
+        """
+        Tick every frame_duration against absolute loop-time deadlines
+        until close().
+        """
+        loop = asyncio.get_running_loop()
+        frame_s = self.frame_duration / 1000
+        deadline = loop.time()
+        while not self._closed:
+            self.tick()
+            deadline += frame_s
+            now = loop.time()
+            if deadline < now:
+                # Fell behind by more than a tick: skip ahead, don't burst
+                self.stats["late_ticks"] += 1
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["participants"] = len(self.participants)
+        stats["mix_ms_mean"] = stats["mix_ms_total"] / stats["ticks"] if stats["ticks"] else 0.0
+        return stats
+
+    def close(self):
+        self._closed = True
+        if self.transport is not None:
+            self.transport.close()
+        for participant in self.participants.values():
+            participant.jitter_buffer.close()
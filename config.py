@@ -9,4 +9,22 @@ PAYLOAD_TYPE = 0  # PCMU
 SSRC = 12345 # Synchronization source identifier
 LOCAL_IP = "127.0.0.1"
 AUDIO_CODEC = "PCMU"  # G.711 codec
-BUFFER_SIZE = 1024  # Buffer size for SIP
\ No newline at end of file
+BUFFER_SIZE = 1024  # Buffer size for SIP
+MEDIA_CACHE_DIR = ".media_cache"  # Pre-encoded prompt cache
+METRICS_ENABLED = True  # counters, histograms and tracing; False makes them a no-op
+TRACE_SAMPLE_EVERY = 100  # write one trace event in this many
+TRACE_LOG_FILE = "trace_log.txt"
+METRICS_PORT = 9180  # local JSON snapshot endpoint (metrics.serve_http)
+AUDIO_OUTPUT = "pyaudio"  # audio_output sink: pyaudio, pyaudio-callback, null or file
+MEDIA_PORT_BASE = 20000  # first RTP port of media worker 0
+MEDIA_PORTS_PER_WORKER = 1000  # RTP/RTCP port range owned by each media worker
+VAD_MODE = None  # send-side silence suppression: None (off), "suppress" or "cn" (RFC 3389 comfort noise)
+VAD_THRESHOLD_DB = -45.0  # quietest frame level (dBov) that can count as speech
+VAD_HANGOVER_MS = 200  # keep sending this long after speech stops
+CN_PAYLOAD_TYPE = 13  # RFC 3389 comfort noise
+CN_REFRESH_MS = 500  # longest gap between comfort-noise packets
+COMFORT_NOISE_TIMEOUT = 2.0  # receiver stops generating noise this long after the last CN packet
+RELAY_PORT_BASE = 30000  # first RTP port of the media relay (mock_sip_server --relay)
+RELAY_PORT_COUNT = 10000  # relay ports; each call leg uses an RTP/RTCP pair
+UDP_RCVBUF = 1 << 20  # SO_RCVBUF for sockets made by network_util (absorbs bursts)
+UDP_SNDBUF = 1 << 20  # SO_SNDBUF for sockets made by network_util
\ No newline at end of file
@@ -5,26 +5,404 @@ Task to do:
 1. Add Start Call/End Call buttons.
 2. Trigger SIP signaling and RTP Streaming from GUI.
 3. Display real-time logs (call status, packet info).
-'''
 
+Tk is only touched from the main thread. Signaling (CallManager), RTP
+sending (RtpScheduler) and receiving (an asyncio loop thread) all run on
+worker threads. They report through an EventQueue, which is a plain
+thread-safe queue, so posting an event costs a few hundred nanoseconds.
+
+A timed after() callback drains the queue every DRAIN_INTERVAL_MS:
+    - log lines from a batch are inserted into the Text widget with one
+      insert
+    - the widget is trimmed to LOG_LINES, so it never grows
+    - only the newest stats snapshot in a batch is rendered
+A backlog larger than one batch is worked off over the next callbacks, so
+Tk keeps processing input between batches. The stats panel shows packet
+rate per outgoing call, and packet rate, loss and jitter per incoming
+SSRC. A worker thread samples it STATS_INTERVAL apart.
+
+Usage:
+    python gui.py [--to 127.0.0.1] [--audio audio.wav] [--stress 5000]
+'''
 
+import argparse
+import asyncio
+import queue
+import random
+import threading
+import time
 from tkinter import *
+from tkinter import ttk
+from config import *
+from audio_handler import play_rtp_session
+from audio_output import NullSink, open_sink
+from call_manager import CallManager
+from media_cache import MediaCache
+from rtp_async import RtpReceiveSession
+from rtp_packet import RTP_HEADER
+from rtp_scheduler import RtpScheduler
+from sip_client import SDP_BODY, create_call_id
+from sip_message import sdp_media_address
+
+DRAIN_INTERVAL_MS = 50      # how often the UI drains the event queue
+MAX_EVENTS_PER_DRAIN = 5000 # events handled per callback; the rest wait for the next one
+LOG_LINES = 1000            # log ring size
+STATS_INTERVAL = 0.25       # seconds between stats snapshots
+CALL_DURATION = 60          # longest call the GUI places (s)
+
+class EventQueue:
+    """
+    Worker threads post (kind, payload) events; the UI drains them in batches.
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self.posted = 0
+
+    def post(self, kind, payload):
+        self.posted += 1
+        self._queue.put((kind, payload))
+
+    def log(self, text):
+        self.post("log", f"{time.strftime('%H:%M:%S')} {text}")
+
+    def drain(self, max_events):
+        events = []
+        get = self._queue.get_nowait
+        try:
+            for _ in range(max_events):
+                events.append(get())
+        except queue.Empty:
+            pass
+        return events
+
+    def empty(self):
+        return self._queue.empty()
+
+class PacketLog:
+    """
+    Per-packet log lines for the receive session. It hooks into
+    RtpReceiveSession's capture slot and only posts while enabled.
+    """
+    def __init__(self, events):
+        self.events = events
+        self.enabled = False
+
+    def write(self, data, channel, arrival_time=None):
+        if not self.enabled:
+            return
+        if channel == 0 and len(data) >= RTP_HEADER.size:
+            _, _, seq, timestamp, ssrc = RTP_HEADER.unpack_from(data)
+            self.events.post("log", f"rx RTP ssrc={ssrc:08x} seq={seq} ts={timestamp} {len(data)} bytes")
+        else:
+            self.events.post("log", f"rx RTCP {len(data)} bytes")
+
+class CallController:
+    """
+    Worker-side state: calls, outgoing streams and the receive session.
+    Never touches Tk.
+    """
+    def __init__(self, events, rtp_port=RTP_PORT):
+        self.events = events
+        self.rtp_port = rtp_port
+        self.packet_log = PacketLog(events)
+        self.manager = CallManager()
+        self.scheduler = RtpScheduler()
+        self.cache = MediaCache()
+        self.session = None
+        self.calls = {}  # Call-ID -> [dialog, stream handle or None]
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self.manager.start()
+        self.scheduler.start()
+        threading.Thread(target=self._loop.run_forever, name="gui-media", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._receive(), self._loop)
+        threading.Thread(target=self._poll_stats, name="gui-stats", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        self.end_calls()
+        if self.session is not None:
+            self._loop.call_soon_threadsafe(self.session.close)
+        self.scheduler.stop()
+        self.manager.stop()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _receive(self):
+        session = RtpReceiveSession(self.rtp_port, self.rtp_port + 1, capture=self.packet_log)
+        try:
+            await session.open()
+        except OSError as e:
+            self.events.log(f"Cannot receive RTP on port {self.rtp_port}: {e}")
+            return
+        self.session = session
+        try:
+            sink = open_sink(AUDIO_OUTPUT)
+        except Exception as e:
+            self.events.log(f"Audio output unavailable ({e}); received audio is discarded")
+            sink = NullSink()
+        self.events.log(f"Receiving RTP on port {self.rtp_port}")
+        try:
+            await play_rtp_session(session, sink)
+        finally:
+            sink.close()
+
+    def place_call(self, to, audio_file):
+        call_id = create_call_id()
+        events = self.events
+
+        def on_established(dialog):
+            events.log(f"Call {call_id[:8]} established in {dialog.setup_latency * 1000:.1f} ms")
+            ip, port = sdp_media_address(dialog.remote_sdp) or (to, RTP_PORT)
+
+            def on_sent(handle):
+                # Scheduler thread
+                if handle.error is not None:
+                    events.log(f"Call {call_id[:8]}: streaming {audio_file} failed: {handle.error}")
+                self.manager.hangup(dialog)
+
+            # CallManager thread: only hand the already encoded frames over
+            frames = media.frames()
+            suppressor = None
+            if VAD_MODE:
+                from vad import SilenceSuppressor
+                suppressor = SilenceSuppressor(VAD_MODE, AUDIO_CODEC)
+                frames = suppressor.process(frames)
+            handle = self.scheduler.add_stream(frames, ip, port, ssrc=random.getrandbits(32),
+                                               on_complete=on_sent)
+            handle.vad = suppressor
+            with self._lock:
+                if call_id in self.calls:
+                    self.calls[call_id][1] = handle
+
+        def on_ended(dialog):
+            with self._lock:
+                self.calls.pop(call_id, None)
+            if dialog.state == "failed":
+                events.log(f"Call {call_id[:8]} failed: {dialog.status_code} {dialog.reason}")
+            else:
+                events.log(f"Call {call_id[:8]} ended")
+
+        try:
+            # Opens and encodes the prompt now, on this thread. The callbacks
+            # run on the CallManager thread and must not block.
+            media = self.cache.get(audio_file, AUDIO_CODEC)
+        except Exception as e:
+            events.log(f"Cannot stream {audio_file}: {e}")
+            return
+
+        events.log(f"Calling {to} (Call-ID {call_id})")
+        with self._lock:
+            self.calls[call_id] = [None, None]
+        dialog = self.manager.place_call(to, "gui", (to, SIP_PORT), call_id=call_id, sdp=SDP_BODY,
+                                         on_established=on_established, on_ended=on_ended,
+                                         duration=CALL_DURATION)
+        with self._lock:
+            if call_id in self.calls:
+                self.calls[call_id][0] = dialog
+
+    def end_calls(self):
+        with self._lock:
+            dialogs = [dialog for dialog, _ in self.calls.values() if dialog is not None]
+        for dialog in dialogs:
+            self.manager.hangup(dialog)
+
+    def _poll_stats(self):
+        previous = {}
+        last = time.monotonic()
+        while self._running:
+            time.sleep(STATS_INTERVAL)
+            now = time.monotonic()
+            elapsed = now - last
+            last = now
+            rows = []
+            with self._lock:
+                calls = list(self.calls.items())
+            for call_id, (dialog, handle) in calls:
+                sent = handle.stats["packets_sent"] if handle is not None else 0
+                rate = (sent - previous.get(call_id, sent)) / elapsed
+                previous[call_id] = sent
+                state = dialog.state if dialog is not None else "calling"
+                rows.append((f"call {call_id[:8]}", f"tx {state}", f"{rate:.0f}", "", ""))
+            session = self.session
+            if session is not None and session.rtcp is not None:
+                for ssrc, source in session.rtcp.snapshot().items():
+                    key = ("ssrc", ssrc)
+                    received = source["received"]
+                    rate = (received - previous.get(key, received)) / elapsed
+                    previous[key] = received
+                    loss = source["lost"] / source["expected"] if source["expected"] else 0.0
+                    rows.append((f"ssrc {ssrc:08x}", "rx", f"{rate:.0f}", f"{loss:.1%}",
+                                 f"{source['jitter_ms']:.1f} ms"))
+            self.events.post("stats", rows)
+
+class SipClientGui:
+    def __init__(self, root, controller, events, to=LOCAL_IP, audio_file="audio.wav"):
+        self.root = root
+        self.controller = controller
+        self.events = events
+        self._log_line_count = 0
+        self._stats_items = {}
+        self._handled = 0
+        self._rate_start = time.monotonic()
+
+        root.title("SIP Client")
+        root.configure(bg="lightblue")
+        root.resizable(False, False)
+        root.geometry("520x800")
+
+        form = Frame(root, bg="lightblue")
+        form.pack(pady=10)
+        Label(form, text="To", bg="lightblue").grid(row=0, column=0, sticky=W)
+        self.to_entry = Entry(form, width=30)
+        self.to_entry.insert(0, to)
+        self.to_entry.grid(row=0, column=1)
+        Label(form, text="Audio", bg="lightblue").grid(row=1, column=0, sticky=W)
+        self.audio_entry = Entry(form, width=30)
+        self.audio_entry.insert(0, audio_file)
+        self.audio_entry.grid(row=1, column=1)
+
+        # Add buttons for SIP signaling and RTP streaming
+        self.start_call_button = Button(root, text="Start Call", width=20, height=2, bg="green", fg="white",
+                                        command=self.start_call)
+        self.start_call_button.pack(pady=10)
+        self.end_call_button = Button(root, text="End Call", width=20, height=2, bg="red", fg="white",
+                                      command=self.end_call)
+        self.end_call_button.pack(pady=10)
+        self.packet_log_var = BooleanVar(value=False)
+        Checkbutton(root, text="Log every packet", variable=self.packet_log_var, bg="lightblue",
+                    command=self._toggle_packet_log).pack()
+
+        # Live per-stream statistics
+        columns = ("stream", "direction", "pps", "loss", "jitter")
+        self.stats_tree = ttk.Treeview(root, columns=columns, show="headings", height=6)
+        for column, width in zip(columns, (120, 110, 60, 70, 80)):
+            self.stats_tree.heading(column, text=column)
+            self.stats_tree.column(column, width=width, anchor=CENTER)
+        self.stats_tree.pack(pady=10)
+
+        # Add a text area for real-time logs
+        self.log_area = Text(root, width=60, height=20, bg="white", fg="black", state=DISABLED)
+        self.log_area.pack(pady=10)
+        self.status = Label(root, text="", bg="lightblue")
+        self.status.pack()
+
+        self.append_log(["Real-time logs will appear here..."])
+        root.protocol("WM_DELETE_WINDOW", self.close)
+        root.after(DRAIN_INTERVAL_MS, self.drain)
+
+    def start_call(self):
+        to = self.to_entry.get().strip()
+        audio_file = self.audio_entry.get().strip()
+        # place_call only queues the INVITE, but keep even that off the UI thread
+        threading.Thread(target=self.controller.place_call, args=(to, audio_file), daemon=True).start()
+
+    def end_call(self):
+        threading.Thread(target=self.controller.end_calls, daemon=True).start()
+
+    def _toggle_packet_log(self):
+        self.controller.packet_log.enabled = self.packet_log_var.get()
+
+    def drain(self):
+        """
+        Handle one batch of events and schedule the next drain.
+        """
+        started = time.perf_counter()
+        events = self.events.drain(MAX_EVENTS_PER_DRAIN)
+        lines = []
+        stats = None
+        for kind, payload in events:
+            if kind == "log":
+                lines.append(payload)
+            elif kind == "stats":
+                stats = payload  # only the newest snapshot is worth drawing
+        if lines:
+            self.append_log(lines)
+        if stats is not None:
+            self.render_stats(stats)
+
+        self._handled += len(events)
+        now = time.monotonic()
+        if now - self._rate_start >= 1.0:
+            self.status.config(text=f"{self._handled / (now - self._rate_start):,.0f} events/s, "
+                                    f"last batch {len(events)} in {(time.perf_counter() - started) * 1000:.1f} ms")
+            self._handled = 0
+            self._rate_start = now
+        # Work off a backlog quickly, but always go back to the Tk loop in between
+        self.root.after(1 if not self.events.empty() else DRAIN_INTERVAL_MS, self.drain)
+
+    def append_log(self, lines):
+        """
+        Append lines with one insert and trim the widget to LOG_LINES.
+        """
+        log_area = self.log_area
+        log_area.configure(state=NORMAL)
+        if len(lines) >= LOG_LINES:
+            log_area.delete("1.0", END)
+            self._log_line_count = 0
+            lines = lines[-LOG_LINES:]
+        log_area.insert(END, "\n".join(lines) + "\n")
+        self._log_line_count += len(lines)
+        excess = self._log_line_count - LOG_LINES
+        if excess > 0:
+            log_area.delete("1.0", f"{excess + 1}.0")
+            self._log_line_count = LOG_LINES
+        log_area.configure(state=DISABLED)
+        log_area.see(END)
+
+    def render_stats(self, rows):
+        tree = self.stats_tree
+        seen = set()
+        for row in rows:
+            key = row[0]
+            seen.add(key)
+            item = self._stats_items.get(key)
+            if item is None:
+                self._stats_items[key] = tree.insert("", END, values=row)
+            else:
+                tree.item(item, values=row)
+        for key in list(self._stats_items):
+            if key not in seen:
+                tree.delete(self._stats_items.pop(key))
+
+    def close(self):
+        self.controller.stop()
+        self.root.destroy()
+
+def stress(events, rate):
+    """
+    Post rate log events per second, to check the UI stays responsive.
+    """
+    interval = 0.01
+    per_tick = max(1, int(rate * interval))
+    n = 0
+    deadline = time.monotonic()
+    while True:
+        for _ in range(per_tick):
+            n += 1
+            events.post("log", f"stress event {n}")
+        deadline += interval
+        time.sleep(max(0.0, deadline - time.monotonic()))
 
-windows = Tk()
-windows.title("SIP Client")
-windows.configure(bg="lightblue")
-windows.resizable(False, False)
-windows.geometry("400x800")
+def main():
+    parser = argparse.ArgumentParser(description="SIP client GUI")
+    parser.add_argument("--to", default=LOCAL_IP)
+    parser.add_argument("--audio", default="audio.wav")
+    parser.add_argument("--stress", type=int, default=0, help="post this many log events per second")
+    args = parser.parse_args()
 
-# Add buttons for SIP signaling and RTP streaming
-start_call_button = Button(windows, text="Start Call", width=20, height=2, bg="green", fg="white")
-start_call_button.pack(pady=20)
-end_call_button = Button(windows, text="End Call", width=20, height=2, bg="red", fg="white")
-end_call_button.pack(pady=20)
+    events = EventQueue()
+    controller = CallController(events)
+    controller.start()
+    if args.stress:
+        threading.Thread(target=stress, args=(events, args.stress), daemon=True).start()
 
-# Add a text area for real-time logs
-log_area = Text(windows, width=50, height=20, bg="white", fg="black")
-log_area.pack(pady=20)
-log_area.insert(END, "Real-time logs will appear here...\n")
+    windows = Tk()
+    SipClientGui(windows, controller, events, args.to, args.audio)
+    windows.mainloop()
 
-windows.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+'''
+Adaptive RTP jitter buffer
+
+Packets are stored by (extended) RTP sequence number, so late packets are
+put back in order, duplicates are dropped and 16-bit wraparound is handled.
+Playout is driven by a 20 ms clock that runs against absolute monotonic
+deadlines: get_packet() sleeps on a condition variable until the next frame
+is due, so an idle receiver does not burn CPU.
+
+The playout delay adapts to the RFC 3550 interarrival jitter estimate and
+to packets that arrive after their playout time:
+    target delay = clamp(max(frame + JITTER_FACTOR * jitter, late floor),
+                         min_delay, max_delay)
+Reordering hardly moves the jitter estimate, so each late packet sets the
+floor one frame above the current target and holds playout back one frame
+(one concealed frame) so the delay actually grows; the floor then decays by
+LATE_FLOOR_DECAY per frame played. If the buffer runs dry it re-buffers up
+to the target, and if it holds much more audio than the target it discards
+the oldest frame to cut latency.
+
+A sequence jump beyond what the buffer can hold (a sender restart, or a
+new source behind the same port) is not concealed frame by frame. As in
+RFC 3550 appendix A.1, the packet after the jump is held on probation.
+If the next packet follows it in sequence, the buffer drops what it holds
+and resynchronizes on the new numbering; otherwise the stray is dropped.
+'''
+
+import struct
+import threading
+import time
+import metrics
+
+JITTER_FACTOR = 3
+SEQ_MOD = 1 << 16
+MAX_MISORDER = 100  # a packet further behind than this may be a restart
+LATE_FLOOR_DECAY = 0.9995  # per frame played: about 28 s half-life at 20 ms
+
+_RTP_SEQ_TS = struct.Struct('!HI')
+
+WAIT_MS = metrics.histogram("jitter_buffer.wait_ms")  # arrival to playout, per packet
+
+class JitterBuffer:
+    def __init__(self, max_size=50, frame_duration=20, clock_rate=8000, min_delay=20, max_delay=200):
+        """
+        Args:
+            max_size (int): Maximum number of packets held at once.
+            frame_duration (int): Duration of each audio frame in milliseconds.
+            clock_rate (int): RTP timestamp clock rate in Hz.
+            min_delay (int): Lower bound of the playout delay in milliseconds.
+            max_delay (int): Upper bound of the playout delay in milliseconds.
+        """
+        self.max_size = max_size
+        self.frame_duration = frame_duration
+        self.clock_rate = clock_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        self._packets = {}
+        self._arrivals = {}  # extended seq -> arrival time, only while metrics are enabled
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Sequence tracking (extended to 32+ bits to survive wraparound)
+        self._highest_seq = None
+        self._next_seq = None
+        self._probation = None  # (ext_seq, packet, timestamp, arrival) after a jump
+
+        # Playout clock
+        self._playing = False
+        self._prefill_start = 0.0
+        self._next_deadline = 0.0
+
+        # RFC 3550 interarrival jitter, in seconds
+        self._jitter = 0.0
+        self._last_transit = None
+        self._late_floor_ms = 0.0
+        self._stretch = 0  # frames to hold playout back by
+
+        self.stats = {
+            "received": 0,
+            "played": 0,
+            "lost": 0,
+            "late": 0,
+            "duplicates": 0,
+            "overflow": 0,
+            "discarded": 0,
+            "underruns": 0,
+            "stretched": 0,
+            "resyncs": 0,
+        }
+
+    def _extend_seq(self, seq):
+        """
+        Map a 16-bit sequence number onto the extended sequence space.
+        """
+        if self._highest_seq is None:
+            return seq
+        delta = (seq - self._highest_seq) % SEQ_MOD
+        if delta >= SEQ_MOD // 2:
+            delta -= SEQ_MOD
+        return self._highest_seq + delta
+
+    def _update_jitter(self, timestamp, arrival_time):
+        transit = arrival_time - timestamp / self.clock_rate
+        if self._last_transit is not None:
+            d = abs(transit - self._last_transit)
+            # Ignore timestamp jumps (new talkspurt or wrap) larger than a second
+            if d < 1.0:
+                self._jitter += (d - self._jitter) / 16
+        self._last_transit = transit
+
+    @property
+    def jitter_ms(self):
+        return self._jitter * 1000
+
+    @property
+    def target_delay(self):
+        """
+        Current playout delay target in milliseconds.
+        """
+        delay = max(self.frame_duration + JITTER_FACTOR * self.jitter_ms, self._late_floor_ms)
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def _buffered_ms(self):
+        if self._highest_seq is None or self._next_seq is None:
+            return 0
+        return (self._highest_seq - self._next_seq + 1) * self.frame_duration
+
+    def add_packet(self, packet, arrival_time=None):
+        """
+        Add an RTP packet to the jitter buffer.
+        """
+        if len(packet) < 12:
+            return
+        if arrival_time is None:
+            arrival_time = time.monotonic()
+        seq, timestamp = _RTP_SEQ_TS.unpack_from(packet, 2)
+
+        with self._cond:
+            ext_seq = self._extend_seq(seq)
+            self.stats["received"] += 1
+
+            if self._next_seq is not None:
+                jump = ext_seq - self._highest_seq
+                if jump > self.max_size or jump < -MAX_MISORDER:
+                    if not self._probe(ext_seq, packet, timestamp, arrival_time):
+                        return
+                else:
+                    self._probation = None
+
+            if self._next_seq is None:
+                self._next_seq = ext_seq
+            elif ext_seq < self._next_seq:
+                # Its playout time has already passed: buffer deeper
+                self.stats["late"] += 1
+                if self.target_delay + self.frame_duration <= self.max_delay:
+                    self._late_floor_ms = self.target_delay + self.frame_duration
+                    self._stretch += 1
+                return
+            if ext_seq in self._packets:
+                self.stats["duplicates"] += 1
+                return
+
+            self._store(ext_seq, packet, timestamp, arrival_time)
+            while len(self._packets) > self.max_size:
+                if self._packets.pop(self._next_seq, None) is not None:
+                    self.stats["overflow"] += 1
+                self._arrivals.pop(self._next_seq, None)
+                self._next_seq += 1
+
+            self._cond.notify()
+
+    def _store(self, ext_seq, packet, timestamp, arrival_time):
+        self._update_jitter(timestamp, arrival_time)
+        if not self._packets and not self._playing:
+            self._prefill_start = arrival_time
+        self._packets[ext_seq] = packet
+        if metrics.enabled:
+            self._arrivals[ext_seq] = arrival_time
+        if self._highest_seq is None or ext_seq > self._highest_seq:
+            self._highest_seq = ext_seq
+
+    def _probe(self, ext_seq, packet, timestamp, arrival_time):
+        """
+        Handle a packet far outside the current sequence window. Returns
+        True if it confirms the packet on probation, in which case the
+        buffer has been resynchronized and the packet can be stored.
+        """
+        probation = self._probation
+        if probation is None or ext_seq != probation[0] + 1:
+            self._probation = (ext_seq, packet, timestamp, arrival_time)
+            return False
+
+        # Two packets in sequence: the stream really jumped
+        self._probation = None
+        self.stats["resyncs"] += 1
+        self.stats["discarded"] += len(self._packets)
+        self._packets.clear()
+        self._arrivals.clear()
+        self._last_transit = None
+        self._highest_seq = None
+        self._next_seq = probation[0]
+        self._store(*probation)
+        return True
+
+    def __len__(self):
+        with self._cond:
+            return len(self._packets)
+
+    def _start_if_ready(self, now):
+        """
+        Start the playout clock once enough audio is buffered, or once the
+        oldest packet has waited the target delay. Returns the time to wake
+        up and check again (None if the buffer is empty).
+        """
+        if not self._packets:
+            return None
+        wake_at = self._prefill_start + self.target_delay / 1000
+        if self._buffered_ms() >= self.target_delay or now >= wake_at:
+            self._playing = True
+            self._next_deadline = now
+        return wake_at
+
+    def _release_frame(self, now):
+        """
+        Pop the frame that is due now. Returns None for a lost frame or an
+        underrun.
+        """
+        if self._highest_seq < self._next_seq:
+            # Buffer ran dry: stop the clock and build the delay back up
+            self._playing = False
+            self._stretch = 0
+            self.stats["underruns"] += 1
+            return None
+
+        self._late_floor_ms *= LATE_FLOOR_DECAY
+        buffered_ms = self._buffered_ms()
+        if self._stretch:
+            # A packet came in late: hold playout back one frame
+            self._stretch -= 1
+            self.stats["stretched"] += 1
+            return None
+
+        # Trim latency when we hold much more audio than needed
+        if buffered_ms > self.target_delay + 2 * self.frame_duration:
+            if self._packets.pop(self._next_seq, None) is not None:
+                self.stats["discarded"] += 1
+            else:
+                self.stats["lost"] += 1
+            self._arrivals.pop(self._next_seq, None)
+            self._next_seq += 1
+
+        packet = self._packets.pop(self._next_seq, None)
+        if self._arrivals:
+            arrival_time = self._arrivals.pop(self._next_seq, None)
+            if arrival_time is not None and metrics.enabled:
+                WAIT_MS.observe((now - arrival_time) * 1000)
+        self._next_seq += 1
+        if packet is None:
+            self.stats["lost"] += 1
+        else:
+            self.stats["played"] += 1
+        return packet
+
+    def get_packet(self, timeout=None):
+        """
+        Retrieve the next packet when its playout time comes.
+
+        Blocks until the next 20 ms playout deadline. Returns the packet, or
+        None if the frame was lost (the caller should conceal it), the buffer
+        was closed, or no audio arrived within timeout seconds.
+        """
+        frame_s = self.frame_duration / 1000
+        give_up = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            # (Re)buffer until enough audio is queued to cover the jitter
+            while not self._closed and not self._playing:
+                now = time.monotonic()
+                wake_at = self._start_if_ready(now)
+                if self._playing:
+                    break
+                if give_up is not None:
+                    if now >= give_up:
+                        return None
+                    wake_at = give_up if wake_at is None else min(wake_at, give_up)
+                self._cond.wait(None if wake_at is None else wake_at - now)
+
+            # Wait for the playout clock
+            while not self._closed:
+                remaining = self._next_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._closed:
+                return None
+
+            now = time.monotonic()
+            self._next_deadline += frame_s
+            if self._next_deadline < now - frame_s:
+                # The consumer fell behind; don't try to catch up in a burst
+                self._next_deadline = now
+
+            return self._release_frame(now)
+
+    def poll(self, now=None):
+        """
+        Non-blocking playout step for callers that run their own 20 ms clock
+        (e.g. an asyncio loop, or a virtual clock when replaying a capture).
+        Call once per frame.
+
+        Returns:
+            tuple: (ready, packet). ready is False while the buffer is still
+                (re)buffering; otherwise packet is the due packet or None if
+                the frame has to be concealed.
+        """
+        with self._cond:
+            if self._closed:
+                return False, None
+            if now is None:
+                now = time.monotonic()
+            if not self._playing:
+                self._start_if_ready(now)
+                if not self._playing:
+                    return False, None
+            return True, self._release_frame(now)
+
+    def get_stats(self):
+        """
+        Return a snapshot of the buffer counters and delay estimates.
+        """
+        with self._cond:
+            stats = dict(self.stats)
+            stats["jitter_ms"] = self.jitter_ms
+            stats["target_delay_ms"] = self.target_delay
+            stats["buffered_ms"] = self._buffered_ms()
+            return stats
+
+    def close(self):
+        """
+        Wake up any waiting reader and stop playout.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
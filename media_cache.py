@@ -0,0 +1,198 @@
+'''
+Pre-encoded media cache for prompts and announcements
+
+A WAV file is encoded once into a packed payload file (a small header
+followed by fixed-size G.711 frames, the last one padded with silence) and
+then memory-mapped. Frames are served as memoryview slices of the mapping,
+so streaming a cached prompt needs no file reads and no per-frame encoding.
+
+Entries are keyed by (path, mtime, codec, frame duration), so editing a
+prompt transparently produces a new entry. Mapped entries are kept in a
+size-bounded LRU; payload files on disk survive restarts.
+'''
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from config import *
+
+MAGIC = b'G711'
+FILE_HEADER = struct.Struct('!4s4sHI')  # magic, codec name, frame duration, frame size
+
+def _codec_name(codec):
+    # Plain names are normalized without loading the codec tables (and
+    # NumPy), so serving an already encoded prompt never needs them
+    if isinstance(codec, str) and codec.upper() in ("PCMU", "PCMA"):
+        return codec.upper()
+    from g711 import get_codec
+    return get_codec(codec).name
+
+def _iter_frames(view, frame_size, num_frames):
+    # Holds the view (and so the mapping) until the generator is finished
+    for start in range(0, num_frames * frame_size, frame_size):
+        yield view[start:start + frame_size]
+
+class CachedMedia:
+    """
+    One memory-mapped, pre-encoded media file.
+    """
+    def __init__(self, path, codec, frame_duration):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, codec_name, duration, frame_size = FILE_HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or codec_name.rstrip(b'\0').decode() != codec or duration != frame_duration:
+            self._mmap.close()
+            raise ValueError(f"Payload file {path} does not match {codec}/{frame_duration}ms")
+
+        self.path = path
+        self.codec = codec
+        self.frame_duration = frame_duration
+        self.frame_size = frame_size
+        self.view = memoryview(self._mmap)[FILE_HEADER.size:]
+        self.num_frames = len(self.view) // frame_size if frame_size else 0
+        self.nbytes = len(self._mmap)
+
+    def __len__(self):
+        return self.num_frames
+
+    def frame(self, index):
+        start = index * self.frame_size
+        return self.view[start:start + self.frame_size]
+
+    def frames(self):
+        """
+        Return an iterator over every frame as a memoryview slice of the
+        mapping. The view is taken now, not when iteration starts, so the
+        stream survives the entry being evicted or closed in between.
+        """
+        if self.view is None:
+            raise ValueError(f"Cached media {self.path} is closed")
+        return _iter_frames(self.view, self.frame_size, self.num_frames)
+
+    def close(self):
+        """
+        Drop the cache's references to the mapping. Streams that are still
+        iterating hold their own view, and the file is unmapped once the
+        last of them finishes.
+        """
+        self.view = None
+        self._mmap = None
+
+class MediaCache:
+    def __init__(self, cache_dir=MEDIA_CACHE_DIR, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Directory for the packed payload files.
+            max_bytes (int): Upper bound on the total size of mapped entries.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0         # served from a mapped entry
+        self.disk_hits = 0    # payload file existed, only had to be mapped
+        self.misses = 0       # had to read and encode the WAV
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, audio_file, codec, frame_duration):
+        path = os.path.abspath(audio_file)
+        return path, os.stat(path).st_mtime_ns, codec, frame_duration
+
+    def _payload_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.g711")
+
+    def get(self, audio_file, codec=AUDIO_CODEC, frame_duration=20):
+        """
+        Return the cached, memory-mapped encoding of audio_file, encoding
+        it first if needed.
+
+        Returns:
+            CachedMedia: The mapped entry.
+        """
+        codec = _codec_name(codec)
+        key = self._key(audio_file, codec, frame_duration)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        payload_path = self._payload_path(key)
+        if os.path.exists(payload_path):
+            disk_hit = True
+        else:
+            disk_hit = False
+            self._encode_to_file(audio_file, payload_path, codec, frame_duration)
+        entry = CachedMedia(payload_path, codec, frame_duration)
+
+        with self._lock:
+            if disk_hit:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            existing = self._entries.get(key)
+            if existing is not None:
+                # Another thread mapped it first
+                entry.close()
+                return existing
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+        return entry
+
+    def _encode_to_file(self, audio_file, payload_path, codec, frame_duration):
+        from g711 import get_codec
+        from audio_handler import read_and_encode_audio
+        frame_size = frame_duration * 8  # one byte per sample at 8 kHz
+        silence = bytes([get_codec(codec).silence])
+        tmp_path = f"{payload_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(FILE_HEADER.pack(MAGIC, codec.encode(), frame_duration, frame_size))
+            written = 0
+            for encoded_audio in read_and_encode_audio(audio_file, frame_duration, codec):
+                f.write(encoded_audio)
+                written += len(encoded_audio)
+            # Pad the last frame with silence so every frame has the same size
+            if written % frame_size:
+                f.write(silence * (frame_size - written % frame_size))
+        # Atomic publish so concurrent readers never map a partial file
+        os.replace(tmp_path, payload_path)
+
+    def _evict(self):
+        # Caller holds the lock; always keep the newest entry
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
+            entry.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        """
+        Unmap every entry (payload files on disk are kept).
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+            self._bytes = 0
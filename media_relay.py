@@ -0,0 +1,471 @@
+'''
+RTP media relay
+
+Anchors the media of a call on local RTP/RTCP port pairs, so both parties
+send to the relay instead of to each other (NAT traversal, a fixed point
+to record from). Nothing is decoded or transcoded: datagrams received on
+one leg are sent out of the other leg's socket to that leg's remote.
+
+    - Port pairs (even RTP port, RTCP on port + 1) come from a pool.
+    - Each relay session has two legs, or one leg in echo mode, where the
+      media goes back to the party that sent it.
+    - A leg's remote comes from SDP; with latch=True it is replaced by the
+      source of the first packet received (symmetric RTP behind NAT), and
+      datagrams from anywhere else are dropped after that.
+    - Datagrams are received in batches into preallocated buffers and sent
+      on from the same buffers, one recvmmsg and one sendmmsg per batch
+      where available (network_util.DatagramBatch).
+    - The SSRC and sequence number are passed through untouched. They are
+      only rewritten when the source on a leg changes SSRC mid-call, so
+      the far end keeps seeing one continuous stream, and RTCP from that
+      source (SR/RR sender, SDES and BYE SSRCs) is mapped the same way.
+
+MediaRelay either runs its own selector loop (serve_forever) or is attached
+to an existing selector, as MockSipServer does in relay mode.
+'''
+
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+import metrics
+from config import *
+from network_util import DatagramBatch, configure_socket
+from rtcp import RTCP_SR, RTCP_RR, RTCP_SDES, RTCP_BYE, RTCP_HEADER
+
+RELAY_BATCH = 64  # datagrams read from one socket per readiness event
+RELAY_BUFFER_SIZE = 2048
+
+RTP_SEQ_SSRC = struct.Struct('!2xH4xI')
+RTP_SEQ = struct.Struct('!H')
+RTP_SSRC = struct.Struct('!I')
+
+TOTAL_FIELDS = ("packets", "bytes", "rtcp_packets", "rewritten", "dropped", "kernel_drops")
+
+PACKETS_FORWARDED = metrics.counter("relay.packets_forwarded")
+BYTES_FORWARDED = metrics.counter("relay.bytes_forwarded")
+PACKETS_DROPPED = metrics.counter("relay.packets_dropped")
+
+class PortPairPool:
+    def __init__(self, host=LOCAL_IP, port_base=RELAY_PORT_BASE, port_count=RELAY_PORT_COUNT):
+        """
+        Args:
+            host (str): Address to bind the relay sockets on.
+            port_base (int): First port of the range (rounded up to even).
+            port_count (int): Number of ports in the range.
+        """
+        self.host = host
+        first = port_base + (port_base & 1)
+        self._free = deque(range(first, port_base + port_count - 1, 2))
+
+    def __len__(self):
+        return len(self._free)
+
+    def allocate(self):
+        """
+        Bind the next free RTP/RTCP pair. Pairs that are in use by another
+        process are skipped.
+
+        Returns:
+            tuple: (rtp_sock, rtcp_sock), both non-blocking.
+        """
+        for _ in range(len(self._free)):
+            port = self._free.popleft()
+            rtp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rtcp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                rtp_sock.bind((self.host, port))
+                rtcp_sock.bind((self.host, port + 1))
+            except OSError:
+                rtp_sock.close()
+                rtcp_sock.close()
+                self._free.append(port)
+                continue
+            configure_socket(rtp_sock, blocking=False)
+            configure_socket(rtcp_sock, blocking=False)
+            return rtp_sock, rtcp_sock
+        raise OSError("No free relay port pairs")
+
+    def release(self, port):
+        self._free.append(port)
+
+class RelayLeg:
+    """
+    One side of a relayed call: the local port pair the party sends to and
+    the party's address. The rewrite state describes packets received on
+    this leg on their way out of the peer leg.
+    """
+    def __init__(self, rtp_sock, rtcp_sock, remote=None, latch=False):
+        self.rtp_sock = rtp_sock
+        self.rtcp_sock = rtcp_sock
+        self.port = rtp_sock.getsockname()[1]
+        self.remote = None
+        self.remote_rtcp = None
+        self.latch = latch
+        self.latched = False
+        self.rtcp_latched = False
+        self.peer = self
+        if remote is not None:
+            self.set_remote(remote)
+
+        self.in_ssrc = None
+        self.out_ssrc = None
+        self.seq_offset = 0
+        self.last_seq = 0
+        self.rewrite = False
+
+        self.stats = {
+            "packets": 0,
+            "bytes": 0,
+            "rtcp_packets": 0,
+            "rtcp_bytes": 0,
+            "rewritten": 0,
+            "dropped": 0,
+            "kernel_drops": 0,
+        }
+
+    def set_remote(self, remote):
+        """
+        Point the leg at (ip, port); RTCP goes to port + 1.
+        """
+        ip, port = remote
+        self.remote = (ip, port)
+        self.remote_rtcp = (ip, port + 1)
+
+    def switch_source(self, seq, ssrc):
+        """
+        A new SSRC arrived on this leg. The first one is passed through as
+        is; later ones are mapped onto it, continuing its sequence numbers.
+        """
+        if self.in_ssrc is None:
+            self.in_ssrc = self.out_ssrc = ssrc
+            self.last_seq = (seq - 1) & 0xFFFF
+            return
+        self.in_ssrc = ssrc
+        self.seq_offset = (self.last_seq + 1 - seq) & 0xFFFF
+        self.rewrite = self.seq_offset != 0 or ssrc != self.out_ssrc
+
+    def close(self):
+        self.rtp_sock.close()
+        self.rtcp_sock.close()
+
+def _rewrite_rtcp_ssrc(buffer, length, in_ssrc, out_ssrc):
+    """
+    Map in_ssrc to out_ssrc in a compound RTCP packet, in place: the sender
+    SSRC of SR/RR, the SDES chunk SSRCs and the BYE SSRCs. Report blocks
+    describe the other direction and are left alone.
+    """
+    position = 0
+    while position + 8 <= length:
+        first, packet_type, words = RTCP_HEADER.unpack_from(buffer, position)
+        end = min(position + 4 + words * 4, length)
+        if first >> 6 != 2:
+            return
+        if packet_type in (RTCP_SR, RTCP_RR):
+            ssrc_positions = (position + 4,)
+        elif packet_type == RTCP_BYE:
+            ssrc_positions = range(position + 4, min(position + 4 + (first & 0x1F) * 4, end - 3), 4)
+        elif packet_type == RTCP_SDES:
+            ssrc_positions = []
+            chunk = position + 4
+            for _ in range(first & 0x1F):
+                if chunk + 4 > end:
+                    break
+                ssrc_positions.append(chunk)
+                item = chunk + 4
+                # Items are (type, length, text) up to a zero type byte, then
+                # padding to the next 32-bit boundary
+                while item < end and buffer[item] != 0:
+                    item += 2 + (buffer[item + 1] if item + 1 < end else 0)
+                chunk = (item + 4) & ~3
+        else:
+            ssrc_positions = ()
+        for ssrc_position in ssrc_positions:
+            if RTP_SSRC.unpack_from(buffer, ssrc_position)[0] == in_ssrc:
+                RTP_SSRC.pack_into(buffer, ssrc_position, out_ssrc)
+        position += 4 + words * 4
+
+class RelaySession:
+    """
+    The relayed media of one call, keyed by (usually) its Call-ID.
+    """
+    def __init__(self, key, leg_a, leg_b=None):
+        self.key = key
+        self.leg_a = leg_a
+        self.leg_b = leg_b if leg_b is not None else leg_a
+        self.leg_a.peer = self.leg_b
+        self.leg_b.peer = self.leg_a
+        self.created = time.monotonic()
+
+    @property
+    def echo(self):
+        return self.leg_b is self.leg_a
+
+    def legs(self):
+        return (self.leg_a,) if self.echo else (self.leg_a, self.leg_b)
+
+    def get_stats(self):
+        """
+        Counters per direction: "a" is what the A party sent, "b" what the
+        B party sent.
+        """
+        stats = {"duration": time.monotonic() - self.created, "a": dict(self.leg_a.stats)}
+        if not self.echo:
+            stats["b"] = dict(self.leg_b.stats)
+        return stats
+
+class MediaRelay:
+    def __init__(self, host=LOCAL_IP, port_base=RELAY_PORT_BASE, port_count=RELAY_PORT_COUNT,
+                 latch=False, batch=RELAY_BATCH):
+        """
+        Args:
+            host (str): Address to bind the relay ports on (and to put in SDP).
+            port_base (int): First port of the relay range.
+            port_count (int): Number of ports in the range (two per leg).
+            latch (bool): Send each leg's media back to wherever it comes
+                from (symmetric RTP), for parties behind NAT.
+            batch (int): Datagrams read from one socket per syscall.
+        """
+        self.host = host
+        self.latch = latch
+        self.pool = PortPairPool(host, port_base, port_count)
+        self.sessions = {}
+        self.selector = None
+        self._running = False
+
+        self._batch = DatagramBatch(batch, RELAY_BUFFER_SIZE)
+
+        self.stats = {
+            "sessions_created": 0,
+            "sessions_closed": 0,
+            "allocation_failures": 0,
+            "send_errors": 0,
+        }
+        self._closed_totals = dict.fromkeys(TOTAL_FIELDS, 0)
+
+    def attach(self, selector):
+        """
+        Register the relay's sockets (current and future) with selector.
+        The owner of the selector passes each ready key's data to
+        on_readable().
+        """
+        self.selector = selector
+        for session in self.sessions.values():
+            self._register(session)
+
+    def _register(self, session):
+        if self.selector is None:
+            return
+        for leg in session.legs():
+            self.selector.register(leg.rtp_sock, selectors.EVENT_READ, (self, leg, False))
+            self.selector.register(leg.rtcp_sock, selectors.EVENT_READ, (self, leg, True))
+
+    def create_session(self, key, remote_a=None, remote_b=None, echo=False):
+        """
+        Allocate the port pairs for a call.
+
+        Args:
+            key (str): Session key, normally the Call-ID.
+            remote_a (tuple): (ip, port) of the A party's media, from its SDP.
+            remote_b (tuple): (ip, port) of the B party's media.
+            echo (bool): One leg only; media goes back to the A party.
+
+        Returns:
+            RelaySession: The new session. Raises OSError if the pool is empty.
+        """
+        try:
+            leg_a = RelayLeg(*self.pool.allocate(), remote=remote_a, latch=self.latch)
+            leg_b = None
+            if not echo:
+                try:
+                    leg_b = RelayLeg(*self.pool.allocate(), remote=remote_b, latch=self.latch)
+                except OSError:
+                    self._release(leg_a)
+                    raise
+        except OSError:
+            self.stats["allocation_failures"] += 1
+            raise
+        session = self.sessions[key] = RelaySession(key, leg_a, leg_b)
+        self._register(session)
+        self.stats["sessions_created"] += 1
+        return session
+
+    def get_session(self, key):
+        return self.sessions.get(key)
+
+    def close_session(self, key):
+        """
+        Release a session's ports.
+
+        Returns:
+            dict: The session's final stats, or None if it did not exist.
+        """
+        session = self.sessions.pop(key, None)
+        if session is None:
+            return None
+        for leg in session.legs():
+            for name in TOTAL_FIELDS:
+                self._closed_totals[name] += leg.stats[name]
+            self._release(leg)
+        self.stats["sessions_closed"] += 1
+        return session.get_stats()
+
+    def _release(self, leg):
+        if self.selector is not None:
+            for sock in (leg.rtp_sock, leg.rtcp_sock):
+                try:
+                    self.selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+        leg.close()
+        self.pool.release(leg.port)
+
+    def on_readable(self, data):
+        """
+        Handle a ready relay socket, given the selector key's data.
+        """
+        _, leg, rtcp = data
+        if rtcp:
+            self._forward_rtcp(leg)
+        else:
+            self._forward_rtp(leg)
+
+    def _receive_batch(self, sock, leg, rtcp):
+        # Read a batch into the preallocated buffers, latching and filtering
+        # by source address. Returns the slots to forward.
+        batch = self._batch
+        try:
+            count = batch.recv(sock, want_addrs=leg.latch)
+        except OSError:
+            return [], 0
+        if batch.kernel_drops:
+            leg.stats["kernel_drops"] += batch.kernel_drops
+        if not leg.latch:
+            return list(range(count)), 0
+        addrs = batch.addrs
+        slots = []
+        dropped = 0
+        for i in range(count):
+            addr = addrs[i]
+            if rtcp:
+                if not leg.rtcp_latched:
+                    leg.rtcp_latched = True
+                    leg.remote_rtcp = addr
+                elif addr != leg.remote_rtcp:
+                    dropped += 1
+                    continue
+            elif not leg.latched:
+                leg.latched = True
+                leg.remote = addr
+            elif addr != leg.remote:
+                dropped += 1
+                continue
+            slots.append(i)
+        return slots, dropped
+
+    def _send_batch(self, sock, remote, slots):
+        # Returns (sent, bytes sent); what was not sent is dropped
+        if remote is None:
+            return 0, 0
+        try:
+            sent = self._batch.send(sock, remote, slots)
+        except OSError:
+            self.stats["send_errors"] += 1
+            return 0, 0
+        lengths = self._batch.lengths
+        return sent, sum([lengths[i] for i in slots[:sent]])
+
+    def _forward_rtp(self, leg):
+        slots, dropped = self._receive_batch(leg.rtp_sock, leg, False)
+        if not slots:
+            leg.stats["dropped"] += dropped
+            return
+        views = self._batch.views
+        lengths = self._batch.lengths
+        valid = []
+        rewritten = 0
+        for i in slots:
+            buffer = views[i]
+            if lengths[i] < 12 or buffer[0] >> 6 != 2:
+                continue
+            seq, ssrc = RTP_SEQ_SSRC.unpack_from(buffer)
+            if ssrc != leg.in_ssrc:
+                leg.switch_source(seq, ssrc)
+            if leg.rewrite:
+                seq = (seq + leg.seq_offset) & 0xFFFF
+                RTP_SEQ.pack_into(buffer, 2, seq)
+                RTP_SSRC.pack_into(buffer, 8, leg.out_ssrc)
+                rewritten += 1
+            leg.last_seq = seq
+            valid.append(i)
+
+        peer = leg.peer
+        sent, sent_bytes = self._send_batch(peer.rtp_sock, peer.remote, valid)
+        dropped += len(slots) - sent
+        stats = leg.stats
+        stats["packets"] += sent
+        stats["bytes"] += sent_bytes
+        stats["rewritten"] += rewritten
+        stats["dropped"] += dropped
+        if metrics.enabled:
+            PACKETS_FORWARDED.inc(sent)
+            BYTES_FORWARDED.inc(sent_bytes)
+            PACKETS_DROPPED.inc(dropped)
+
+    def _forward_rtcp(self, leg):
+        # RTCP is forwarded as is, unless the RTP from this leg is being
+        # rewritten onto another SSRC
+        slots, dropped = self._receive_batch(leg.rtcp_sock, leg, True)
+        if slots:
+            if leg.rewrite:
+                views = self._batch.views
+                lengths = self._batch.lengths
+                for i in slots:
+                    _rewrite_rtcp_ssrc(views[i], lengths[i], leg.in_ssrc, leg.out_ssrc)
+            peer = leg.peer
+            sent, sent_bytes = self._send_batch(peer.rtcp_sock, peer.remote_rtcp, slots)
+            dropped += len(slots) - sent
+            leg.stats["rtcp_packets"] += sent
+            leg.stats["rtcp_bytes"] += sent_bytes
+        leg.stats["dropped"] += dropped
+
+    def serve_forever(self, stop_event=None):
+        """
+        Run the relay on its own selector until stop() (or stop_event).
+        """
+        selector = selectors.DefaultSelector()
+        self.attach(selector)
+        self._running = True
+        try:
+            while self._running:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                for key, _ in selector.select(0.5):
+                    self.on_readable(key.data)
+        finally:
+            self.selector = None
+            selector.close()
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        for key in list(self.sessions):
+            self.close_session(key)
+
+    def get_stats(self):
+        """
+        Relay-wide counters plus traffic totals over all sessions, open
+        and closed.
+        """
+        stats = dict(self.stats)
+        stats["sessions"] = len(self.sessions)
+        stats["free_port_pairs"] = len(self.pool)
+        totals = dict(self._closed_totals)
+        for session in self.sessions.values():
+            for leg in session.legs():
+                for name in totals:
+                    totals[name] += leg.stats[name]
+        stats["totals"] = totals
+        return stats
@@ -0,0 +1,434 @@
+'''
+Multi-process RTP media worker pool
+
+Encoding, decoding and jitter buffering are CPU-bound. In one interpreter
+the GIL keeps all of them on a single core, so media capacity is spread
+over N worker processes instead. Each worker owns a contiguous range of
+RTP/RTCP port pairs. Each worker runs the ordinary media code on its own
+event loop:
+    - RtpReceiveSession (jitter buffer, decode, optional RTCP and
+      recording)
+    - an RtpScheduler for outgoing prompts, served from a MediaCache
+
+Sessions are sharded by port. The kernel delivers each datagram straight
+to the process that owns its port, so no dispatcher sits in the packet
+path.
+
+The SIP layer talks to the pool through a control pipe per worker.
+open_receive() and start_send() place the session on the least-loaded
+worker, meaning the fewest live sessions, with ties going to the worker
+that has used the least CPU. Workers report their counters (sessions,
+packets, frames, CPU time) into one shared-memory array about twice a
+second. Reading pool stats never goes through the pipes.
+
+Usage:
+    pool = MediaWorkerPool(num_workers=4)
+    pool.start()
+    session = pool.open_receive(rtcp=True)       # session.port, session.rtcp_port
+    pool.start_send("prompt.wav", ip, port, on_complete=...)
+    print(pool.get_stats())
+    pool.stop()
+'''
+
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+from config import *
+
+STAT_FIELDS = ("receive_sessions", "send_streams", "packets_received", "packets_sent",
+               "frames_played", "frames_concealed", "cpu_seconds", "updated")
+NUM_STATS = len(STAT_FIELDS)
+STATS_INTERVAL = 0.5  # seconds between shared-memory updates
+
+class MediaWorker:
+    """
+    The event loop side of one worker process.
+    """
+    def __init__(self, index, conn, shared_stats, first_port, last_port, host):
+        self.index = index
+        self.conn = conn
+        self.shared_stats = shared_stats
+        self.host = host
+        self._free_ports = collections.deque(range(first_port + first_port % 2, last_port - 1, 2))
+        self.receivers = {}  # session id -> (session, task, recorder, port)
+        self.senders = {}    # session id -> RtpStreamHandle
+        self._opening = set()   # receive session ids still binding
+        self._stop_pending = set()  # of those, the ones stopped meanwhile
+        self._totals = {"packets_received": 0, "packets_sent": 0, "frames_played": 0,
+                        "frames_concealed": 0}
+
+    async def run(self):
+        # Media modules are imported here so the parent (the SIP side)
+        # never loads them just to start the pool
+        from media_cache import MediaCache
+        from rtp_scheduler import RtpScheduler
+
+        self.loop = asyncio.get_running_loop()
+        self._done = asyncio.Event()
+        self.scheduler = RtpScheduler()
+        self.scheduler.start()
+        self.cache = MediaCache()
+        threading.Thread(target=self._read_control, name="media-control", daemon=True).start()
+
+        try:
+            while not self._done.is_set():
+                self._publish_stats()
+                try:
+                    await asyncio.wait_for(self._done.wait(), STATS_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for session_id in list(self.receivers):
+                await self._close_receiver(session_id)
+            self.scheduler.stop()
+            self._publish_stats()
+
+    def _read_control(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                message = ("shutdown", None, None)
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+            if message[0] == "shutdown":
+                return
+
+    def _reply(self, *message):
+        try:
+            self.conn.send(message)
+        except OSError:
+            pass
+
+    def _dispatch(self, message):
+        op, session_id, params = message
+        if op == "receive":
+            self._opening.add(session_id)
+            self.loop.create_task(self._open_receiver(session_id, params))
+        elif op == "send":
+            self._start_sender(session_id, params)
+        elif op == "stop":
+            if session_id in self.receivers:
+                self.loop.create_task(self._close_receiver(session_id))
+            elif session_id in self._opening:
+                # Closed by _open_receiver once the bind finishes
+                self._stop_pending.add(session_id)
+            elif session_id in self.senders:
+                self.scheduler.remove_stream(self.senders[session_id])
+        elif op == "shutdown":
+            self._done.set()
+
+    async def _open_receiver(self, session_id, params):
+        from audio_handler import play_rtp_session
+        from audio_output import NullSink
+        from recording import CallRecorder
+        from rtp_async import RtpReceiveSession
+
+        if not self._free_ports:
+            self._opening.discard(session_id)
+            self._stop_pending.discard(session_id)
+            self._reply("error", session_id, f"worker {self.index} has no free ports")
+            return
+        port = self._free_ports.popleft()
+        rtcp_port = port + 1 if params.get("rtcp") else None
+        try:
+            session = await RtpReceiveSession(port, rtcp_port, host=self.host,
+                                              codec=params.get("codec", AUDIO_CODEC)).open()
+        except OSError as e:
+            self._free_ports.append(port)
+            self._opening.discard(session_id)
+            self._stop_pending.discard(session_id)
+            self._reply("error", session_id, str(e))
+            return
+        self._opening.discard(session_id)
+        if session_id in self._stop_pending:
+            # Stopped (e.g. the parent timed out) while binding
+            self._stop_pending.discard(session_id)
+            session.close()
+            self._free_ports.append(port)
+            self._reply("ended", session_id, {"packets_received": 0, "frames_played": 0,
+                                              "frames_concealed": 0})
+            return
+        output_file = params.get("output_file")
+        recorder = CallRecorder(output_file) if output_file else None
+        task = self.loop.create_task(play_rtp_session(session, NullSink(), recorder))
+        self.receivers[session_id] = (session, task, recorder, port)
+        self._reply("ok", session_id, {"worker": self.index, "port": port, "rtcp_port": rtcp_port})
+
+    async def _close_receiver(self, session_id):
+        session, task, recorder, port = self.receivers.pop(session_id)
+        session.close()
+        await asyncio.gather(task, return_exceptions=True)
+        if recorder is not None:
+            recorder.close(wait=False)
+        jitter = session.jitter_buffer.stats
+        stats = {"packets_received": session.packets_received, "frames_played": jitter["played"],
+                 "frames_concealed": jitter["lost"]}
+        self._totals["packets_received"] += stats["packets_received"]
+        self._totals["frames_played"] += stats["frames_played"]
+        self._totals["frames_concealed"] += stats["frames_concealed"]
+        self._free_ports.append(port)
+        self._reply("ended", session_id, stats)
+
+    def _start_sender(self, session_id, params):
+        try:
+            frames = self.cache.get(params["audio_file"], params.get("codec", AUDIO_CODEC),
+                                    params.get("frame_duration", 20)).frames()
+        except (OSError, ValueError) as e:
+            self._reply("error", session_id, str(e))
+            return
+
+        suppressor = None
+        if params.get("silence_suppression"):
+            from vad import SilenceSuppressor
+            suppressor = SilenceSuppressor(params["silence_suppression"], params.get("codec", AUDIO_CODEC),
+                                           params.get("frame_duration", 20))
+            frames = suppressor.process(frames)
+
+        def on_complete(handle):
+            # Scheduler thread; the pipe is only written from the loop
+            self.loop.call_soon_threadsafe(self._sender_ended, session_id, handle)
+
+        handle = self.scheduler.add_stream(frames, params["ip"], params["port"],
+                                           params.get("frame_duration", 20),
+                                           ssrc=params.get("ssrc", SSRC), on_complete=on_complete)
+        handle.vad = suppressor
+        self.senders[session_id] = handle
+        self._reply("ok", session_id, {"worker": self.index})
+
+    def _sender_ended(self, session_id, handle):
+        self.senders.pop(session_id, None)
+        self._totals["packets_sent"] += handle.stats["packets_sent"]
+        stats = dict(handle.stats)
+        if handle.vad is not None:
+            stats["vad"] = handle.vad.get_stats()
+        self._reply("ended", session_id, stats)
+
+    def _publish_stats(self):
+        packets_received = self._totals["packets_received"]
+        frames_played = self._totals["frames_played"]
+        frames_concealed = self._totals["frames_concealed"]
+        for session, _, _, _ in self.receivers.values():
+            packets_received += session.packets_received
+            frames_played += session.jitter_buffer.stats["played"]
+            frames_concealed += session.jitter_buffer.stats["lost"]
+        packets_sent = self._totals["packets_sent"] + sum(
+            handle.stats["packets_sent"] for handle in list(self.senders.values()))
+        row = self.index * NUM_STATS
+        self.shared_stats[row:row + NUM_STATS] = [
+            len(self.receivers), len(self.senders), packets_received, packets_sent,
+            frames_played, frames_concealed, time.process_time(), time.time()]
+
+def _worker_main(index, conn, shared_stats, first_port, last_port, host):
+    worker = MediaWorker(index, conn, shared_stats, first_port, last_port, host)
+    try:
+        asyncio.run(worker.run())
+    except KeyboardInterrupt:
+        pass
+
+class MediaSession:
+    """
+    Parent-side handle of a session placed on a worker.
+    """
+    def __init__(self, session_id, worker, kind, on_complete=None):
+        self.session_id = session_id
+        self.worker = worker
+        self.kind = kind
+        self.on_complete = on_complete
+        self.port = None
+        self.rtcp_port = None
+        self.error = None
+        self.stats = None        # final counters, once ended
+        self.ready = threading.Event()
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        Block until the session has ended.
+        """
+        return self.done.wait(timeout)
+
+class MediaWorkerPool:
+    def __init__(self, num_workers=None, port_base=MEDIA_PORT_BASE, ports_per_worker=MEDIA_PORTS_PER_WORKER,
+                 host=LOCAL_IP):
+        """
+        Args:
+            num_workers (int): Worker processes; defaults to the CPU count.
+            port_base (int): First RTP port of worker 0.
+            ports_per_worker (int): Size of each worker's port range (RTP and
+                RTCP, so half as many sessions).
+            host (str): Address the workers bind.
+        """
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.port_base = port_base
+        self.ports_per_worker = ports_per_worker
+        self.host = host
+        self._processes = []
+        self._conns = []
+        self._send_locks = []
+        self._sessions = {}
+        self._live = [0] * self.num_workers
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._shared_stats = None
+        self._reader = None
+        self._running = False
+
+    def start(self):
+        self._shared_stats = multiprocessing.RawArray('d', self.num_workers * NUM_STATS)
+        for index in range(self.num_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            first_port = self.port_base + index * self.ports_per_worker
+            process = multiprocessing.Process(
+                target=_worker_main, name=f"media-worker-{index}", daemon=True,
+                args=(index, child_conn, self._shared_stats, first_port,
+                      first_port + self.ports_per_worker, self.host))
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+            self._send_locks.append(threading.Lock())
+        self._running = True
+        self._reader = threading.Thread(target=self._read_replies, name="media-pool", daemon=True)
+        self._reader.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Shut every worker down, closing their sessions.
+        """
+        for index in range(len(self._conns)):
+            self._send(index, ("shutdown", None, None))
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._running = False
+        if self._reader is not None:
+            self._reader.join()
+        for conn in self._conns:
+            conn.close()
+
+    def least_loaded(self):
+        """
+        Index of the worker with the fewest live sessions (ties go to the
+        one that has used the least CPU).
+        """
+        stats = self._shared_stats
+        cpu = STAT_FIELDS.index("cpu_seconds")
+        return min(range(self.num_workers),
+                   key=lambda index: (self._live[index], stats[index * NUM_STATS + cpu]))
+
+    def _place(self, op, params, on_complete, worker=None):
+        with self._lock:
+            if worker is None:
+                worker = self.least_loaded()
+            session = MediaSession(next(self._ids), worker, op, on_complete)
+            self._sessions[session.session_id] = session
+            self._live[worker] += 1
+        self._send(worker, (op, session.session_id, params))
+        return session
+
+    def _send(self, index, message):
+        with self._send_locks[index]:
+            try:
+                self._conns[index].send(message)
+            except OSError as e:
+                print(f"[MediaPool] Worker {index} control channel closed: {e}")
+
+    def open_receive(self, rtcp=True, output_file=None, codec=AUDIO_CODEC, timeout=5.0):
+        """
+        Open a receive session (jitter buffer, decode, playout) on the
+        least-loaded worker.
+
+        Args:
+            rtcp (bool): Also receive RTCP and send reports on port + 1.
+            output_file (str): Record the played audio to this WAV file.
+            codec (str): G.711 codec of the incoming stream.
+            timeout (float): Seconds to wait for the worker to bind.
+
+        Returns:
+            MediaSession: With port/rtcp_port set, for the SDP answer.
+        """
+        session = self._place("receive", {"rtcp": rtcp, "output_file": output_file, "codec": codec},
+                              None)
+        if not session.ready.wait(timeout):
+            # Forget the session and have the worker close it if it ever opens
+            with self._lock:
+                if self._sessions.pop(session.session_id, None) is not None:
+                    self._live[session.worker] -= 1
+            self.close_session(session)
+            raise TimeoutError(f"Media worker {session.worker} did not answer")
+        if session.error is not None:
+            raise OSError(session.error)
+        return session
+
+    def start_send(self, audio_file, ip, port, ssrc=SSRC, frame_duration=20, codec=AUDIO_CODEC,
+                   on_complete=None, silence_suppression=VAD_MODE):
+        """
+        Stream audio_file to ip:port from the least-loaded worker. Returns
+        immediately.
+
+        Args:
+            on_complete (callable): Called with the MediaSession once the
+                stream has been sent (or failed to start).
+            silence_suppression (str): None, "suppress" or "cn"; see
+                rtp_stream.send_rtp_stream.
+        """
+        params = {"audio_file": os.path.abspath(audio_file), "ip": ip, "port": port, "ssrc": ssrc,
+                  "frame_duration": frame_duration, "codec": codec,
+                  "silence_suppression": silence_suppression}
+        return self._place("send", params, on_complete)
+
+    def close_session(self, session):
+        self._send(session.worker, ("stop", session.session_id, None))
+
+    def _read_replies(self):
+        conns = list(self._conns)
+        while self._running and conns:
+            for conn in multiprocessing.connection.wait(conns, 0.5):
+                try:
+                    status, session_id, info = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    continue
+                self._on_reply(status, session_id, info)
+
+    def _on_reply(self, status, session_id, info):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return
+        if status == "ok":
+            session.port = info.get("port")
+            session.rtcp_port = info.get("rtcp_port")
+            session.ready.set()
+            return
+        if status == "error":
+            session.error = info
+            session.ready.set()
+        else:
+            session.stats = info
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._live[session.worker] -= 1
+        session.done.set()
+        if session.on_complete is not None:
+            session.on_complete(session)
+
+    def worker_stats(self):
+        """
+        Latest counters of every worker, read from shared memory.
+        """
+        stats = self._shared_stats
+        return [dict(zip(STAT_FIELDS, stats[index * NUM_STATS:(index + 1) * NUM_STATS]))
+                for index in range(self.num_workers)]
+
+    def get_stats(self):
+        workers = self.worker_stats()
+        totals = {name: sum(worker[name] for worker in workers)
+                  for name in STAT_FIELDS if name != "updated"}
+        return {"workers": workers, "totals": totals, "live_sessions": list(self._live)}
@@ -0,0 +1,287 @@
+'''
+In-process metrics and sampled tracing
+
+Counters and fixed-bucket histograms are plain Python objects updated
+in place: no locks, no allocation and no I/O on the hot path. Under
+heavy thread contention an increment can very occasionally be lost,
+which is acceptable for monitoring. Histogram buckets are fixed at
+creation (latencies in milliseconds), so an observation is one bisect
+and a few integer adds.
+
+Tracing is sampled (one event in TRACE_SAMPLE_EVERY) and goes through an
+AsyncLogWriter. That is a background thread which drains queued lines in
+batches, so the caller never touches the file.
+
+snapshot() returns everything as a plain dict for the GUI. serve_http()
+exposes the same data as JSON on a local port for scraping.
+
+Instrumented code checks the module flag before doing any work:
+    if metrics.enabled:
+        SENT.inc()
+With METRICS_ENABLED = False in config, or after disable(), the cost is
+one attribute lookup and a branch.
+'''
+
+import atexit
+import bisect
+import collections
+import json
+import threading
+import time
+from config import *
+
+enabled = METRICS_ENABLED
+
+# Upper bounds (ms) of the default latency buckets; one overflow bucket follows
+DEFAULT_BUCKETS_MS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+class Counter:
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+class Histogram:
+    __slots__ = ('name', 'bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, name, bounds=DEFAULT_BUCKETS_MS):
+        """
+        Args:
+            name (str): Metric name.
+            bounds (tuple): Sorted bucket upper bounds; values above the last
+                one go to an overflow bucket.
+        """
+        self.name = name
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observe_since(self, start):
+        """
+        Record the milliseconds elapsed since start (a perf_counter() value).
+        """
+        self.observe((time.perf_counter() - start) * 1000)
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile (the overflow
+        bucket reports the maximum seen).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        counts = list(self.counts)
+        buckets = {str(bound): n for bound, n in zip(self.bounds, counts)}
+        buckets["+Inf"] = counts[-1]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.50),
+            "p90": self.quantile(0.90),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+_counters = {}
+_histograms = {}
+_registry_lock = threading.Lock()
+
+def counter(name):
+    """
+    Get or create the counter called name.
+    """
+    with _registry_lock:
+        metric = _counters.get(name)
+        if metric is None:
+            metric = _counters[name] = Counter(name)
+        return metric
+
+def histogram(name, bounds=DEFAULT_BUCKETS_MS):
+    """
+    Get or create the histogram called name.
+    """
+    with _registry_lock:
+        metric = _histograms.get(name)
+        if metric is None:
+            metric = _histograms[name] = Histogram(name, bounds)
+        return metric
+
+def reset():
+    with _registry_lock:
+        for metric in _counters.values():
+            metric.value = 0
+        for metric in _histograms.values():
+            metric.reset()
+
+def snapshot():
+    """
+    All counters and histogram summaries as a plain (JSON-serializable) dict.
+    """
+    with _registry_lock:
+        counters = {name: metric.value for name, metric in _counters.items()}
+        histograms = {name: metric.snapshot() for name, metric in _histograms.items()}
+    return {
+        "enabled": enabled,
+        "timestamp": time.time(),
+        "counters": counters,
+        "histograms": histograms,
+        "log_writers": {path: writer.get_stats() for path, writer in list(_writers.items())},
+    }
+
+class AsyncLogWriter:
+    """
+    Appends lines to a file from a background thread, one batched write per
+    flush interval. write() never blocks; when more than max_lines are
+    pending, new lines are dropped and counted.
+    """
+    def __init__(self, path, flush_interval=0.25, max_lines=100000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_lines = max_lines
+        self._lines = collections.deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.stats = {"lines": 0, "dropped": 0, "batches": 0, "write_errors": 0}
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        if len(self._lines) >= self.max_lines:
+            self.stats["dropped"] += 1
+            return
+        self._lines.append(line)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        lines = self._lines
+        if not lines:
+            return
+        batch = []
+        try:
+            while True:
+                batch.append(lines.popleft())
+        except IndexError:
+            pass
+        try:
+            with open(self.path, "a") as f:
+                f.write("".join(batch))
+            self.stats["lines"] += len(batch)
+            self.stats["batches"] += 1
+        except OSError as e:
+            self.stats["write_errors"] += 1
+            print(f"Error writing log {self.path}: {e}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["pending"] = len(self._lines)
+        return stats
+
+    def close(self):
+        """
+        Write everything still queued and stop the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+
+_writers = {}
+
+def get_log_writer(path):
+    """
+    The shared AsyncLogWriter for path, started on first use.
+    """
+    with _registry_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = AsyncLogWriter(path)
+        return writer
+
+@atexit.register
+def close_log_writers():
+    for writer in list(_writers.values()):
+        writer.close()
+
+_trace_tick = 0
+
+def trace(event, detail="", sample=True):
+    """
+    Record a trace line to TRACE_LOG_FILE. Only one call in
+    TRACE_SAMPLE_EVERY is written unless sample is False (use that for
+    rare events such as errors).
+    """
+    global _trace_tick
+    if not enabled:
+        return
+    if sample:
+        _trace_tick += 1
+        if _trace_tick < TRACE_SAMPLE_EVERY:
+            return
+        _trace_tick = 0
+    get_log_writer(TRACE_LOG_FILE).write(f"{time.time():.6f} {event} {detail}\n")
+
+def serve_http(port=METRICS_PORT, host=LOCAL_IP):
+    """
+    Serve snapshot() as JSON on http://host:port/ from a daemon thread.
+
+    Returns:
+        http.server.ThreadingHTTPServer: Call shutdown() to stop it.
+    """
+    import http.server  # only needed by the scrape endpoint
+
+    class SnapshotHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(snapshot()).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), SnapshotHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -1,58 +1,432 @@
+'''
+Mock SIP server (UAS) for local testing and load tests
+
+MockSipServer answers INVITE/ACK/BYE (plus OPTIONS and REGISTER) with
+correct Via/From/To/CSeq echoing and keeps:
+    - a Call-ID keyed dialog table (early -> confirmed -> terminated)
+    - a response cache keyed by Via branch, Call-ID and CSeq, so a
+      retransmitted request gets the exact same response back without
+      re-processing
+It can inject error responses for a fraction of INVITEs and delay
+responses, to exercise client retransmission and failure paths. Timers
+(delayed responses, cache and dialog expiry) share one TimerHeap serviced
+by the socket loop. Per-message logging is off unless verbose is set.
+
+In relay mode (relay=MediaRelay) the server also anchors the media of each
+dialog: an INVITE with SDP gets relay ports, the 200 OK answers with the
+offer's SDP rewritten to point at them, and the relay forwards RTP/RTCP to
+media_target (or back to the caller when there is none) until the BYE.
+
+run_workers() starts several processes bound to the same port with
+SO_REUSEPORT. The kernel hashes each client address to one worker, so
+every dialog stays on the process that holds its state.
+
+Usage:
+    python mock_sip_server.py [--workers N] [--error-rate 0.1 --error-code 503]
+                              [--delay 0.05] [--verbose]
+                              [--relay [--media-target IP:PORT] [--relay-latch]]
+'''
+
+import argparse
+import multiprocessing
+import os
+import random
+import selectors
 import socket
+import time
 from config import *
-import traceback
+from call_manager import TimerHeap, T1, format_response
+from sip_message import SipMessage, sdp_media_address, sdp_rewrite_media_address
 
-def start_mock_server():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((LOCAL_IP, SIP_PORT))
-    print(f"[Server] Listening on {LOCAL_IP}:{SIP_PORT}")
+TRANSACTION_LIFETIME = 64 * T1  # how long cached responses are kept (Timer J)
+MAX_DATAGRAM = 65535
+
+REASONS = {
+    100: "Trying",
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    408: "Request Timeout",
+    480: "Temporarily Unavailable",
+    481: "Call/Transaction Does Not Exist",
+    486: "Busy Here",
+    500: "Server Internal Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+    603: "Decline",
+}
+
+class MockDialog:
+    __slots__ = ('call_id', 'to_tag', 'state', 'created')
+
+    def __init__(self, call_id, to_tag):
+        self.call_id = call_id
+        self.to_tag = to_tag
+        self.state = "early"
+        self.created = time.monotonic()
+
+class MockSipServer:
+    def __init__(self, host=LOCAL_IP, port=SIP_PORT, sock=None, verbose=False,
+                 error_rate=0.0, error_code=486, delay=0.0, delay_jitter=0.0,
+                 reuse_port=False, seed=None, relay=None, media_target=None):
+        """
+        Args:
+            host (str): Address to bind.
+            port (int): Port to bind.
+            sock (socket.socket): Already bound UDP socket to use instead.
+            verbose (bool): Print every message received.
+            error_rate (float): Fraction of INVITEs answered with error_code.
+            error_code (int): 4xx/5xx/6xx status for injected failures.
+            delay (float): Seconds to hold every final response.
+            delay_jitter (float): Extra uniform random delay, 0..delay_jitter s.
+            reuse_port (bool): Set SO_REUSEPORT so several workers can bind.
+            seed (int): Seed for the injection RNG.
+            relay (media_relay.MediaRelay): Anchor each dialog's media on
+                this relay, which is served by the socket loop.
+            media_target (tuple): (ip, port) the relay sends the caller's
+                media to; None echoes it back to the caller.
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((host, port))
+        sock.setblocking(False)
+        self.sock = sock
+        self.address = sock.getsockname()
+        self.verbose = verbose
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.delay = delay
+        self.delay_jitter = delay_jitter
+        self._random = random.Random(seed)
+        self.relay = relay
+        self.media_target = media_target
 
-    while True:
+        self.timers = TimerHeap()
+        self.dialogs = {}          # Call-ID -> MockDialog
+        self._responses = {}       # (branch, Call-ID, CSeq) -> response bytes, None while delayed
+        self._tag_prefix = f"{os.getpid():x}"
+        self._next_tag = 0
+        self._running = False
+
+        self.stats = {
+            "received": 0,
+            "invites": 0,
+            "acks": 0,
+            "byes": 0,
+            "responses_sent": 0,
+            "retransmissions": 0,
+            "errors_injected": 0,
+            "malformed": 0,
+            "relay_failures": 0,
+            "errors": 0,
+        }
+
+    def log(self, text):
+        if self.verbose:
+            print(f"[Server] {text}")
+
+    def serve_forever(self, stop_event=None):
+        """
+        Handle requests until stop() is called (or stop_event is set).
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        if self.relay is not None:
+            self.relay.attach(selector)
+        self._running = True
+        print(f"[Server] Listening on {self.address[0]}:{self.address[1]}")
+        try:
+            while self._running:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                timeout = self.timers.run_due()
+                # Wake at least twice a second to notice stop requests
+                timeout = 0.5 if timeout is None else min(timeout, 0.5)
+                for key, _ in selector.select(timeout):
+                    if key.data is None:
+                        self._drain_socket()
+                    else:
+                        self.relay.on_readable(key.data)
+        finally:
+            if self.relay is not None:
+                self.relay.selector = None
+            selector.close()
+
+    def stop(self):
+        self._running = False
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["dialogs"] = len(self.dialogs)
+        stats["cached_responses"] = len(self._responses)
+        if self.relay is not None:
+            stats["relay"] = self.relay.get_stats()
+        return stats
+
+    def _drain_socket(self):
+        sock = self.sock
+        while True:
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionResetError:
+                self.log("Connection reset by client. Waiting for next message...")
+                continue
+            except OSError as e:
+                self.stats["errors"] += 1
+                print(f"[Server] Error receiving: {e}")
+                return
+            self.stats["received"] += 1
+            try:
+                message = SipMessage.parse(data)
+            except ValueError as e:
+                self.stats["malformed"] += 1
+                self.log(f"Malformed message from {addr}: {e}")
+                continue
+            if self.verbose:
+                self.log(f"Received from {addr}:\n{data.decode('utf-8', 'replace')}")
+            if not message.is_request:
+                continue
+            try:
+                self.handle_request(message, addr)
+            except Exception as e:
+                # One bad request must not take the worker down
+                self.stats["errors"] += 1
+                print(f"[Server] Unexpected error handling {message.method} from {addr}: {e}")
+
+    def _sendto(self, data, addr):
         try:
-            data, addr = sock.recvfrom(BUFFER_SIZE)
-            message = data.decode()
-            print(f"\n[Server] Received from {addr}:\n{message}")
-
-            if message.startswith("INVITE"):
-                call_id = extract_call_id(message)
-                to = extract_field(message, "To")
-                from_ = extract_field(message, "From")
-
-                response = f"SIP/2.0 200 OK\r\n" \
-                           f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n" \
-                           f"From: {from_};tag={call_id}\r\n" \
-                           f"To: {to};tag={call_id}\r\n" \
-                           f"Call-ID: {call_id}\r\n" \
-                           f"CSeq: 1 INVITE\r\n" \
-                           f"Content-Length: 0\r\n\r\n"
-
-                sock.sendto(response.encode(), addr)
-                print("[Server] Sent 200 OK")
-
-            elif message.startswith("ACK"):
-                print("[Server] Received ACK. Call established.")
-
-            elif message.startswith("BYE"):
-                print("[Server] Received BYE. Call ended.")
-                goodbye = f"SIP/2.0 200 OK\r\nCall-ID: {extract_call_id(message)}\r\nContent-Length: 0\r\n\r\n"
-                sock.sendto(goodbye.encode(), addr)
-
-        except ConnectionResetError:
-            print("[Server] Connection reset by client. Waiting for next message...")
-        except Exception as e:
-            print(f"[Server] Unexpected error: {e}")
+            self.sock.sendto(data, addr)
+            self.stats["responses_sent"] += 1
+        except OSError as e:
+            self.log(f"Error sending to {addr}: {e}")
+
+    def _new_tag(self):
+        self._next_tag += 1
+        return f"{self._tag_prefix}{self._next_tag:x}"
+
+    def build_response(self, request, status_code, to_tag=None, sdp=None):
+        to_header = request.get("To", "")
+        if to_tag is not None and request.to_tag is None:
+            to_header = f"{to_header};tag={to_tag}"
+        via = "".join(f"Via: {value}\r\n" for value in request.get_all("Via"))
+        return format_response(status_code, REASONS.get(status_code, "Unknown"), via,
+                               request.get("From", ""), to_header, request.call_id or "",
+                               request.get("CSeq", ""), sdp or b'')
+
+    def handle_request(self, request, addr):
+        method = request.method
+        if method == "ACK":
+            self.stats["acks"] += 1
+            dialog = self.dialogs.get(request.call_id)
+            if dialog is not None and dialog.state == "early":
+                dialog.state = "confirmed"
+                self.log("Received ACK. Call established.")
+            return
+
+        # CSeq carries the method. Call-ID and CSeq also keep requests
+        # without a branch (RFC 2543 clients) from sharing one entry.
+        key = (request.branch, request.call_id, request.get("CSeq", ""))
+        if key in self._responses:
+            # Retransmission: replay the cached response (or keep waiting
+            # if it is still being delayed)
+            self.stats["retransmissions"] += 1
+            response = self._responses[key]
+            if response is not None:
+                self._sendto(response, addr)
+            return
+
+        if method == "INVITE":
+            self.stats["invites"] += 1
+            response = self._handle_invite(request)
+        elif method == "BYE":
+            self.stats["byes"] += 1
+            response = self._handle_bye(request)
+        elif method in ("OPTIONS", "REGISTER"):
+            response = self.build_response(request, 200, self._new_tag())
+        else:
+            response = self.build_response(request, 501, self._new_tag())
+
+        delay = self.delay + (self._random.uniform(0, self.delay_jitter) if self.delay_jitter else 0)
+        if delay > 0:
+            if method == "INVITE":
+                # Stop the client's Timer A while the final response is held
+                self._sendto(self.build_response(request, 100), addr)
+            self._responses[key] = None
+            self.timers.schedule(delay, self._send_delayed, key, response, addr)
+        else:
+            self._responses[key] = response
+            self._sendto(response, addr)
+        self.timers.schedule(TRANSACTION_LIFETIME + delay, self._responses.pop, key, None)
+
+    def _send_delayed(self, key, response, addr):
+        if key in self._responses:
+            self._responses[key] = response
+        self._sendto(response, addr)
+
+    def _handle_invite(self, request):
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.stats["errors_injected"] += 1
+            return self.build_response(request, self.error_code, self._new_tag())
+
+        call_id = request.call_id or "test123"
+        dialog = self.dialogs.get(call_id)
+        if dialog is None:
+            dialog = self.dialogs[call_id] = MockDialog(call_id, request.to_tag or self._new_tag())
+            # Drop dialogs that are never ACKed
+            self.timers.schedule(TRANSACTION_LIFETIME, self._expire_early, dialog)
+        sdp = None
+        if self.relay is not None and request.raw_body:
+            sdp = self._relay_answer(call_id, request.raw_body)
+            if sdp is None:
+                return self.build_response(request, 503, dialog.to_tag)
+        self.log("Sent 200 OK")
+        return self.build_response(request, 200, dialog.to_tag, sdp)
+
+    def _relay_answer(self, call_id, offer):
+        """
+        Anchor the call's media on the relay (re-INVITEs keep their ports)
+        and return the SDP answer pointing at it, or None if out of ports.
+        """
+        session = self.relay.get_session(call_id)
+        if session is None:
+            try:
+                session = self.relay.create_session(call_id, echo=self.media_target is None)
+            except OSError as e:
+                self.stats["relay_failures"] += 1
+                self.log(f"Cannot relay {call_id}: {e}")
+                return None
+            if self.media_target is not None:
+                session.leg_b.set_remote(self.media_target)
+        remote = sdp_media_address(offer)
+        if remote is not None and not session.leg_a.latched:
+            session.leg_a.set_remote(remote)
+        return sdp_rewrite_media_address(offer, self.relay.host, session.leg_a.port)
+
+    def _handle_bye(self, request):
+        dialog = self.dialogs.get(request.call_id)
+        if dialog is None:
+            return self.build_response(request, 481, self._new_tag())
+        dialog.state = "terminated"
+        del self.dialogs[dialog.call_id]
+        if self.relay is not None:
+            self.relay.close_session(dialog.call_id)
+        self.log("Received BYE. Call ended.")
+        return self.build_response(request, 200, dialog.to_tag)
+
+    def _expire_early(self, dialog):
+        if dialog.state == "early" and self.dialogs.get(dialog.call_id) is dialog:
+            del self.dialogs[dialog.call_id]
+            if self.relay is not None:
+                self.relay.close_session(dialog.call_id)
+
+def start_mock_server():
+    """
+    Run a single verbose server on LOCAL_IP:SIP_PORT.
+    """
+    MockSipServer(verbose=True).serve_forever()
+
+def _worker(kwargs, stop_event, results, index=0, num_workers=1):
+    kwargs = dict(kwargs)
+    relay_options = kwargs.pop("relay_options", None)
+    if relay_options is not None:
+        # Every worker owns its own slice of the relay port range
+        from media_relay import MediaRelay
+        relay_options = dict(relay_options)
+        count = relay_options.get("port_count", RELAY_PORT_COUNT) // num_workers
+        relay_options["port_base"] = relay_options.get("port_base", RELAY_PORT_BASE) + index * count
+        relay_options["port_count"] = count
+        kwargs["relay"] = MediaRelay(**relay_options)
+    server = MockSipServer(reuse_port=True, **kwargs)
+    try:
+        server.serve_forever(stop_event)
+    except KeyboardInterrupt:
+        pass
+    results.put((os.getpid(), server.get_stats()))
+
+def run_workers(num_workers=None, stop_event=None, **kwargs):
+    """
+    Serve with num_workers processes sharing one port via SO_REUSEPORT.
+
+    Args:
+        num_workers (int): Worker processes; defaults to the CPU count.
+        stop_event (multiprocessing.Event): Stops the workers when set;
+            otherwise they run until interrupted.
+        **kwargs: Passed to MockSipServer, except relay_options: MediaRelay
+            arguments; each worker then relays on its share of the ports.
+
+    Returns:
+        dict: Stats summed over all workers.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        print("[Server] SO_REUSEPORT not available, running a single worker")
+        num_workers = 1
+    num_workers = num_workers or os.cpu_count() or 1
+    stop_event = stop_event or multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, daemon=True,
+                                       args=(kwargs, stop_event, results, index, num_workers))
+               for index in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    totals = {}
+    for _ in workers:
+        _, stats = results.get()
+        stats.pop("relay", None)
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+    for worker in workers:
+        worker.join()
+    return totals
 
 def extract_call_id(msg):
-    for line in msg.splitlines():
-        if line.startswith("Call-ID"):
-            return line.split(" ")[1].strip()
-    return "test123"
+    return SipMessage.parse(msg).call_id or "test123"
 
 def extract_field(msg, field_name):
-    for line in msg.splitlines():
-        if line.startswith(field_name):
-            return line.split(":", 1)[1].strip()
-    return ""
+    return SipMessage.parse(msg).get(field_name, "")
 
 if __name__ == "__main__":
-    start_mock_server()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Mock SIP server")
+    parser.add_argument("--host", default=LOCAL_IP)
+    parser.add_argument("--port", type=int, default=SIP_PORT)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-code", type=int, default=486)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--delay-jitter", type=float, default=0.0)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--relay", action="store_true", help="anchor media on a MediaRelay")
+    parser.add_argument("--media-target", help="IP:PORT the relay sends caller media to (default: echo)")
+    parser.add_argument("--relay-latch", action="store_true", help="symmetric RTP for callers behind NAT")
+    args = parser.parse_args()
+
+    options = dict(host=args.host, port=args.port, verbose=args.verbose,
+                   error_rate=args.error_rate, error_code=args.error_code,
+                   delay=args.delay, delay_jitter=args.delay_jitter)
+    relay_options = None
+    if args.relay:
+        relay_options = dict(host=args.host, latch=args.relay_latch)
+        if args.media_target:
+            ip, _, port = args.media_target.rpartition(":")
+            options["media_target"] = (ip, int(port))
+    if args.workers > 1:
+        print(run_workers(args.workers, relay_options=relay_options, **options))
+    else:
+        if relay_options is not None:
+            from media_relay import MediaRelay
+            options["relay"] = MediaRelay(**relay_options)
+        server = MockSipServer(**options)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(server.get_stats())
@@ -6,48 +6,601 @@ Task to do: DONE
     - send_udp_packet(ip, port, data): Sends data over UDP to the specified IP and port.
     - receive_udp_packet(socket, buffer_size): Receives data from a UDP socket with the specified buffer size.
     - create_udp_socket(port): Creates a UDP socket bound to the specified port.
+
+Datagram I/O layer:
+    - configure_socket() sets SO_RCVBUF/SO_SNDBUF, blocking mode and (on
+      Linux) SO_RXQ_OVFL, so the kernel reports how many datagrams it
+      dropped because the receive buffer was full.
+    - SocketPool hands out one socket per local address and keeps it, so
+      sending without a socket of your own does not create and close a
+      socket per datagram.
+    - DatagramBatch receives and sends up to N datagrams per syscall with
+      recvmmsg/sendmmsg (Linux, through ctypes) into preallocated buffers.
+      Elsewhere it falls back to one recvmsg_into/sendmsg per datagram;
+      sendmsg takes the header and payload as separate buffers, so they
+      never have to be joined.
 '''
 
+import _socket
+import ctypes
+import ctypes.util
+import errno
+import os
 import socket
+import struct
+import sys
+import threading
+import time
+import metrics
 from config import *
 
+SENT_PACKETS = metrics.counter("udp.sent_packets")
+SENT_BYTES = metrics.counter("udp.sent_bytes")
+SEND_ERRORS = metrics.counter("udp.send_errors")
+SEND_MS = metrics.histogram("udp.send_ms")
+RECEIVED_PACKETS = metrics.counter("udp.received_packets")
+RECEIVED_BYTES = metrics.counter("udp.received_bytes")
+RECEIVE_TIMEOUTS = metrics.counter("udp.receive_timeouts")
+RECEIVE_ERRORS = metrics.counter("udp.receive_errors")
+RECEIVE_MS = metrics.histogram("udp.receive_ms")  # time in recvfrom, including the wait
+BATCH_RECEIVE_CALLS = metrics.counter("udp.batch_receive_calls")
+BATCH_SEND_CALLS = metrics.counter("udp.batch_send_calls")
+KERNEL_DROPS = metrics.counter("udp.kernel_drops")  # receive buffer overflows (SO_RXQ_OVFL)
+TRUNCATED = metrics.counter("udp.truncated")  # short reads: datagram larger than the buffer
+SHORT_SENDS = metrics.counter("udp.short_sends")  # batch sends that stopped early
+
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40 if sys.platform.startswith("linux") else None)
+OVERFLOW_CMSG_SPACE = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
 def send_udp_packet(ip, port, data, sock=None):
- 
+    """
+    Send one datagram. data may be a list of buffers (e.g. header and
+    payload), which are sent as one datagram without joining them. Without
+    a socket, the pooled unbound socket is used.
+    """
     try:
         if isinstance(data, str):
             data = data.encode('utf-8')
 
+        start = time.perf_counter() if metrics.enabled else 0.0
         if sock is None:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as temp_sock:
-                temp_sock.sendto(data, (ip, port))
+            sock = default_pool.get()
+        if isinstance(data, (list, tuple)):
+            if HAS_SENDMSG:
+                sent = sock.sendmsg(data, (), 0, (ip, port))
+            else:
+                sent = sock.sendto(b''.join(data), (ip, port))
         else:
-            sock.sendto(data, (ip, port))
+            sent = sock.sendto(data, (ip, port))
 
-        print(f"Sent {len(data)} bytes to {ip}:{port}")
+        if metrics.enabled:
+            SEND_MS.observe_since(start)
+            SENT_PACKETS.inc()
+            SENT_BYTES.inc(sent)
+            metrics.trace("udp.send", f"{sent} bytes to {ip}:{port}")
     except Exception as e:
+        SEND_ERRORS.inc()
         print(f"Error sending UDP packet: {e}")
 
 def receive_udp_packet(sock, buffer_size = BUFFER_SIZE, timeout = None):
     try:
         if timeout:
             sock.settimeout(timeout)
+        start = time.perf_counter() if metrics.enabled else 0.0
         data, addr = sock.recvfrom(buffer_size)
-        print(f"Received {len(data)} bytes from {addr}")
+        if metrics.enabled:
+            RECEIVE_MS.observe_since(start)
+            RECEIVED_PACKETS.inc()
+            RECEIVED_BYTES.inc(len(data))
+            metrics.trace("udp.receive", f"{len(data)} bytes from {addr}")
         return addr, data
     except socket.timeout:
-        print("Socket timed out waiting for data")
+        RECEIVE_TIMEOUTS.inc()
         return None
     except Exception as e:
+        RECEIVE_ERRORS.inc()
         print(f"Error receiving UDP packet: {e}")
         return None
 
-def create_udp_socket(port):
-    
+def create_udp_socket(port, host='', rcvbuf=UDP_RCVBUF, sndbuf=UDP_SNDBUF, blocking=True):
+    """
+    Create a UDP socket bound to (host, port), with socket buffers of the
+    given sizes. Returns None on failure.
+    """
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('', port))
+        sock.bind((host, port))
+        configure_socket(sock, rcvbuf, sndbuf, blocking)
         print(f"Socket created and bound to port {port}")
         return sock
     except Exception as e:
         print(f"Error creating UDP socket: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def configure_socket(sock, rcvbuf=None, sndbuf=None, blocking=None, drop_counter=True):
+    """
+    Tune a UDP socket. Options left as None are not changed.
+
+    Args:
+        sock (socket.socket): The socket.
+        rcvbuf (int): SO_RCVBUF in bytes (Linux doubles it for bookkeeping).
+        sndbuf (int): SO_SNDBUF in bytes.
+        blocking (bool): Blocking mode.
+        drop_counter (bool): Ask the kernel for its overflow count
+            (SO_RXQ_OVFL), read by DatagramBatch.recv().
+
+    Returns:
+        socket.socket: sock.
+    """
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if blocking is not None:
+        sock.setblocking(blocking)
+    if drop_counter and SO_RXQ_OVFL is not None:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        except OSError:
+            pass
+    return sock
+
+class SocketPool:
+    """
+    Long-lived UDP sockets keyed by local address. get() returns the same
+    socket for the same address until close(), so hot paths never create
+    and tear down sockets.
+    """
+    def __init__(self, rcvbuf=UDP_RCVBUF, sndbuf=UDP_SNDBUF, blocking=True):
+        self.rcvbuf = rcvbuf
+        self.sndbuf = sndbuf
+        self.blocking = blocking
+        self._sockets = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def get(self, local_addr=('0.0.0.0', 0)):
+        """
+        The pooled socket bound to local_addr (created on first use). Port
+        0 gives one shared socket on an ephemeral port for that host.
+        """
+        sock = self._sockets.get(local_addr)
+        if sock is not None:
+            return sock
+        with self._lock:
+            sock = self._sockets.get(local_addr)
+            if sock is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    sock.bind(local_addr)
+                    configure_socket(sock, self.rcvbuf, self.sndbuf, self.blocking)
+                except OSError:
+                    sock.close()
+                    raise
+                self._sockets[local_addr] = sock
+            return sock
+
+    def discard(self, local_addr):
+        """
+        Close and forget the socket for local_addr (e.g. after an error).
+        """
+        with self._lock:
+            sock = self._sockets.pop(local_addr, None)
+        if sock is not None:
+            sock.close()
+
+    def close(self):
+        with self._lock:
+            sockets, self._sockets = self._sockets, {}
+        for sock in sockets.values():
+            sock.close()
+
+default_pool = SocketPool()
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_Iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _Msghdr), ("msg_len", ctypes.c_uint)]
+
+class _SockaddrIn(ctypes.Structure):
+    # Port and address are kept in network byte order
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint32), ("sin_zero", ctypes.c_ubyte * 8)]
+
+def _load_mmsg():
+    """
+    recvmmsg/sendmmsg from libc, or None where they are not available.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        recvmmsg = libc.recvmmsg
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    # Arrays are passed as plain addresses, the cheapest argument to convert
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return recvmmsg, sendmmsg
+
+_MMSG = _load_mmsg()
+_recvmmsg, _sendmmsg = _MMSG or (None, None)
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+MSG_TRUNC = getattr(socket, "MSG_TRUNC", 0)
+_family = _socket.socket.family.__get__  # plain int, without the enum conversion
+SOCKADDR_IN_SIZE = ctypes.sizeof(_SockaddrIn)
+NATIVE_U32 = struct.Struct('=I')
+
+# Field layouts for filling the ctypes arrays through raw byte views
+MMSG_SIZE = ctypes.sizeof(_Mmsghdr)
+MSG_NAMELEN_OFFSET = _Msghdr.msg_namelen.offset
+MSG_IOVLEN_OFFSET = _Msghdr.msg_iovlen.offset
+MSG_CONTROLLEN_OFFSET = _Msghdr.msg_controllen.offset
+MSG_FLAGS_OFFSET = _Msghdr.msg_flags.offset
+MSG_NAMELEN = struct.Struct('=I')
+MSG_IOVLEN = struct.Struct('@N')
+MSG_CONTROLLEN = struct.Struct('@N')
+MSG_FLAGS_LEN = struct.Struct(f'=i{_Mmsghdr.msg_len.offset - MSG_FLAGS_OFFSET - 4}xI')
+SOCKADDR_IN = struct.Struct('=HHI8x')  # family, port and address as stored (network order)
+IOVEC = struct.Struct('@PN')
+OVERFLOW_CMSG = struct.Struct(f"={'Q' if ctypes.sizeof(ctypes.c_size_t) == 8 else 'I'}iiI")
+
+class DatagramBatch:
+    """
+    Preallocated buffers for moving up to `size` IPv4 datagrams per
+    syscall. One batch can serve any number of sockets, one call at a time
+    (it is not thread-safe).
+
+    After recv(), datagram i is views[i][:lengths[i]] from addrs[i], valid
+    until the next call. Received datagrams can be modified in place and
+    sent on with send() without copying them.
+    """
+    def __init__(self, size=64, buffer_size=2048, use_mmsg=True):
+        """
+        Args:
+            size (int): Datagrams per batch.
+            buffer_size (int): Bytes per datagram; longer ones are truncated
+                (and counted).
+            use_mmsg (bool): Use recvmmsg/sendmmsg where available.
+        """
+        self.size = size
+        self.buffer_size = buffer_size
+        self.lengths = [0] * size
+        self.addrs = [None] * size
+        self._overflow = {}  # fileno -> last SO_RXQ_OVFL count seen
+        self.kernel_drops = 0  # drops the kernel reported during the last recv()
+        self._addr_cache = {}  # (ip, port) <-> raw sockaddr fields
+
+        self.stats = {
+            "receive_calls": 0,
+            "received": 0,
+            "truncated": 0,
+            "kernel_drops": 0,
+            "send_calls": 0,
+            "sent": 0,
+            "short_sends": 0,
+        }
+
+        self.mmsg = use_mmsg and _MMSG is not None
+        if not self.mmsg:
+            self._buffers = [bytearray(buffer_size) for _ in range(size)]
+            self.views = [memoryview(buffer) for buffer in self._buffers]
+            return
+
+        # The ctypes arrays are filled in through raw byte views with
+        # struct, which is much cheaper per datagram than field access
+        self._storage = ctypes.create_string_buffer(size * buffer_size)
+        self._slot_base = ctypes.addressof(self._storage)
+        storage = memoryview(self._storage).cast('B')
+        self.views = [storage[i * buffer_size:(i + 1) * buffer_size] for i in range(size)]
+
+        self._control = ctypes.create_string_buffer(size * OVERFLOW_CMSG_SPACE)
+        self._control_view = memoryview(self._control).cast('B')
+        self._recv_names = (_SockaddrIn * size)()
+        self._recv_names_raw = memoryview(self._recv_names).cast('B')
+        self._recv_iov = (_Iovec * size)()
+        self._recv_msgs = (_Mmsghdr * size)()
+        self._recv_raw = memoryview(self._recv_msgs).cast('B')
+        self._recv_address = ctypes.addressof(self._recv_msgs)
+        for i in range(size):
+            self._recv_iov[i].iov_base = self._slot_base + i * buffer_size
+            self._recv_iov[i].iov_len = buffer_size
+            hdr = self._recv_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._recv_names[i])
+            hdr.msg_iov = ctypes.pointer(self._recv_iov[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_control = ctypes.addressof(self._control) + i * OVERFLOW_CMSG_SPACE
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_controllen = OVERFLOW_CMSG_SPACE
+        self._filled = 0
+
+        # Up to two iovecs (header, payload) and one address per datagram sent
+        self._send_iov = (_Iovec * (2 * size))()
+        self._send_iov_raw = memoryview(self._send_iov).cast('B')
+        self._send_names = (_SockaddrIn * size)()
+        self._send_names_raw = memoryview(self._send_names).cast('B')
+        self._send_msgs = (_Mmsghdr * size)()
+        self._send_raw = memoryview(self._send_msgs).cast('B')
+        self._send_address = ctypes.addressof(self._send_msgs)
+        for i in range(size):
+            hdr = self._send_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._send_names[i])
+            hdr.msg_namelen = SOCKADDR_IN_SIZE
+            hdr.msg_iov = ctypes.cast(ctypes.byref(self._send_iov, 2 * i * IOVEC.size), ctypes.POINTER(_Iovec))
+            hdr.msg_iovlen = 1
+
+    def _raw_addr(self, addr):
+        raw = self._addr_cache.get(addr)
+        if raw is None:
+            if len(self._addr_cache) > 4096:
+                self._addr_cache.clear()
+            raw = (socket.htons(addr[1]), NATIVE_U32.unpack(socket.inet_aton(addr[0]))[0])
+            self._addr_cache[addr] = raw
+            self._addr_cache[raw] = addr
+        return raw
+
+    def _note_overflow(self, sock, count):
+        # SO_RXQ_OVFL is a running total per socket; count what is new
+        fileno = sock.fileno()
+        last = self._overflow.get(fileno, 0)
+        dropped = count - last if count >= last else count  # fd reused by a new socket
+        self._overflow[fileno] = count
+        self.kernel_drops = dropped
+        if dropped:
+            self.stats["kernel_drops"] += dropped
+            if metrics.enabled:
+                KERNEL_DROPS.inc(dropped)
+        return dropped
+
+    def recv(self, sock, want_addrs=True):
+        """
+        Receive up to size datagrams from a non-blocking socket.
+
+        Args:
+            sock (socket.socket): The socket.
+            want_addrs (bool): Fill in addrs; skip it if the sources are
+                not needed.
+
+        Returns:
+            int: Number of datagrams received (0 if none were waiting).
+        """
+        self.kernel_drops = 0
+        if self.mmsg and _family(sock) == socket.AF_INET:
+            return self._recv_mmsg(sock, want_addrs)
+        return self._recv_each(sock)
+
+    def _recv_mmsg(self, sock, want_addrs):
+        raw = self._recv_raw
+        # The kernel only rewrites the headers of the messages it filled
+        for offset in range(0, self._filled * MMSG_SIZE, MMSG_SIZE):
+            MSG_NAMELEN.pack_into(raw, offset + MSG_NAMELEN_OFFSET, SOCKADDR_IN_SIZE)
+            MSG_CONTROLLEN.pack_into(raw, offset + MSG_CONTROLLEN_OFFSET, OVERFLOW_CMSG_SPACE)
+        count = _recvmmsg(sock.fileno(), self._recv_address, self.size, MSG_DONTWAIT, None)
+        stats = self.stats
+        stats["receive_calls"] += 1
+        if count <= 0:
+            self._filled = 0
+            if count == 0:
+                return 0
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(err, os.strerror(err))
+        self._filled = count
+
+        lengths = self.lengths
+        truncated = 0
+        for i in range(count):
+            flags, length = MSG_FLAGS_LEN.unpack_from(raw, i * MMSG_SIZE + MSG_FLAGS_OFFSET)
+            lengths[i] = length
+            if flags & MSG_TRUNC:
+                truncated += 1
+        if want_addrs:
+            addrs = self.addrs
+            names = self._recv_names_raw
+            cache = self._addr_cache
+            for i in range(count):
+                _, port, ip = SOCKADDR_IN.unpack_from(names, i * SOCKADDR_IN_SIZE)
+                addr = cache.get((port, ip))
+                if addr is None:
+                    addr = (socket.inet_ntoa(NATIVE_U32.pack(ip)), socket.ntohs(port))
+                    self._raw_addr(addr)
+                addrs[i] = addr
+
+        stats["received"] += count
+        # Only the newest running total matters
+        offset = (count - 1) * MMSG_SIZE
+        if MSG_CONTROLLEN.unpack_from(raw, offset + MSG_CONTROLLEN_OFFSET)[0] >= OVERFLOW_CMSG.size:
+            _, level, kind, overflow = OVERFLOW_CMSG.unpack_from(
+                self._control_view, (count - 1) * OVERFLOW_CMSG_SPACE)
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                self._note_overflow(sock, overflow)
+        if truncated:
+            stats["truncated"] += truncated
+            if metrics.enabled:
+                TRUNCATED.inc(truncated)
+        if metrics.enabled:
+            BATCH_RECEIVE_CALLS.inc()
+            RECEIVED_PACKETS.inc(count)
+        return count
+
+    def _recv_each(self, sock):
+        views = self.views
+        lengths = self.lengths
+        addrs = self.addrs
+        count = truncated = 0
+        overflow = None
+        ancillary = OVERFLOW_CMSG_SPACE if SO_RXQ_OVFL is not None else 0
+        while count < self.size:
+            try:
+                if ancillary:
+                    nbytes, ancdata, flags, addr = sock.recvmsg_into([views[count]], ancillary)
+                    for level, kind, data in ancdata:
+                        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                            overflow = NATIVE_U32.unpack(data[:4])[0]
+                    if flags & socket.MSG_TRUNC:
+                        truncated += 1
+                else:
+                    nbytes, addr = sock.recvfrom_into(views[count])
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                continue
+            lengths[count] = nbytes
+            addrs[count] = addr
+            count += 1
+        self.stats["receive_calls"] += count + 1
+        self.stats["received"] += count
+        if overflow is not None:
+            self._note_overflow(sock, overflow)
+        if truncated:
+            self.stats["truncated"] += truncated
+            if metrics.enabled:
+                TRUNCATED.inc(truncated)
+        if metrics.enabled:
+            RECEIVED_PACKETS.inc(count)
+        return count
+
+    def send(self, sock, addr, slots):
+        """
+        Send received datagrams (possibly modified in place) on to one
+        destination, without copying them.
+
+        Args:
+            sock (socket.socket): Socket to send from.
+            addr (tuple): Destination (ip, port).
+            slots (list): Indices of the datagrams to send, in order.
+
+        Returns:
+            int: Number of datagrams sent.
+        """
+        if len(slots) > 1 and self.mmsg and _family(sock) == socket.AF_INET:
+            port, ip = self._raw_addr(addr)
+            names = self._send_names_raw
+            iov = self._send_iov_raw
+            raw = self._send_raw
+            base = self._slot_base
+            buffer_size = self.buffer_size
+            lengths = self.lengths
+            for n, slot in enumerate(slots):
+                SOCKADDR_IN.pack_into(names, n * SOCKADDR_IN_SIZE, socket.AF_INET, port, ip)
+                IOVEC.pack_into(iov, 2 * n * IOVEC.size, base + slot * buffer_size, lengths[slot])
+                MSG_IOVLEN.pack_into(raw, n * MMSG_SIZE + MSG_IOVLEN_OFFSET, 1)
+            return self._sendmmsg(sock, len(slots))
+
+        # A single datagram is cheaper with a plain sendto
+        sent = 0
+        views = self.views
+        lengths = self.lengths
+        for slot in slots:
+            try:
+                sock.sendto(views[slot][:lengths[slot]], addr)
+            except BlockingIOError:
+                self._short_send()
+                break
+            sent += 1
+        self.stats["send_calls"] += sent
+        return self._sent(sent)
+
+    def sendmany(self, sock, datagrams, addrs):
+        """
+        Send a list of datagrams, each either one buffer or a list of
+        buffers (header, payload) sent as one datagram without joining.
+
+        Args:
+            sock (socket.socket): Socket to send from.
+            datagrams (list): Up to size datagrams.
+            addrs (list | tuple): One (ip, port) per datagram, or a single
+                destination for all of them.
+
+        Returns:
+            int: Number of datagrams sent.
+        """
+        single = addrs.__class__ is tuple
+        if len(datagrams) > 1 and self.mmsg and _family(sock) == socket.AF_INET:
+            names = self._send_names_raw
+            iov = self._send_iov_raw
+            raw = self._send_raw
+            if single:
+                port, ip = self._raw_addr(addrs)
+            keep = []  # ctypes views over the buffers, alive until the call returns
+            for n, datagram in enumerate(datagrams):
+                if not single:
+                    port, ip = self._raw_addr(addrs[n])
+                SOCKADDR_IN.pack_into(names, n * SOCKADDR_IN_SIZE, socket.AF_INET, port, ip)
+                parts = datagram if datagram.__class__ in (list, tuple) else (datagram,)
+                for k, part in enumerate(parts[:2]):
+                    IOVEC.pack_into(iov, (2 * n + k) * IOVEC.size, _buffer_address(part, keep), len(part))
+                MSG_IOVLEN.pack_into(raw, n * MMSG_SIZE + MSG_IOVLEN_OFFSET, min(len(parts), 2))
+            return self._sendmmsg(sock, len(datagrams))
+
+        sent = 0
+        for n, datagram in enumerate(datagrams):
+            addr = addrs if single else addrs[n]
+            try:
+                if datagram.__class__ in (list, tuple):
+                    if HAS_SENDMSG:
+                        sock.sendmsg(datagram, (), 0, addr)
+                    else:
+                        sock.sendto(b''.join(datagram), addr)
+                else:
+                    sock.sendto(datagram, addr)
+            except BlockingIOError:
+                self._short_send()
+                break
+            sent += 1
+        self.stats["send_calls"] += sent
+        return self._sent(sent)
+
+    def _sendmmsg(self, sock, count):
+        sent = _sendmmsg(sock.fileno(), self._send_address, count, 0)
+        self.stats["send_calls"] += 1
+        if metrics.enabled:
+            BATCH_SEND_CALLS.inc()
+        if sent < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self._short_send()
+                return 0
+            raise OSError(err, os.strerror(err))
+        if sent < count:
+            self._short_send()
+        return self._sent(sent)
+
+    def _short_send(self):
+        self.stats["short_sends"] += 1
+        if metrics.enabled:
+            SHORT_SENDS.inc()
+
+    def _sent(self, sent):
+        self.stats["sent"] += sent
+        if metrics.enabled:
+            SENT_PACKETS.inc(sent)
+        return sent
+
+def _buffer_address(part, keep):
+    """
+    Address of a buffer's first byte for an iovec. Read-only buffers other
+    than bytes are copied.
+    """
+    if part.__class__ is bytes:
+        return ctypes.cast(ctypes.c_char_p(part), ctypes.c_void_p).value
+    try:
+        view = (ctypes.c_char * len(part)).from_buffer(part)
+    except TypeError:
+        view = ctypes.create_string_buffer(bytes(part), len(part))
+    keep.append(view)
+    return ctypes.addressof(view)
@@ -0,0 +1,250 @@
+'''
+Call recording sink
+
+CallRecorder takes decoded 20 ms frames from the receive/playout path and
+copies them into fixed-size blocks (1 s by default). Full blocks go to a
+shared background RecordingWriter thread, which does all of the file I/O,
+so the playout thread never touches the disk. For WAV output the writer
+uses the wave module, which patches the RIFF header sizes on close.
+
+Memory per recording is bounded: each recorder owns a small pool of
+blocks. If the disk falls so far behind that the pool runs dry, the next
+block's worth of audio is dropped (and counted), and the writer puts the
+same amount of silence in its place. The timeline stays correct either
+way. When sequence numbers are supplied, gaps (lost packets) are filled
+with silence the same way.
+'''
+
+import collections
+import queue
+import threading
+import wave
+import numpy as np
+
+MAX_GAP_FRAMES = 250  # longest sequence gap filled with silence (5 s)
+
+class RecordingWriter:
+    """
+    Background thread that writes blocks for any number of recorders.
+    """
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="recording-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, recorder, block, samples, silence_samples):
+        self._queue.put((recorder, block, samples, silence_samples))
+
+    def finish(self, recorder):
+        self._queue.put((recorder, None, -1, 0))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            recorder, block, samples, silence_samples = self._queue.get()
+            try:
+                if silence_samples:
+                    recorder._write(bytes(2 * silence_samples))
+                if samples < 0:
+                    recorder._close_file()
+                    continue
+                if block is not None:
+                    recorder._write(block[:samples].tobytes())
+            except OSError as e:
+                recorder.stats["write_errors"] += 1
+                print(f"Error writing recording {recorder.path}: {e}")
+            if block is not None:
+                recorder._release(block)
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+def get_default_writer():
+    """
+    The process-wide writer thread, started on first use.
+    """
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            _default_writer = RecordingWriter()
+        return _default_writer
+
+class CallRecorder:
+    def __init__(self, path, sample_rate=8000, frame_samples=160, block_frames=50, max_blocks=8,
+                 raw=False, writer=None):
+        """
+        Args:
+            path (str): Output file.
+            sample_rate (int): Sample rate of the frames.
+            frame_samples (int): Samples per frame.
+            block_frames (int): Frames per block handed to the writer.
+            max_blocks (int): Blocks this recording may hold (in flight plus
+                the one being filled); bounds its memory.
+            raw (bool): Write headerless 16-bit PCM instead of WAV.
+            writer (RecordingWriter): Writer thread; the shared one if None.
+        """
+        self.path = path
+        self.frame_samples = frame_samples
+        self.block_samples = block_frames * frame_samples
+        self.max_blocks = max_blocks
+        self.writer = writer or get_default_writer()
+
+        if raw:
+            self._file = open(path, 'wb')
+            self._wave = None
+        else:
+            self._wave = wave.open(path, 'wb')
+            self._wave.setnchannels(1)
+            self._wave.setsampwidth(2)
+            self._wave.setframerate(sample_rate)
+            self._file = None
+
+        self._pool = collections.deque(np.zeros(self.block_samples, dtype=np.int16)
+                                       for _ in range(max_blocks))
+        self._block = self._pool.popleft()
+        self._fill = 0
+        self._silence_pending = 0  # samples dropped since the last submitted block
+        self._skip = 0             # samples still to drop in the current dropped block
+        self._next_seq = None
+        self._frame_len = frame_samples  # length of the last real frame, used for gaps
+        self._closed = False
+        self.done = threading.Event()
+
+        self.stats = {
+            "frames": 0,
+            "frames_concealed": 0,
+            "frames_filled": 0,
+            "frames_late": 0,
+            "blocks_written": 0,
+            "dropped_blocks": 0,
+            "max_queue_depth": 0,
+            "write_errors": 0,
+            "bytes_written": 0,
+        }
+
+    @property
+    def queue_depth(self):
+        """
+        Blocks handed to the writer and not yet written.
+        """
+        return self.max_blocks - len(self._pool) - (1 if self._block is not None else 0)
+
+    def write_frame(self, frame, seq=None):
+        """
+        Add one frame (int16 array of any length, or None for a
+        lost/concealed frame as long as the last real one). Never blocks.
+
+        Args:
+            frame (np.ndarray): Decoded samples.
+            seq (int): RTP sequence number, to fill gaps in arrival-order
+                input. Frames that arrive behind the timeline are dropped.
+        """
+        if self._closed:
+            return
+        if seq is not None:
+            if self._next_seq is not None:
+                delta = (seq - self._next_seq) & 0xFFFF
+                if delta >= 0x8000:
+                    self.stats["frames_late"] += 1
+                    return
+                for _ in range(min(delta, MAX_GAP_FRAMES)):
+                    self.stats["frames_filled"] += 1
+                    self._append(None)
+            self._next_seq = (seq + 1) & 0xFFFF
+        self.stats["frames"] += 1
+        if frame is None:
+            self.stats["frames_concealed"] += 1
+        self._append(frame)
+
+    def _append(self, frame):
+        # Frames need not divide the block size: a frame that crosses the
+        # end of a block is split, and the rest starts the next one
+        if frame is None:
+            n = self._frame_len
+        else:
+            n = self._frame_len = len(frame)
+        offset = 0
+        while offset < n:
+            if self._skip:
+                # Inside a dropped block: account for it as silence
+                take = min(self._skip, n - offset)
+                self._skip -= take
+                self._silence_pending += take
+                offset += take
+                continue
+            if self._block is None:
+                if not self._pool:
+                    # Writer is behind and this recording is at its memory bound
+                    self.stats["dropped_blocks"] += 1
+                    self._skip = self.block_samples
+                    continue
+                self._block = self._pool.popleft()
+                self._fill = 0
+
+            take = min(self.block_samples - self._fill, n - offset)
+            end = self._fill + take
+            if frame is None:
+                self._block[self._fill:end] = 0
+            else:
+                self._block[self._fill:end] = frame[offset:offset + take]
+            self._fill = end
+            offset += take
+            if end >= self.block_samples:
+                self._submit()
+
+    def _submit(self):
+        self.writer.submit(self, self._block, self._fill, self._silence_pending)
+        self._silence_pending = 0
+        self._block = None
+        self._fill = 0
+        depth = self.queue_depth
+        if depth > self.stats["max_queue_depth"]:
+            self.stats["max_queue_depth"] = depth
+
+    def close(self, wait=True, timeout=None):
+        """
+        Flush the partial block and finalize the file on the writer thread.
+
+        Args:
+            wait (bool): Block until the file is closed.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._block is not None and self._fill:
+            self._submit()
+        elif self._silence_pending:
+            self.writer.submit(self, None, 0, self._silence_pending)
+            self._silence_pending = 0
+        self.writer.finish(self)
+        if wait:
+            self.done.wait(timeout)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats["queue_depth"] = self.queue_depth
+        return stats
+
+    # --- writer thread side ----------------------------------------------
+
+    def _write(self, data):
+        if self._wave is not None:
+            self._wave.writeframesraw(data)
+        else:
+            self._file.write(data)
+        self.stats["bytes_written"] += len(data)
+
+    def _release(self, block):
+        self.stats["blocks_written"] += 1
+        self._pool.append(block)
+
+    def _close_file(self):
+        try:
+            if self._wave is not None:
+                self._wave.close()  # patches the header sizes
+            else:
+                self._file.close()
+        finally:
+            self.done.set()
@@ -0,0 +1,451 @@
+'''
+RTCP statistics and Sender/Receiver Reports (RFC 3550)
+
+    - ReceiverStats: per-SSRC reception statistics updated in O(1) per RTP
+      packet (sequence tracking from appendix A.1, interarrival jitter from
+      A.8, cumulative and interval loss from A.3).
+    - SenderStats: packet/octet counters for outgoing Sender Reports.
+    - build_sr / build_rr / build_sdes: RTCP packet builders. Reports are
+      sent as compound packets (SR or RR followed by SDES CNAME).
+    - parse_rtcp: splits a compound packet into its SR/RR/SDES/BYE parts.
+    - rtcp_interval: the randomized report interval from section 6.3.
+'''
+
+import random
+import socket
+import struct
+import time
+from config import *
+
+RTCP_SR = 200
+RTCP_RR = 201
+RTCP_SDES = 202
+RTCP_BYE = 203
+SDES_CNAME = 1
+
+RTCP_HEADER = struct.Struct('!BBH')
+SR_SENDER_INFO = struct.Struct('!IIIIII')  # SSRC, NTP msw, NTP lsw, RTP ts, packets, octets
+REPORT_BLOCK = struct.Struct('!IIIIII')   # SSRC, fraction|cumulative, ext seq, jitter, LSR, DLSR
+
+NTP_EPOCH_OFFSET = 2208988800  # seconds from 1900 to 1970
+
+# Sequence validation constants from RFC 3550 appendix A.1
+RTP_SEQ_MOD = 1 << 16
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
+MIN_SEQUENTIAL = 2
+
+# Report interval constants from RFC 3550 section 6.3
+RTCP_MIN_INTERVAL = 5.0
+RTCP_COMPENSATION = 2.71828 - 1.5
+
+def ntp_timestamp(now=None):
+    """
+    Current wall-clock time as a 64-bit NTP timestamp (msw, lsw).
+    """
+    now = time.time() if now is None else now
+    seconds = int(now)
+    fraction = int((now - seconds) * (1 << 32)) & 0xFFFFFFFF
+    return seconds + NTP_EPOCH_OFFSET, fraction
+
+def ntp_middle32(msw, lsw):
+    """
+    The middle 32 bits of an NTP timestamp, as used in LSR.
+    """
+    return ((msw & 0xFFFF) << 16) | (lsw >> 16)
+
+class ReceiverStats:
+    """
+    Reception statistics for one source (SSRC).
+    """
+    def __init__(self, ssrc, clock_rate=8000):
+        self.ssrc = ssrc
+        self.clock_rate = clock_rate
+
+        self.max_seq = None
+        self.cycles = 0
+        self.base_seq = 0
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.probation = MIN_SEQUENTIAL
+        self.received = 0
+        self.expected_prior = 0
+        self.received_prior = 0
+
+        self.jitter = 0.0  # in timestamp units
+        self.transit = None
+
+        self.last_sr = 0            # middle 32 bits of the last SR's NTP time
+        self.last_sr_arrival = None
+
+    def _init_seq(self, seq):
+        self.base_seq = seq
+        self.max_seq = seq
+        self.bad_seq = RTP_SEQ_MOD + 1
+        self.cycles = 0
+        self.received = 0
+        self.received_prior = 0
+        self.expected_prior = 0
+
+    def update(self, seq, rtp_timestamp, arrival_time):
+        """
+        Account for one received RTP packet.
+
+        Args:
+            seq (int): 16-bit sequence number.
+            rtp_timestamp (int): RTP timestamp.
+            arrival_time (float): Arrival time in seconds (any monotonic clock).
+
+        Returns:
+            bool: False if the packet was rejected as out of sequence.
+        """
+        if self.max_seq is None:
+            # New source: it must pass probation before it is counted
+            self._init_seq(seq)
+            self.max_seq = (seq - 1) % RTP_SEQ_MOD
+            self.probation = MIN_SEQUENTIAL
+        udelta = (seq - self.max_seq) % RTP_SEQ_MOD
+
+        if self.probation:
+            # Source is not valid until MIN_SEQUENTIAL packets in sequence
+            if seq == (self.max_seq + 1) % RTP_SEQ_MOD:
+                self.probation -= 1
+                self.max_seq = seq
+                if self.probation == 0:
+                    self._init_seq(seq)
+                    self.received += 1
+                    self._update_jitter(rtp_timestamp, arrival_time)
+                    return True
+            else:
+                self.probation = MIN_SEQUENTIAL - 1
+                self.max_seq = seq
+            return False
+        elif udelta < MAX_DROPOUT:
+            # In order, with permissible gap
+            if seq < self.max_seq:
+                self.cycles += RTP_SEQ_MOD
+            self.max_seq = seq
+        elif udelta <= RTP_SEQ_MOD - MAX_MISORDER:
+            # The sequence number made a very large jump
+            if seq == self.bad_seq:
+                # Two sequential packets: assume the other side restarted
+                self._init_seq(seq)
+            else:
+                self.bad_seq = (seq + 1) % RTP_SEQ_MOD
+                return False
+        # else: duplicate or reordered packet
+
+        self.received += 1
+        self._update_jitter(rtp_timestamp, arrival_time)
+        return True
+
+    def _update_jitter(self, rtp_timestamp, arrival_time):
+        transit = arrival_time * self.clock_rate - rtp_timestamp
+        if self.transit is not None:
+            d = abs(transit - self.transit)
+            self.jitter += (d - self.jitter) / 16
+        self.transit = transit
+
+    def on_sender_report(self, ntp_msw, ntp_lsw, arrival_time):
+        """
+        Remember the last SR from this source for the LSR/DLSR fields.
+        """
+        self.last_sr = ntp_middle32(ntp_msw, ntp_lsw)
+        self.last_sr_arrival = arrival_time
+
+    @property
+    def extended_max_seq(self):
+        return self.cycles + (self.max_seq or 0)
+
+    @property
+    def expected(self):
+        return self.extended_max_seq - self.base_seq + 1
+
+    @property
+    def cumulative_lost(self):
+        return self.expected - self.received
+
+    @property
+    def jitter_ms(self):
+        return self.jitter * 1000 / self.clock_rate
+
+    def report_block(self, now):
+        """
+        Build a 24-byte report block and start a new reporting interval.
+
+        Args:
+            now (float): Current time on the same clock as arrival_time.
+        """
+        expected = self.expected
+        expected_interval = expected - self.expected_prior
+        received_interval = self.received - self.received_prior
+        self.expected_prior = expected
+        self.received_prior = self.received
+        lost_interval = expected_interval - received_interval
+        if expected_interval == 0 or lost_interval <= 0:
+            fraction = 0
+        else:
+            fraction = min((lost_interval << 8) // expected_interval, 255)
+
+        # Cumulative loss is a signed 24-bit value, clamped
+        lost = max(min(self.cumulative_lost, 0x7FFFFF), -0x800000) & 0xFFFFFF
+
+        dlsr = 0
+        if self.last_sr_arrival is not None:
+            dlsr = int((now - self.last_sr_arrival) * 65536) & 0xFFFFFFFF
+
+        return REPORT_BLOCK.pack(self.ssrc, (fraction << 24) | lost,
+                                 self.extended_max_seq & 0xFFFFFFFF, int(self.jitter),
+                                 self.last_sr, dlsr)
+
+    def snapshot(self):
+        return {
+            "ssrc": self.ssrc,
+            "received": self.received,
+            "expected": self.expected if not self.probation else 0,
+            "lost": self.cumulative_lost if not self.probation else 0,
+            "extended_max_seq": self.extended_max_seq,
+            "jitter_ms": self.jitter_ms,
+        }
+
+class SenderStats:
+    """
+    Counters for the Sender Report of one outgoing stream.
+    """
+    def __init__(self, ssrc, clock_rate=8000):
+        self.ssrc = ssrc
+        self.clock_rate = clock_rate
+        self.packet_count = 0
+        self.octet_count = 0
+        self.last_rtp_timestamp = 0
+        self.last_send_time = None
+
+    def update(self, payload_len, rtp_timestamp, send_time):
+        self.packet_count += 1
+        self.octet_count += payload_len
+        self.last_rtp_timestamp = rtp_timestamp
+        self.last_send_time = send_time
+
+    def rtp_timestamp_at(self, now):
+        """
+        Extrapolate the RTP timestamp that corresponds to now.
+        """
+        if self.last_send_time is None:
+            return self.last_rtp_timestamp
+        elapsed = now - self.last_send_time
+        return (self.last_rtp_timestamp + int(elapsed * self.clock_rate)) & 0xFFFFFFFF
+
+def _header(count, packet_type, body_len):
+    # Length is in 32-bit words minus one, including the 4-byte header
+    return RTCP_HEADER.pack(0x80 | count, packet_type, (body_len + 4) // 4 - 1)
+
+def build_sr(sender, report_blocks=(), now=None, wallclock=None):
+    """
+    Build a Sender Report.
+
+    Args:
+        sender (SenderStats): Stats of the stream being reported.
+        report_blocks (list[bytes]): Report blocks for sources we receive.
+        now (float): Current time on the sender's send_time clock.
+        wallclock (float): Current time.time() used for the NTP field.
+    """
+    now = time.monotonic() if now is None else now
+    msw, lsw = ntp_timestamp(wallclock)
+    body = SR_SENDER_INFO.pack(sender.ssrc, msw, lsw, sender.rtp_timestamp_at(now),
+                               sender.packet_count & 0xFFFFFFFF,
+                               sender.octet_count & 0xFFFFFFFF)
+    body += b''.join(report_blocks)
+    return _header(len(report_blocks), RTCP_SR, len(body)) + body
+
+def build_rr(ssrc, report_blocks=()):
+    """
+    Build a Receiver Report.
+    """
+    body = struct.pack('!I', ssrc) + b''.join(report_blocks)
+    return _header(len(report_blocks), RTCP_RR, len(body)) + body
+
+def build_sdes(ssrc, cname):
+    """
+    Build an SDES packet carrying a single CNAME item.
+    """
+    cname = cname.encode('utf-8')[:255]
+    chunk = struct.pack('!IBB', ssrc, SDES_CNAME, len(cname)) + cname
+    # Item list ends with a null octet, then pad to a 32-bit boundary
+    chunk += b'\0' * (4 - len(chunk) % 4)
+    return _header(1, RTCP_SDES, len(chunk)) + chunk
+
+def build_bye(ssrc):
+    return _header(1, RTCP_BYE, 4) + struct.pack('!I', ssrc)
+
+def parse_rtcp(data):
+    """
+    Split a compound RTCP packet.
+
+    Yields:
+        tuple: (packet_type, count, body) for each RTCP packet, where body
+            is a memoryview of everything after the 4-byte header.
+    """
+    view = memoryview(data)
+    offset = 0
+    while offset + 4 <= len(view):
+        first, packet_type, length = RTCP_HEADER.unpack_from(view, offset)
+        if first >> 6 != 2:
+            return
+        end = offset + 4 * (length + 1)
+        if end > len(view):
+            return
+        yield packet_type, first & 0x1F, view[offset + 4:end]
+        offset = end
+
+def parse_sender_info(body):
+    """
+    Unpack the sender info of an SR body.
+
+    Returns:
+        tuple: (ssrc, ntp_msw, ntp_lsw, rtp_timestamp, packet_count, octet_count)
+    """
+    return SR_SENDER_INFO.unpack_from(body)
+
+def parse_report_blocks(body, count, offset):
+    """
+    Unpack report blocks from an SR (offset 24) or RR (offset 4) body.
+
+    Yields:
+        dict: Fields of each report block.
+    """
+    for i in range(count):
+        ssrc, loss, ext_seq, jitter, lsr, dlsr = REPORT_BLOCK.unpack_from(body, offset + 24 * i)
+        lost = loss & 0xFFFFFF
+        if lost & 0x800000:
+            lost -= 1 << 24
+        yield {
+            "ssrc": ssrc,
+            "fraction_lost": (loss >> 24) / 256,
+            "cumulative_lost": lost,
+            "extended_max_seq": ext_seq,
+            "jitter": jitter,
+            "lsr": lsr,
+            "dlsr": dlsr,
+        }
+
+def rtcp_interval(members, senders, rtcp_bw, we_sent, avg_rtcp_size, initial):
+    """
+    Compute the randomized RTCP transmission interval (RFC 3550 6.3.1).
+
+    Args:
+        members (int): Number of session members.
+        senders (int): Number of active senders.
+        rtcp_bw (float): RTCP bandwidth in octets per second.
+        we_sent (bool): Whether we sent RTP since the last report.
+        avg_rtcp_size (float): Average compound RTCP packet size in octets.
+        initial (bool): True for the first report.
+
+    Returns:
+        float: Seconds until the next report.
+    """
+    min_interval = RTCP_MIN_INTERVAL / 2 if initial else RTCP_MIN_INTERVAL
+    n = members
+    if 0 < senders <= members * 0.25:
+        if we_sent:
+            rtcp_bw *= 0.25
+            n = senders
+        else:
+            rtcp_bw *= 0.75
+            n = members - senders
+    interval = max(avg_rtcp_size * n / rtcp_bw, min_interval)
+    return interval * random.uniform(0.5, 1.5) / RTCP_COMPENSATION
+
+def default_cname():
+    return f"{socket.gethostname()}@{LOCAL_IP}"
+
+class RtcpReporter:
+    """
+    RTCP state of one local participant: reception stats per remote SSRC,
+    optional sender stats, and the report schedule.
+    """
+    def __init__(self, ssrc=None, cname=None, clock_rate=8000, session_bw=8700):
+        """
+        Args:
+            ssrc (int): Our SSRC (random if None).
+            cname (str): Canonical name for SDES.
+            clock_rate (int): RTP clock rate of the media.
+            session_bw (float): Session bandwidth in octets per second
+                (PCMU at 50 packets/s is about 8700 including RTP headers).
+        """
+        self.ssrc = random.getrandbits(32) if ssrc is None else ssrc
+        self.cname = cname or default_cname()
+        self.clock_rate = clock_rate
+        self.rtcp_bw = session_bw * 0.05
+
+        self.sources = {}
+        self.sender = None
+        self.remote_reports = {}
+        self.we_sent = False
+        self.initial = True
+        self.avg_rtcp_size = 128.0
+        self.reports_sent = 0
+
+    def on_rtp_received(self, ssrc, seq, rtp_timestamp, arrival_time):
+        stats = self.sources.get(ssrc)
+        if stats is None:
+            stats = self.sources[ssrc] = ReceiverStats(ssrc, self.clock_rate)
+        stats.update(seq, rtp_timestamp, arrival_time)
+
+    def on_rtp_sent(self, payload_len, rtp_timestamp, send_time):
+        if self.sender is None:
+            self.sender = SenderStats(self.ssrc, self.clock_rate)
+        self.sender.update(payload_len, rtp_timestamp, send_time)
+        self.we_sent = True
+
+    def on_rtcp_received(self, data, arrival_time):
+        """
+        Process an incoming compound RTCP packet.
+        """
+        self.avg_rtcp_size += (len(data) + 28 - self.avg_rtcp_size) / 16
+        for packet_type, count, body in parse_rtcp(data):
+            if packet_type == RTCP_SR and len(body) >= 24:
+                ssrc, msw, lsw = parse_sender_info(body)[:3]
+                stats = self.sources.get(ssrc)
+                if stats is not None:
+                    stats.on_sender_report(msw, lsw, arrival_time)
+                self._store_reports(body, count, 24)
+            elif packet_type == RTCP_RR and len(body) >= 4:
+                self._store_reports(body, count, 4)
+
+    def _store_reports(self, body, count, offset):
+        count = min(count, (len(body) - offset) // 24)
+        for block in parse_report_blocks(body, count, offset):
+            if block["ssrc"] == self.ssrc:
+                self.remote_reports[block["ssrc"]] = block
+
+    def build_report(self, now=None):
+        """
+        Build the next compound report (SR if we sent RTP, else RR).
+        """
+        now = time.monotonic() if now is None else now
+        blocks = [stats.report_block(now) for stats in self.sources.values()
+                  if not stats.probation][:31]
+        if self.we_sent and self.sender is not None:
+            report = build_sr(self.sender, blocks, now)
+        else:
+            report = build_rr(self.ssrc, blocks)
+        packet = report + build_sdes(self.ssrc, self.cname)
+        self.avg_rtcp_size += (len(packet) + 28 - self.avg_rtcp_size) / 16
+        self.we_sent = False
+        self.initial = False
+        self.reports_sent += 1
+        return packet
+
+    def next_interval(self):
+        """
+        Seconds until the next report should be sent.
+        """
+        members = len(self.sources) + 1
+        senders = len(self.sources) + (1 if self.sender is not None else 0)
+        return rtcp_interval(members, senders, self.rtcp_bw, self.we_sent,
+                             self.avg_rtcp_size, self.initial)
+
+    def snapshot(self):
+        """
+        Live per-SSRC loss and jitter.
+        """
+        return {ssrc: stats.snapshot() for ssrc, stats in self.sources.items()}
@@ -0,0 +1,442 @@
+'''
+asyncio media transport for RTP/RTCP
+
+Every session is a pair of DatagramProtocol endpoints (RTP and, optionally,
+RTCP) on the running event loop, so one process can carry many streams
+without a reader thread or a sleeping sender thread per call.
+
+    - RtpReceiveSession: receives RTP into a JitterBuffer and yields decoded
+      G.711 frames on a 20 ms playout clock (or raw packets as they arrive).
+    - RtpSendSession: packetizes encoded frames and sends them against
+      absolute loop-time deadlines. Frames are pulled from their source in
+      the default executor, a bounded batch ahead, because the source may
+      read and encode a file.
+
+When an RTCP port is given, a session keeps RFC 3550 statistics in an
+rtcp.RtcpReporter and sends SR/RR compound packets on the randomized
+report interval.
+
+The blocking helpers in audio_handler and rtp_stream are thin wrappers
+around these sessions.
+'''
+
+import asyncio
+import itertools
+import struct
+import time
+import metrics
+from config import *
+from jitter_buffer import JitterBuffer
+from rtp_packet import RtpPacket, RtpPacketizer, RTP_HEADER_SIZE
+from rtcp import RtcpReporter, build_bye
+from rtp_capture import CHANNEL_RTP, CHANNEL_RTCP
+
+_SEQ_TS_SSRC = struct.Struct('!HII')
+
+READ_AHEAD_FRAMES = 25  # frames pulled from the source per executor call (0.5 s)
+
+DECODED_FRAMES = metrics.counter("rtp.decoded_frames")
+MALFORMED_PACKETS = metrics.counter("rtp.malformed_packets")
+DECODE_MS = metrics.histogram("rtp.decode_ms")
+
+class DatagramEndpoint(asyncio.DatagramProtocol):
+    """
+    Forwards every datagram to a callback.
+    """
+    def __init__(self, on_datagram, name="endpoint"):
+        self.on_datagram = on_datagram
+        self.name = name
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.on_datagram(data, addr)
+
+    def error_received(self, exc):
+        print(f"[{self.name}] Socket error: {exc}")
+
+async def run_rtcp_reports(reporter, transport, get_destination):
+    """
+    Send a compound RTCP report every randomized interval until cancelled.
+
+    Args:
+        reporter (RtcpReporter): Source of the reports.
+        transport (asyncio.DatagramTransport): RTCP transport to send on.
+        get_destination (callable): Returns the peer's RTCP address, or
+            None while it is still unknown.
+    """
+    while True:
+        await asyncio.sleep(reporter.next_interval())
+        addr = get_destination()
+        if addr is not None:
+            transport.sendto(reporter.build_report(), addr)
+
+async def open_endpoint(on_datagram=None, local_addr=None, remote_addr=None, name="endpoint"):
+    """
+    Create a UDP endpoint on the running loop.
+
+    Returns:
+        asyncio.DatagramTransport: The transport of the new endpoint.
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: DatagramEndpoint(on_datagram or (lambda data, addr: None), name),
+        local_addr=local_addr, remote_addr=remote_addr)
+    return transport
+
+class RtpReceiveSession:
+    def __init__(self, port, rtcp_port=None, host='0.0.0.0', codec=AUDIO_CODEC, jitter_buffer=None,
+                 use_jitter_buffer=True, on_rtcp=None, capture=None):
+        """
+        Args:
+            port (int): Port to listen for RTP packets.
+            rtcp_port (int): Port to listen for RTCP packets (optional).
+            host (str): Local address to bind.
+            codec (str): G.711 codec name used to decode payloads.
+            jitter_buffer (JitterBuffer): Buffer to use; one is created if None.
+            use_jitter_buffer (bool): If False, packets() hands out packets in
+                arrival order without buffering.
+            on_rtcp (callable): Called with (data, addr) for each RTCP packet.
+            capture (rtp_capture.CaptureWriter): Record every datagram received.
+        """
+        self.port = port
+        self.rtcp_port = rtcp_port
+        self.host = host
+        from g711 import get_codec  # NumPy is only loaded by receivers
+        self.codec = get_codec(codec)
+        self.jitter_buffer = None
+        if use_jitter_buffer:
+            self.jitter_buffer = jitter_buffer or JitterBuffer()
+        self.on_rtcp = on_rtcp
+        self.rtcp = RtcpReporter() if rtcp_port else None
+        self.capture = capture
+        from vad import ComfortNoiseGenerator
+        frame_duration = self.jitter_buffer.frame_duration if self.jitter_buffer is not None else 20
+        self.comfort_noise = ComfortNoiseGenerator(frame_duration * 8)
+
+        self.rtp_transport = None
+        self.rtcp_transport = None
+        self.remote_addr = None
+        self.remote_rtcp_addr = None
+        self.packets_received = 0
+        self.rtcp_received = 0
+        self._rtcp_task = None
+
+        self._packet = RtpPacket()
+        self._queue = None
+        self._wakeup = None
+        self._closed_event = None
+        self._closed = False
+
+    async def open(self):
+        self._queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._closed_event = asyncio.Event()
+        self.rtp_transport = await open_endpoint(self._on_rtp, (self.host, self.port), name="rtp-recv")
+        if self.rtcp_port:
+            self.rtcp_transport = await open_endpoint(self._on_rtcp, (self.host, self.rtcp_port),
+                                                      name="rtcp-recv")
+            self._rtcp_task = asyncio.get_running_loop().create_task(
+                run_rtcp_reports(self.rtcp, self.rtcp_transport, self._rtcp_destination))
+        return self
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def _on_rtp(self, data, addr):
+        now = time.monotonic()
+        if self.capture is not None:
+            self.capture.write(data, CHANNEL_RTP)
+        self.feed_rtp(data, now, addr)
+
+    def _on_rtcp(self, data, addr):
+        now = time.monotonic()
+        if self.capture is not None:
+            self.capture.write(data, CHANNEL_RTCP)
+        self.feed_rtcp(data, now, addr)
+
+    def feed_rtp(self, data, arrival_time, addr=None):
+        """
+        Run one RTP datagram through the receive path. Called for every
+        packet from the socket; rtp_capture's replayer calls it directly
+        with recorded arrival times.
+        """
+        if len(data) < RTP_HEADER_SIZE:
+            return
+        self.packets_received += 1
+        if addr is not None:
+            self.remote_addr = addr
+        if self.rtcp is not None:
+            seq, timestamp, ssrc = _SEQ_TS_SSRC.unpack_from(data, 2)
+            self.rtcp.on_rtp_received(ssrc, seq, timestamp, arrival_time)
+        if self.jitter_buffer is not None:
+            self.jitter_buffer.add_packet(data, arrival_time)
+            if self._wakeup is not None:
+                self._wakeup.set()
+        elif self._queue is not None:
+            self._queue.put_nowait(data)
+
+    def feed_rtcp(self, data, arrival_time, addr=None):
+        self.rtcp_received += 1
+        if addr is not None:
+            self.remote_rtcp_addr = addr
+        if self.rtcp is not None:
+            self.rtcp.on_rtcp_received(data, arrival_time)
+        if self.on_rtcp:
+            self.on_rtcp(data, addr)
+
+    def _rtcp_destination(self):
+        # Prefer where the peer's RTCP comes from; else assume RTP port + 1
+        if self.remote_rtcp_addr is not None:
+            return self.remote_rtcp_addr
+        if self.remote_addr is not None:
+            return self.remote_addr[0], self.remote_addr[1] + 1
+        return None
+
+    def get_stats(self):
+        """
+        Per-SSRC reception statistics (loss, jitter) plus jitter buffer counters.
+        """
+        stats = {"packets_received": self.packets_received, "rtcp_received": self.rtcp_received}
+        if self.rtcp is not None:
+            stats["sources"] = self.rtcp.snapshot()
+        if self.jitter_buffer is not None:
+            stats["jitter_buffer"] = self.jitter_buffer.get_stats()
+        return stats
+
+    def decode(self, packet, now=None):
+        """
+        Decode the G.711 payload of an RTP packet to int16 PCM. Returns None
+        for a malformed packet. A comfort-noise packet sets the noise level
+        and decodes to a frame of comfort noise.
+        """
+        start = time.perf_counter() if metrics.enabled else 0.0
+        try:
+            parsed = self._packet.unpack(packet)
+        except ValueError:
+            if metrics.enabled:
+                MALFORMED_PACKETS.inc()
+            return None
+        if parsed.second_byte & 0x7F == CN_PAYLOAD_TYPE:
+            return self.comfort_noise.update(parsed.payload, time.monotonic() if now is None else now)
+        if self.comfort_noise.level is not None:
+            self.comfort_noise.stop()
+        decoded = self.codec.decode(parsed.payload)
+        if not metrics.enabled:
+            return decoded
+        DECODE_MS.observe_since(start)
+        DECODED_FRAMES.inc()
+        return decoded
+
+    async def packets(self):
+        """
+        Yield raw RTP packets in arrival order (no jitter buffer).
+        """
+        while not self._closed:
+            packet = await self._queue.get()
+            if packet is None:
+                return
+            yield packet
+
+    def playout(self, now=None):
+        """
+        One playout tick: take the due frame from the jitter buffer and
+        decode it.
+
+        Between talkspurts of a stream that sends comfort noise, gaps and
+        underruns are filled with noise at the last signalled level.
+
+        Returns:
+            tuple: (ready, frame). ready is False while buffering; frame is
+                None for a lost or malformed frame (to be concealed).
+        """
+        if now is None:
+            now = time.monotonic()
+        ready, packet = self.jitter_buffer.poll(now)
+        if ready and packet is not None:
+            return True, self.decode(packet, now)
+        if self.comfort_noise.active(now):
+            return True, self.comfort_noise.frame()
+        return ready, None
+
+    async def frames(self):
+        """
+        Yield one decoded int16 frame per playout tick. Lost frames and
+        underruns yield silence. Idles without waking while nothing arrives.
+        """
+        import numpy as np
+        jitter_buffer = self.jitter_buffer
+        frame_s = jitter_buffer.frame_duration / 1000
+        silence = np.zeros(jitter_buffer.frame_duration * 8, dtype=np.int16)
+        loop = asyncio.get_running_loop()
+        deadline = None
+
+        while not self._closed:
+            ready, decoded_audio = self.playout()
+            if not ready:
+                deadline = None
+                self._wakeup.clear()
+                if len(jitter_buffer):
+                    # Prefilling: check again shortly
+                    await asyncio.sleep(frame_s / 2)
+                else:
+                    await self._wakeup.wait()
+                continue
+
+            yield silence if decoded_audio is None else decoded_audio
+
+            now = loop.time()
+            deadline = now + frame_s if deadline is None else deadline + frame_s
+            if deadline < now - frame_s:
+                deadline = now
+            await asyncio.sleep(deadline - now)
+
+    async def wait_closed(self):
+        await self._closed_event.wait()
+
+    def send_rtcp(self, data, addr):
+        if self.rtcp_transport is not None:
+            self.rtcp_transport.sendto(data, addr)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._queue is not None:
+            self._queue.put_nowait(None)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._closed_event is not None:
+            self._closed_event.set()
+        if self._rtcp_task is not None:
+            self._rtcp_task.cancel()
+            addr = self._rtcp_destination()
+            if addr is not None:
+                self.rtcp_transport.sendto(self.rtcp.build_report() + build_bye(self.rtcp.ssrc), addr)
+        for transport in (self.rtp_transport, self.rtcp_transport):
+            if transport is not None:
+                transport.close()
+        if self.jitter_buffer is not None:
+            self.jitter_buffer.close()
+
+def _take(frames, count):
+    # Runs in the executor
+    return list(itertools.islice(frames, count))
+
+class RtpSendSession:
+    def __init__(self, ip, port, rtcp_port=None, frame_duration=20, ssrc=SSRC,
+                 payload_type=PAYLOAD_TYPE, on_rtcp=None):
+        """
+        Args:
+            ip (str): Destination IP address.
+            port (int): Destination RTP port.
+            rtcp_port (int): Destination RTCP port (optional).
+            frame_duration (int): Duration of each audio frame in milliseconds.
+            ssrc (int): SSRC to put in the RTP header.
+            payload_type (int): RTP payload type.
+            on_rtcp (callable): Called with (data, addr) for RTCP replies.
+        """
+        self.addr = (ip, port)
+        self.rtcp_addr = (ip, rtcp_port) if rtcp_port else None
+        self.frame_duration = frame_duration
+        self.ssrc = ssrc
+        self.payload_type = payload_type
+        self.on_rtcp = on_rtcp
+
+        self.packetizer = RtpPacketizer(ssrc, payload_type, frame_duration * 8)
+        self.rtcp = RtcpReporter(ssrc) if rtcp_port else None
+        self.packets_sent = 0
+        self.bytes_sent = 0
+        self.packets_suppressed = 0
+        self.late_max = 0.0
+
+        self.rtp_transport = None
+        self.rtcp_transport = None
+        self._rtcp_task = None
+
+    async def open(self):
+        self.rtp_transport = await open_endpoint(remote_addr=self.addr, name="rtp-send")
+        if self.rtcp_addr:
+            self.rtcp_transport = await open_endpoint(self._on_rtcp, remote_addr=self.rtcp_addr,
+                                                      name="rtcp-send")
+            self._rtcp_task = asyncio.get_running_loop().create_task(
+                run_rtcp_reports(self.rtcp, self.rtcp_transport, lambda: self.rtcp_addr))
+        return self
+
+    def _on_rtcp(self, data, addr):
+        self.rtcp.on_rtcp_received(data, time.monotonic())
+        if self.on_rtcp:
+            self.on_rtcp(data, addr)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def send_frame(self, payload, marker=False, payload_type=None):
+        """
+        Packetize one encoded frame and send it immediately.
+        """
+        timestamp = self.packetizer.timestamp
+        rtp_packet = self.packetizer.packetize(payload, marker, payload_type)
+        self.rtp_transport.sendto(rtp_packet)
+        self.packets_sent += 1
+        self.bytes_sent += len(rtp_packet)
+        if self.rtcp is not None:
+            self.rtcp.on_rtp_sent(len(payload), timestamp, time.monotonic())
+
+    async def send_frames(self, frames, read_ahead=READ_AHEAD_FRAMES):
+        """
+        Send an iterable of encoded frames paced on absolute deadlines.
+        Special packets and suppressed frames are given as for
+        RtpScheduler.add_stream.
+
+        The next read_ahead frames are pulled from the source in the
+        default executor while the current ones are sent. Disk reads and
+        encoding in the source then never block the event loop, and at
+        most two batches are held in memory.
+        """
+        loop = asyncio.get_running_loop()
+        frame_s = self.frame_duration / 1000
+        frames = iter(frames)
+        batch = await loop.run_in_executor(None, _take, frames, read_ahead)
+        start = loop.time()
+        frame_index = 0
+        while batch:
+            pending = loop.run_in_executor(None, _take, frames, read_ahead)
+            for payload in batch:
+                deadline = start + frame_index * frame_s
+                frame_index += 1
+                if payload is None:
+                    self.packetizer.skip()
+                    self.packets_suppressed += 1
+                    continue
+                delay = deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if payload.__class__ is tuple:
+                    payload, payload_type, marker = payload
+                    self.send_frame(payload, marker, payload_type)
+                else:
+                    self.send_frame(payload)
+                self.late_max = max(self.late_max, loop.time() - deadline)
+            batch = await pending
+
+    def send_rtcp(self, data):
+        if self.rtcp_transport is not None:
+            self.rtcp_transport.sendto(data)
+
+    def close(self):
+        if self._rtcp_task is not None:
+            self._rtcp_task.cancel()
+            # Connected transport: asyncio rejects an explicit address
+            self.rtcp_transport.sendto(self.rtcp.build_report() + build_bye(self.ssrc))
+        for transport in (self.rtp_transport, self.rtcp_transport):
+            if transport is not None:
+                transport.close()
@@ -0,0 +1,434 @@
+'''
+RTP/RTCP capture files and offline replay
+
+Capture format (all integers big-endian):
+    file header   magic b'RTPC', version (H), flags (H), start wall time (d)
+    record        arrival offset in microseconds (Q), channel (B), length (H),
+                  then the datagram itself
+Records are only ever appended. A sidecar index (<capture>.idx) holds one
+(offset us, file position) pair per index_interval seconds of capture, so
+a reader can seek to a point in time without scanning the whole file. A
+missing or stale index is rebuilt in memory by one scan; a torn final
+record (writer killed mid-write) is ignored.
+
+Replay:
+    - replay_to_session() drives an rtp_async.RtpReceiveSession directly
+      (jitter buffer, RTCP statistics, G.711 decode) on a virtual clock, so
+      it is deterministic and can run unthrottled, far faster than real
+      time, with no sockets or audio device.
+    - replay_to_socket() re-sends the datagrams over UDP to a live receiver
+      at 1x, Nx or unthrottled speed.
+Both can pass the capture through an Impairment (random loss, reordering,
+extra jitter) first.
+'''
+
+import bisect
+import heapq
+import mmap
+import os
+import random
+import selectors
+import socket
+import struct
+import time
+
+MAGIC = b'RTPC'
+VERSION = 1
+FILE_HEADER = struct.Struct('!4sHHd')
+RECORD_HEADER = struct.Struct('!QBH')
+INDEX_ENTRY = struct.Struct('!QQ')
+
+CHANNEL_RTP = 0
+CHANNEL_RTCP = 1
+
+MAX_DATAGRAM = 65535
+
+class CaptureWriter:
+    def __init__(self, path, index_interval=1.0):
+        """
+        Open a capture for appending, creating it if needed.
+
+        Args:
+            path (str): Capture file path.
+            index_interval (float): Seconds of capture between index entries.
+        """
+        self.path = path
+        self.index_interval_us = int(index_interval * 1e6)
+        new = not os.path.exists(path) or os.path.getsize(path) < FILE_HEADER.size
+        self._file = open(path, 'ab')
+        self._index = open(f"{path}.idx", 'ab')
+        if new:
+            self._file.truncate(0)
+            self._index.truncate(0)
+            self.start_time = time.time()
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, 0, self.start_time))
+        else:
+            with open(path, 'rb') as f:
+                magic, version, _, self.start_time = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f"{path} is not an RTP capture (version {VERSION})")
+                end = self._complete_end(f)
+            # Drop a torn last record, and index entries that point past it
+            self._file.truncate(end)
+            self._index.flush()
+            with open(f"{path}.idx", 'rb') as f:
+                raw = f.read()
+            entries = [entry for entry in INDEX_ENTRY.iter_unpack(raw[:len(raw) - len(raw) % INDEX_ENTRY.size])
+                       if entry[1] < end]
+            self._index.truncate(0)
+            self._index.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+        # Offsets continue from the wall clock so appended sessions stay ordered
+        self._mono_base = time.monotonic() - (time.time() - self.start_time)
+        self._next_index_us = 0
+        self.records = 0
+
+    @staticmethod
+    def _complete_end(f):
+        """
+        Scan record headers like CaptureReader._scan_positions.
+
+        Returns:
+            int: File position just past the last complete record.
+        """
+        size = os.fstat(f.fileno()).st_size
+        position = FILE_HEADER.size
+        header_size = RECORD_HEADER.size
+        while position + header_size <= size:
+            f.seek(position)
+            _, _, length = RECORD_HEADER.unpack(f.read(header_size))
+            if position + header_size + length > size:
+                break  # torn last record
+            position += header_size + length
+        return position
+
+    def write(self, data, channel=CHANNEL_RTP, arrival_time=None):
+        """
+        Append one datagram.
+
+        Args:
+            data (bytes-like): The datagram.
+            channel (int): CHANNEL_RTP or CHANNEL_RTCP.
+            arrival_time (float): time.monotonic() of arrival; now if None.
+        """
+        if arrival_time is None:
+            arrival_time = time.monotonic()
+        offset_us = max(0, int((arrival_time - self._mono_base) * 1e6))
+        if offset_us >= self._next_index_us:
+            self._index.write(INDEX_ENTRY.pack(offset_us, self._file.tell()))
+            self._next_index_us = offset_us + self.index_interval_us
+        self._file.write(RECORD_HEADER.pack(offset_us, channel, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def flush(self):
+        self._file.flush()
+        self._index.flush()
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class CaptureReader:
+    """
+    Memory-mapped reader. Records are (offset seconds, channel, memoryview).
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.start_time = FILE_HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an RTP capture (version {VERSION})")
+        self.view = memoryview(self._mmap)
+        self._index_times, self._index_positions = self._load_index()
+
+    def _load_index(self):
+        times, positions = [], []
+        try:
+            with open(f"{self.path}.idx", 'rb') as f:
+                raw = f.read()
+            for offset_us, position in INDEX_ENTRY.iter_unpack(raw[:len(raw) - len(raw) % INDEX_ENTRY.size]):
+                times.append(offset_us)
+                positions.append(position)
+        except FileNotFoundError:
+            pass
+        if not positions or positions[-1] >= len(self._mmap):
+            # Missing or stale: rebuild (one entry per second)
+            times, positions = [], []
+            next_us = 0
+            for position, offset_us in self._scan_positions(FILE_HEADER.size):
+                if offset_us >= next_us:
+                    times.append(offset_us)
+                    positions.append(position)
+                    next_us = offset_us + 1000000
+        return times, positions
+
+    def _scan_positions(self, position):
+        buf = self._mmap
+        end = len(buf)
+        header_size = RECORD_HEADER.size
+        while position + header_size <= end:
+            offset_us, _, length = RECORD_HEADER.unpack_from(buf, position)
+            if position + header_size + length > end:
+                return  # torn last record
+            yield position, offset_us
+            position += header_size + length
+
+    def records(self, start=0.0, end=None):
+        """
+        Yield (offset, channel, data) for records in [start, end) seconds.
+        data is a memoryview into the mapping.
+        """
+        position = FILE_HEADER.size
+        start_us = int(start * 1e6)
+        if start_us and self._index_times:
+            i = bisect.bisect_right(self._index_times, start_us) - 1
+            if i >= 0:
+                position = self._index_positions[i]
+        end_us = None if end is None else int(end * 1e6)
+
+        buf, view = self._mmap, self.view
+        size = len(buf)
+        header_size = RECORD_HEADER.size
+        unpack_from = RECORD_HEADER.unpack_from
+        while position + header_size <= size:
+            offset_us, channel, length = unpack_from(buf, position)
+            data_start = position + header_size
+            position = data_start + length
+            if position > size:
+                return
+            if offset_us < start_us:
+                continue
+            if end_us is not None and offset_us >= end_us:
+                return
+            yield offset_us / 1e6, channel, view[data_start:position]
+
+    def __iter__(self):
+        return self.records()
+
+    @property
+    def duration(self):
+        last = 0
+        for _, offset_us in self._scan_positions(self._index_positions[-1] if self._index_positions
+                                                 else FILE_HEADER.size):
+            last = offset_us
+        return last / 1e6
+
+    def close(self):
+        # Drop references; the mapping goes away with the last record view
+        self.view = None
+        self._mmap = None
+
+class Impairment:
+    def __init__(self, loss=0.0, reorder=0.0, jitter_ms=0.0, reorder_ms=60.0, seed=0):
+        """
+        Args:
+            loss (float): Probability of dropping each RTP packet.
+            reorder (float): Probability of holding an RTP packet back by
+                up to reorder_ms, so later packets overtake it.
+            jitter_ms (float): Extra uniform 0..jitter_ms delay per packet.
+            reorder_ms (float): Largest hold-back for reordered packets.
+            seed (int): RNG seed; the same seed gives the same impairment.
+        """
+        self.loss = loss
+        self.reorder = reorder
+        self.jitter_ms = jitter_ms
+        self.reorder_ms = reorder_ms
+        self.seed = seed
+        self.stats = {"dropped": 0, "reordered": 0}
+
+    def apply(self, records):
+        """
+        Impair a stream of (offset, channel, data) records. Output is still
+        ordered by (new) arrival offset. RTCP is delayed like RTP but never
+        dropped or reordered.
+        """
+        rng = random.Random(self.seed)
+        pending = []
+        order = 0
+        jitter_s = self.jitter_ms / 1000
+        reorder_s = self.reorder_ms / 1000
+        for offset, channel, data in records:
+            delay = rng.uniform(0, jitter_s) if jitter_s else 0.0
+            if channel == CHANNEL_RTP:
+                if self.loss and rng.random() < self.loss:
+                    self.stats["dropped"] += 1
+                    continue
+                if self.reorder and rng.random() < self.reorder:
+                    delay += rng.uniform(reorder_s / 3, reorder_s)
+                    self.stats["reordered"] += 1
+            heapq.heappush(pending, (offset + delay, order, channel, data))
+            order += 1
+            # Nothing later can arrive before the current offset
+            while pending and pending[0][0] <= offset:
+                arrival, _, ch, payload = heapq.heappop(pending)
+                yield arrival, ch, payload
+        while pending:
+            arrival, _, ch, payload = heapq.heappop(pending)
+            yield arrival, ch, payload
+
+def _paced(records, speed):
+    """
+    Sleep so that record offsets are reached at speed x real time.
+    speed None (or 0) means no sleeping at all.
+    """
+    if not speed:
+        yield from records
+        return
+    wall_start = None
+    for offset, channel, data in records:
+        if wall_start is None:
+            wall_start = time.monotonic() - offset / speed
+        delay = wall_start + offset / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield offset, channel, data
+
+def replay_to_session(reader, session, speed=None, impairment=None, start=0.0, end=None,
+                      on_frame=None):
+    """
+    Feed a capture through an RtpReceiveSession's receive path on a virtual
+    clock: datagrams are delivered at their (impaired) capture offsets and
+    the playout tick runs every frame_duration in capture time.
+
+    Args:
+        reader (CaptureReader): Source capture.
+        session (rtp_async.RtpReceiveSession): Receiver to drive; it does not
+            need to be opened.
+        speed (float): Replay speed relative to real time; None is unthrottled.
+        impairment (Impairment): Optional loss/reorder/jitter injection.
+        start (float): Capture offset to start from, in seconds.
+        end (float): Capture offset to stop at, in seconds.
+        on_frame (callable): Called with each played frame (int16 array, or
+            None for a concealed frame).
+
+    Returns:
+        dict: Replay counters plus the session's stats.
+    """
+    records = reader.records(start, end)
+    if impairment is not None:
+        records = impairment.apply(records)
+    records = _paced(records, speed)
+
+    jitter_buffer = session.jitter_buffer
+    frame_s = jitter_buffer.frame_duration / 1000
+    next_tick = None
+    frames = concealed = datagrams = 0
+    wall_start = time.perf_counter()
+    offset = start
+
+    def tick_until(until):
+        nonlocal next_tick, frames, concealed
+        while next_tick is not None and next_tick <= until:
+            ready, frame = session.playout(next_tick)
+            next_tick += frame_s
+            if not ready:
+                if not len(jitter_buffer):
+                    next_tick = None  # idle until the next packet
+                continue
+            frames += 1
+            if frame is None:
+                concealed += 1
+            if on_frame is not None:
+                on_frame(frame)
+
+    for offset, channel, data in records:
+        tick_until(offset)
+        datagrams += 1
+        if channel == CHANNEL_RTP:
+            session.feed_rtp(data, offset)
+            if next_tick is None:
+                next_tick = offset
+        else:
+            session.feed_rtcp(data, offset)
+    # Drain what is still buffered
+    tick_until(offset + jitter_buffer.max_size * frame_s)
+
+    wall = time.perf_counter() - wall_start
+    span = max(offset - start, 0.0)
+    return {
+        "datagrams": datagrams,
+        "frames_played": frames,
+        "frames_concealed": concealed,
+        "capture_seconds": span,
+        "wall_seconds": wall,
+        "speedup": span / wall if wall else None,
+        "impairment": dict(impairment.stats) if impairment is not None else None,
+        "session": session.get_stats(),
+    }
+
+def replay_to_socket(reader, addr, rtcp_addr=None, speed=1.0, impairment=None, start=0.0,
+                     end=None, sock=None):
+    """
+    Re-send a capture over UDP to a live receiver.
+
+    Args:
+        reader (CaptureReader): Source capture.
+        addr (tuple): (ip, port) for RTP.
+        rtcp_addr (tuple): (ip, port) for RTCP; RTCP records are skipped if None.
+        speed (float): 1.0 for real time, N for N x, None for unthrottled.
+        impairment (Impairment): Optional loss/reorder/jitter injection.
+
+    Returns:
+        int: Datagrams sent.
+    """
+    own_sock = sock is None
+    sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    records = reader.records(start, end)
+    if impairment is not None:
+        records = impairment.apply(records)
+    sent = 0
+    try:
+        for _, channel, data in _paced(records, speed):
+            if channel == CHANNEL_RTP:
+                sock.sendto(data, addr)
+            elif rtcp_addr is not None:
+                sock.sendto(data, rtcp_addr)
+            else:
+                continue
+            sent += 1
+    finally:
+        if own_sock:
+            sock.close()
+    return sent
+
+def record(path, port, rtcp_port=None, host='0.0.0.0', duration=None):
+    """
+    Capture everything arriving on port (and rtcp_port) until duration
+    seconds have passed or Ctrl+C.
+
+    Returns:
+        int: Records written.
+    """
+    selector = selectors.DefaultSelector()
+    socks = []
+    for channel, p in ((CHANNEL_RTP, port), (CHANNEL_RTCP, rtcp_port)):
+        if p is None:
+            continue
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, p))
+        selector.register(sock, selectors.EVENT_READ, channel)
+        socks.append(sock)
+
+    stop_at = None if duration is None else time.monotonic() + duration
+    print(f"Recording RTP on port {port} to {path}...")
+    with CaptureWriter(path) as writer:
+        try:
+            while stop_at is None or time.monotonic() < stop_at:
+                timeout = 0.5 if stop_at is None else max(0.0, min(0.5, stop_at - time.monotonic()))
+                for key, _ in selector.select(timeout):
+                    data = key.fileobj.recv(MAX_DATAGRAM)
+                    writer.write(data, key.data)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for sock in socks:
+                sock.close()
+            selector.close()
+        return writer.records
@@ -0,0 +1,216 @@
+'''
+Zero-copy RTP packetizer / depacketizer
+
+RtpPacketizer packs the fixed header with a precompiled struct.Struct
+straight into a reusable bytearray and copies the payload in after it, so
+sending a frame allocates nothing. Callers can also encode directly into
+payload_buffer() and skip even that copy.
+
+RtpPacket parses a received datagram in place: header fields are unpacked
+from the buffer and the payload, CSRC list and header extension are exposed
+as memoryview slices, with padding stripped. Combined with recv_rtp_packet()
+(recvfrom_into a preallocated buffer) the receive path copies nothing
+before the payload reaches the decoder.
+'''
+
+import struct
+from config import *
+
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_HEADER_SIZE = RTP_HEADER.size
+RTP_EXTENSION_HEADER = struct.Struct('!HH')
+MAX_DATAGRAM_SIZE = 2048
+
+class RtpPacketizer:
+    def __init__(self, ssrc=SSRC, payload_type=PAYLOAD_TYPE, samples_per_frame=160,
+                 sequence_number=0, timestamp=0, max_payload=MAX_DATAGRAM_SIZE - RTP_HEADER_SIZE):
+        """
+        Args:
+            ssrc (int): SSRC to put in the header.
+            payload_type (int): RTP payload type.
+            samples_per_frame (int): Timestamp increment per packet.
+            sequence_number (int): First sequence number.
+            timestamp (int): First timestamp.
+            max_payload (int): Largest payload the buffer must hold.
+        """
+        self.ssrc = ssrc
+        self.payload_type = payload_type
+        self.samples_per_frame = samples_per_frame
+        self.sequence_number = sequence_number
+        self.timestamp = timestamp
+
+        self.buffer = bytearray(RTP_HEADER_SIZE + max_payload)
+        self._view = memoryview(self.buffer)
+        self._packet_views = {}
+        self._payload_slices = {}
+        self._first_byte = RTP_VERSION << 6
+
+    def _views_for(self, payload_len):
+        # Cache views per length so a constant frame size never allocates
+        self._packet_views[payload_len] = self._view[:RTP_HEADER_SIZE + payload_len]
+        self._payload_slices[payload_len] = slice(RTP_HEADER_SIZE, RTP_HEADER_SIZE + payload_len)
+
+    def payload_buffer(self, payload_len):
+        """
+        Writable view of the payload area, for encoding in place.
+        """
+        return self._view[RTP_HEADER_SIZE:RTP_HEADER_SIZE + payload_len]
+
+    def finish(self, payload_len, marker=False):
+        """
+        Write the header for a payload already placed in payload_buffer()
+        and advance the sequence number and timestamp.
+
+        Returns:
+            memoryview: The packet. Valid until the next call.
+        """
+        if payload_len not in self._packet_views:
+            self._views_for(payload_len)
+        sequence_number = self.sequence_number
+        timestamp = self.timestamp
+        RTP_HEADER.pack_into(self.buffer, 0, self._first_byte,
+                             (marker << 7) | self.payload_type,
+                             sequence_number, timestamp, self.ssrc)
+        self.sequence_number = (sequence_number + 1) & 0xFFFF
+        self.timestamp = (timestamp + self.samples_per_frame) & 0xFFFFFFFF
+        return self._packet_views[payload_len]
+
+    def skip(self):
+        """
+        Advance the timestamp by one frame without sending a packet, for a
+        frame suppressed during silence. The sequence number is unchanged,
+        so the receiver does not count the gap as loss.
+        """
+        self.timestamp = (self.timestamp + self.samples_per_frame) & 0xFFFFFFFF
+
+    def packetize(self, payload, marker=False, payload_type=None):
+        """
+        Build the next packet around payload. payload_type overrides the
+        stream's own for this packet (e.g. comfort noise).
+
+        Returns:
+            memoryview: The packet. Valid until the next call.
+        """
+        payload_len = len(payload)
+        payload_slice = self._payload_slices.get(payload_len)
+        if payload_slice is None:
+            self._views_for(payload_len)
+            payload_slice = self._payload_slices[payload_len]
+        buffer = self.buffer
+        buffer[payload_slice] = payload
+        sequence_number = self.sequence_number
+        timestamp = self.timestamp
+        RTP_HEADER.pack_into(buffer, 0, self._first_byte,
+                             (marker << 7) | (self.payload_type if payload_type is None else payload_type),
+                             sequence_number, timestamp, self.ssrc)
+        self.sequence_number = (sequence_number + 1) & 0xFFFF
+        self.timestamp = (timestamp + self.samples_per_frame) & 0xFFFFFFFF
+        return self._packet_views[payload_len]
+
+class RtpPacket:
+    """
+    A parsed RTP packet. Variable-length parts are memoryview slices of the
+    receive buffer, so they are only valid until that buffer is reused.
+    Flag fields are decoded from the first two header bytes on access.
+    """
+    __slots__ = ('data', 'first_byte', 'second_byte', 'sequence_number', 'timestamp', 'ssrc',
+                 'extension_profile', 'extension_data', 'payload')
+
+    def __init__(self, data=None):
+        if data is not None:
+            self.unpack(data)
+
+    def unpack(self, data):
+        """
+        Parse data in place (reusing this object) and return self.
+
+        Raises:
+            ValueError: If the packet is truncated or not RTP version 2.
+        """
+        view = data if data.__class__ is memoryview else memoryview(data)
+        if len(view) < RTP_HEADER_SIZE:
+            raise ValueError("RTP packet shorter than the fixed header")
+        b0, self.second_byte, self.sequence_number, self.timestamp, self.ssrc = \
+            RTP_HEADER.unpack_from(view)
+        self.first_byte = b0
+        self.data = view
+
+        if b0 == 0x80:
+            # Common case: no padding, extension or CSRCs
+            self.extension_profile = self.extension_data = None
+            self.payload = view[RTP_HEADER_SIZE:]
+            return self
+        if b0 >> 6 != 2:
+            raise ValueError(f"Unsupported RTP version {b0 >> 6}")
+
+        size = len(view)
+        offset = RTP_HEADER_SIZE + 4 * (b0 & 0x0F)
+        self.extension_profile = self.extension_data = None
+        if b0 & 0x10:
+            if size < offset + 4:
+                raise ValueError("RTP header extension truncated")
+            self.extension_profile, words = RTP_EXTENSION_HEADER.unpack_from(view, offset)
+            offset += 4
+            self.extension_data = view[offset:offset + 4 * words]
+            offset += 4 * words
+
+        end = size
+        if b0 & 0x20:
+            end -= view[size - 1]
+        if offset > end:
+            raise ValueError("RTP packet truncated")
+        self.payload = view[offset:end]
+        return self
+
+    @property
+    def version(self):
+        return self.first_byte >> 6
+
+    @property
+    def padding(self):
+        return bool(self.first_byte & 0x20)
+
+    @property
+    def extension(self):
+        return bool(self.first_byte & 0x10)
+
+    @property
+    def csrc_count(self):
+        return self.first_byte & 0x0F
+
+    @property
+    def marker(self):
+        return bool(self.second_byte & 0x80)
+
+    @property
+    def payload_type(self):
+        return self.second_byte & 0x7F
+
+    @property
+    def csrcs(self):
+        """
+        Tuple of CSRC identifiers (decoded on first use).
+        """
+        count = self.first_byte & 0x0F
+        if not count:
+            return ()
+        return struct.unpack_from(f'!{count}I', self.data, RTP_HEADER_SIZE)
+
+def recv_rtp_packet(sock, buffer, packet=None):
+    """
+    Receive one datagram into a preallocated buffer and parse it in place.
+
+    Args:
+        sock (socket.socket): Socket to read from.
+        buffer (bytearray): Receive buffer, reused across calls.
+        packet (RtpPacket): Packet object to reuse (a new one if None).
+
+    Returns:
+        tuple: (RtpPacket, addr), or (None, addr) for a malformed datagram.
+    """
+    nbytes, addr = sock.recvfrom_into(buffer)
+    packet = packet or RtpPacket()
+    try:
+        return packet.unpack(memoryview(buffer)[:nbytes]), addr
+    except ValueError:
+        return None, addr
@@ -0,0 +1,226 @@
+'''
+Drift-free RTP send scheduler
+
+A single thread paces any number of outgoing RTP streams. Every stream keeps
+an absolute monotonic start time, and frame n is due at start + n * frame,
+so encode/send time never accumulates into drift. Due streams are kept in a
+heap ordered by deadline; the thread sleeps on a condition variable until
+the earliest one, sends it, and pushes it back with its next deadline.
+
+For each send the scheduler records how late it went out relative to its
+deadline, so pacing quality can be checked per stream.
+'''
+
+import heapq
+import itertools
+import socket
+import threading
+import time
+from config import *
+from rtp_packet import RtpPacketizer
+
+# If a stream falls further behind than this (seconds), rebase its clock
+# instead of sending a burst to catch up.
+MAX_CATCHUP = 0.1
+
+class RtpStreamHandle:
+    """
+    State of one scheduled outgoing stream.
+    """
+    def __init__(self, stream_id, frames, addr, frame_duration, ssrc, payload_type, on_complete):
+        self.stream_id = stream_id
+        self.frames = iter(frames)
+        self.addr = addr
+        self.frame_duration = frame_duration
+        self.packetizer = RtpPacketizer(ssrc, payload_type, frame_duration * 8)  # 8 kHz clock
+        self.on_complete = on_complete
+        self.vad = None  # vad.SilenceSuppressor feeding frames, if any
+
+        self.start = 0.0
+        self.frame_index = 0
+        self.cancelled = False
+        self.error = None  # exception that ended the stream, if any
+        self.done = threading.Event()
+
+        self.stats = {
+            "packets_sent": 0,
+            "bytes_sent": 0,
+            "packets_suppressed": 0,
+            "late_total_ms": 0.0,
+            "late_max_ms": 0.0,
+            "rebases": 0,
+        }
+
+    def next_deadline(self):
+        return self.start + self.frame_index * self.frame_duration / 1000
+
+    @property
+    def mean_lateness_ms(self):
+        sent = self.stats["packets_sent"]
+        return self.stats["late_total_ms"] / sent if sent else 0.0
+
+    def wait(self, timeout=None):
+        """
+        Block until the stream has finished sending.
+        """
+        return self.done.wait(timeout)
+
+class RtpScheduler:
+    def __init__(self, sock=None):
+        """
+        Args:
+            sock (socket.socket): UDP socket shared by all streams. A new one
+                is created if not given.
+        """
+        self.sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._heap = []
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """
+        Start the scheduler thread.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="rtp-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the scheduler thread. Pending streams, and the one being sent
+        when the thread stopped, are finished as if cancelled.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._cond:
+            pending = [entry[2] for entry in self._heap]
+            self._heap.clear()
+        for handle in pending:
+            self._finish(handle)
+
+    def add_stream(self, frames, ip, port, frame_duration=20, ssrc=SSRC,
+                   payload_type=PAYLOAD_TYPE, start_time=None, on_complete=None):
+        """
+        Schedule an iterable of encoded frames to be sent as an RTP stream.
+
+        Args:
+            frames (iterable): Encoded payloads, one per frame. A
+                (payload, payload_type, marker) tuple sends a special packet
+                and None skips the frame (see vad.SilenceSuppressor).
+            ip (str): Destination IP address.
+            port (int): Destination port.
+            frame_duration (int): Duration of each audio frame in milliseconds.
+            ssrc (int): SSRC to put in the RTP header.
+            payload_type (int): RTP payload type.
+            start_time (float): time.monotonic() value of the first send.
+            on_complete (callable): Called with the handle once the stream ends.
+
+        Returns:
+            RtpStreamHandle: Handle used to cancel or inspect the stream.
+        """
+        handle = RtpStreamHandle(next(self._ids), frames, (ip, port), frame_duration,
+                                 ssrc, payload_type, on_complete)
+        handle.start = time.monotonic() if start_time is None else start_time
+        with self._cond:
+            heapq.heappush(self._heap, (handle.start, handle.stream_id, handle))
+            self._cond.notify()
+        return handle
+
+    def remove_stream(self, handle):
+        """
+        Cancel a stream. It is dropped the next time it comes due.
+        """
+        handle.cancelled = True
+
+    def active_streams(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        heap = self._heap
+        while True:
+            with self._cond:
+                while self._running:
+                    if not heap:
+                        self._cond.wait()
+                        continue
+                    delay = heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                deadline, _, handle = heapq.heappop(heap)
+
+            try:
+                more = self._send_next(handle, deadline)
+            except Exception as e:
+                # A broken frame source ends its own stream, not the thread
+                print(f"Error in RTP stream {handle.stream_id} to {handle.addr}: {e}")
+                handle.error = e
+                more = False
+            if more:
+                with self._cond:
+                    # Left on the heap if stopped meanwhile; stop() finishes it
+                    heapq.heappush(heap, (handle.next_deadline(), handle.stream_id, handle))
+            else:
+                self._finish(handle)
+
+    def _finish(self, handle):
+        handle.done.set()
+        if handle.on_complete:
+            try:
+                handle.on_complete(handle)
+            except Exception as e:
+                print(f"Error in completion callback of RTP stream {handle.stream_id}: {e}")
+
+    def _send_next(self, handle, deadline):
+        """
+        Send the handle's next frame. Returns False once the stream is over.
+        """
+        if handle.cancelled:
+            return False
+        try:
+            payload = next(handle.frames)
+        except StopIteration:
+            return False
+
+        stats = handle.stats
+        if payload is None:
+            handle.packetizer.skip()
+            handle.frame_index += 1
+            stats["packets_suppressed"] += 1
+            return True
+        if payload.__class__ is tuple:
+            payload, payload_type, marker = payload
+            rtp_packet = handle.packetizer.packetize(payload, marker, payload_type)
+        else:
+            rtp_packet = handle.packetizer.packetize(payload)
+        try:
+            self.sock.sendto(rtp_packet, handle.addr)
+        except OSError as e:
+            print(f"Error sending RTP packet to {handle.addr}: {e}")
+            handle.error = e
+            return False
+
+        late = time.monotonic() - deadline
+        stats["packets_sent"] += 1
+        stats["bytes_sent"] += len(rtp_packet)
+        stats["late_total_ms"] += late * 1000
+        if late * 1000 > stats["late_max_ms"]:
+            stats["late_max_ms"] = late * 1000
+
+        handle.frame_index += 1
+        if late > MAX_CATCHUP:
+            # Too far behind to recover smoothly; restart the clock from now
+            handle.start = time.monotonic() - handle.frame_index * handle.frame_duration / 1000
+            stats["rebases"] += 1
+        return True
@@ -8,31 +8,22 @@ Task to do:
 4. Implement RTCP for minimal statistics (packet loss, jitter).
 '''
 
-import socket
-import wave
-import struct
-import time
 from config import *
-from audio_handler import read_and_encode_audio, receive_with_jitter_buffer
+from rtp_packet import RTP_HEADER
+from rtcp import REPORT_BLOCK, build_rr
 
-def create_rtp_header(sequence_number, timestamp):
+def create_rtp_header(sequence_number, timestamp, ssrc=SSRC, payload_type=PAYLOAD_TYPE):
     """
     Create an RTP header.
-    """
-    rtp_header = 0
-    rtp_header |= (RTP_VERSION << 30)  # Version (2 bits)
-    rtp_header |= (0 << 29)           # Padding (1 bit)
-    rtp_header |= (0 << 28)           # Extension (1 bit)
-    rtp_header |= (0 << 27)           # CSRC count (4 bits)
-    rtp_header |= (PAYLOAD_TYPE << 16)  # Payload type (7 bits)
-    rtp_header |= sequence_number     # Sequence number (16 bits)
 
-    # Pack the header into bytes
-    header_bytes = struct.pack('!BBHII', (rtp_header >> 24) & 0xFF, (rtp_header >> 16) & 0xFF,
-                               sequence_number, timestamp, SSRC)
-    return header_bytes
+    Hot paths should use rtp_packet.RtpPacketizer, which packs into a
+    reusable buffer instead of returning a new bytes object.
+    """
+    # Version 2, no padding, no extension, no CSRCs, marker clear
+    return RTP_HEADER.pack(RTP_VERSION << 6, payload_type, sequence_number, timestamp, ssrc)
 
-def send_rtp_stream(audio_file, ip, port, frame_duration=20):
+def send_rtp_stream(audio_file, ip, port, frame_duration=20, scheduler=None, cache=None,
+                    on_complete=None, ssrc=SSRC, silence_suppression=VAD_MODE):
     """
     Read audio frames from a file and send them as RTP packets.
     
@@ -41,51 +32,71 @@ def send_rtp_stream(audio_file, ip, port, frame_duration=20):
         ip (str): Destination IP address.
         port (int): Destination port.
         frame_duration (int): Duration of each audio frame in milliseconds.
+        scheduler (RtpScheduler): If given, the stream is handed to this shared
+            scheduler and its handle is returned instead of blocking.
+        cache (MediaCache): If given, frames are served pre-encoded from the
+            cache instead of being read and encoded per frame.
+        on_complete (callable): With a scheduler, called with the handle once
+            the stream has been sent.
+        ssrc (int): SSRC of the stream.
+        silence_suppression (str): None to send every frame, "suppress" to
+            send nothing during silence or "cn" to send RFC 3389 comfort
+            noise instead (see vad.SilenceSuppressor).
     """
-    # Create a UDP socket
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    sequence_number = 0
-    timestamp = 0
-
-    print(f"Streaming audio to {ip}:{port}...")
-    for encoded_audio in read_and_encode_audio(audio_file, frame_duration):
-        # Create RTP header
-        rtp_header = create_rtp_header(sequence_number, timestamp)
-
-        # Combine header and payload
-        rtp_packet = rtp_header + encoded_audio
-
-        # Send RTP packet
-        sock.sendto(rtp_packet, (ip, port))
-
-        # Update sequence number and timestamp
-        sequence_number += 1
-        timestamp += frame_duration * 8  # Assuming 8 kHz sample rate
-
-        # Simulate real-time streaming
-        time.sleep(frame_duration / 1000)
-
-    print("Streaming complete.")
-    sock.close()
-
-def receive_rtp_stream(port, rtcp_port, output_file="audio.wav"):
+    if cache is not None:
+        frames = cache.get(audio_file, AUDIO_CODEC, frame_duration).frames()
+    else:
+        from audio_handler import read_and_encode_audio
+        frames = read_and_encode_audio(audio_file, frame_duration, AUDIO_CODEC)
+    suppressor = None
+    if silence_suppression:
+        from vad import SilenceSuppressor
+        suppressor = SilenceSuppressor(silence_suppression, AUDIO_CODEC, frame_duration)
+        frames = suppressor.process(frames)
+
+    if scheduler is not None:
+        handle = scheduler.add_stream(frames, ip, port, frame_duration, ssrc=ssrc,
+                                      on_complete=on_complete)
+        handle.vad = suppressor
+        return handle
+
+    import asyncio
+    asyncio.run(_send_rtp_stream(frames, ip, port, frame_duration, ssrc, suppressor))
+
+async def _send_rtp_stream(frames, ip, port, frame_duration, ssrc=SSRC, suppressor=None):
+    from rtp_async import RtpSendSession
+    async with RtpSendSession(ip, port, frame_duration=frame_duration, ssrc=ssrc) as session:
+        print(f"Streaming audio to {ip}:{port}...")
+        await session.send_frames(frames)
+    print(f"Streaming complete. Max send lateness: {session.late_max * 1000:.2f} ms")
+    if suppressor is not None:
+        stats = suppressor.get_stats()
+        print(f"Silence suppression: {stats['packets_suppressed']} of {stats['frames']} packets "
+              f"suppressed, {stats['cn_packets']} comfort noise, {stats['bytes_saved']} bytes saved")
+
+def receive_rtp_stream(port, rtcp_port, output_file="received_audio.wav"):
     """
     Receive RTP packets, reconstruct the audio stream, and send RTCP reports.
     
     Args:
         port (int): Port to listen for RTP packets.
         rtcp_port (int): Port to send RTCP reports.
-        output_file (str): Path to save the reconstructed audio stream.
+        output_file (str): Path to save the reconstructed audio stream (WAV);
+            None disables recording.
     """
     print(f"Listening for RTP packets on port {port}...")
 
-    # Use the jitter buffer for smoother playback
-    receive_with_jitter_buffer(port)
+    # Use the jitter buffer for smoother playback; RTCP runs on rtcp_port.
+    # Played frames are recorded off the playout path by a background writer.
+    from audio_handler import receive_with_jitter_buffer
+    receive_with_jitter_buffer(port, rtcp_port=rtcp_port, output_file=output_file)
 
-def create_rtcp_report(ssrc, fraction_lost, cumulative_lost, highest_seq, jitter):
+def create_rtcp_report(ssrc, fraction_lost, cumulative_lost, highest_seq, jitter,
+                       reporter_ssrc=SSRC, lsr=0, dlsr=0):
     """
-    Create an RTCP Receiver Report (RR).
+    Create an RTCP Receiver Report (RR) with one report block.
+
+    Live sessions build their reports from rtcp.RtcpReporter instead.
     
     Args:
         ssrc (int): SSRC of the RTP stream.
@@ -93,13 +104,16 @@ def create_rtcp_report(ssrc, fraction_lost, cumulative_lost, highest_seq, jitter
         cumulative_lost (int): Total number of packets lost.
         highest_seq (int): Highest sequence number received.
         jitter (int): Estimated jitter.
+        reporter_ssrc (int): SSRC of the receiver sending the report.
+        lsr (int): Middle 32 bits of the last SR's NTP timestamp.
+        dlsr (int): Delay since the last SR, in units of 1/65536 s.
     
     Returns:
         bytes: RTCP Receiver Report packet.
     """
-    rtcp_header = struct.pack('!BBH', 0x80, 201, 7)  # Version 2, RR, length
-    ssrc_bytes = struct.pack('!I', ssrc)
-    report_block = struct.pack('!IBBHII', ssrc, int(fraction_lost * 256), cumulative_lost,
-                               highest_seq, jitter, 0)
-    return rtcp_header + ssrc_bytes + report_block
+    fraction = min(int(fraction_lost * 256), 255)
+    lost = max(min(cumulative_lost, 0x7FFFFF), -0x800000) & 0xFFFFFF
+    report_block = REPORT_BLOCK.pack(ssrc, (fraction << 24) | lost, highest_seq & 0xFFFFFFFF,
+                                     jitter, lsr, dlsr)
+    return build_rr(reporter_ssrc, [report_block])
 
@@ -7,100 +7,114 @@ Task to do:
 3. Include an SDP body in the INVITE(contains codec, IP address, port).
 4. Handle SIP responses (log errors for 4xx and 5xx responses).
 '''
-import socket
 import uuid
-import threading
-from network_util import send_udp_packet, receive_udp_packet, create_udp_socket
+import metrics
 from config import *
-from rtp_stream import *
+from rtp_stream import send_rtp_stream
+from rtp_scheduler import RtpScheduler
+from call_manager import CallManager
+from sip_message import sdp_media_address
+
+SIP_MESSAGES_LOGGED = metrics.counter("sip.messages_logged")
+
+# Formatting the port int on every message costs more than the rest of the
+# f-string, so the host:port part is built once
+SIP_HOST = f"{LOCAL_IP}:{SIP_PORT}"
+
+# The SDP offer has no per-call fields, so it is built once
+SDP_BODY = (f"v=0\r\n"
+            f"o=- 0 0 IN IP4 {LOCAL_IP}\r\n"
+            f"s=Session\r\n"
+            f"c=IN IP4 {LOCAL_IP}\r\n"
+            f"t=0 0\r\n"
+            f"a=tool:libavformat 58.29.100\r\n"
+            f"a=recvonly\r\n"
+            f"m=audio {RTP_PORT} RTP/AVP {PAYLOAD_TYPE} {CN_PAYLOAD_TYPE}\r\n"
+            f"a=rtpmap:{PAYLOAD_TYPE} {AUDIO_CODEC}/8000\r\n"
+            f"a=rtpmap:{CN_PAYLOAD_TYPE} CN/8000\r\n").encode('utf-8')
 
 def generate_sip_invite(to, from_, call_id, sdp):
     """
-    Generate a SIP INVITE message.
+    Generate a SIP INVITE message (bytes).
     """
-    return f"INVITE sip:{to}@{LOCAL_IP}:{SIP_PORT} SIP/2.0\r\n" \
-           f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n" \
-           f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"To: <sip:{to}@{LOCAL_IP}>\r\n" \
-           f"Call-ID: {call_id}\r\n" \
-           f"CSeq: 1 INVITE\r\n" \
-           f"Contact: <sip:{from_}@{LOCAL_IP}:{SIP_PORT}>\r\n" \
-           f"Content-Type: application/sdp\r\n" \
-           f"Content-Length: {len(sdp)}\r\n\r\n" \
-           f"{sdp}"
+    if isinstance(sdp, str):
+        sdp = sdp.encode('utf-8')
+    return (f"INVITE sip:{to}@{SIP_HOST} SIP/2.0\r\n"
+            f"Via: SIP/2.0/UDP {SIP_HOST};branch=z9hG4bK{call_id}\r\n"
+            f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"To: <sip:{to}@{LOCAL_IP}>\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: 1 INVITE\r\n"
+            f"Contact: <sip:{from_}@{SIP_HOST}>\r\n"
+            f"Content-Type: application/sdp\r\n"
+            f"Content-Length: {len(sdp)}\r\n\r\n").encode('utf-8') + sdp
 
 def generate_sdp_body():
     """
-    Generate an SDP body for the INVITE message.
+    Generate an SDP body for the INVITE message (bytes).
     """
-    return f"v=0\r\n" \
-           f"o=- 0 0 IN IP4 {LOCAL_IP}\r\n" \
-           f"s=Session\r\n" \
-           f"c=IN IP4 {LOCAL_IP}\r\n" \
-           f"t=0 0\r\n" \
-           f"a=tool:libavformat 58.29.100\r\n" \
-           f"a=recvonly\r\n" \
-           f"m=audio {RTP_PORT} RTP/AVP {AUDIO_CODEC}\r\n" \
-           f"a=rtpmap:{AUDIO_CODEC} PCMU/8000\r\n"
-
-
+    return SDP_BODY
 
 def generate_sip_response(status_code, call_id, to, from_):
     """
-    Generate a SIP response message.
+    Generate a SIP response message (bytes).
     """
-    return f"SIP/2.0 {status_code} {get_status_message(status_code)}\r\n" \
-           f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n" \
-           f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"Call-ID: {call_id}\r\n" \
-           f"CSeq: 1 INVITE\r\n" \
-           f"Content-Length: 0\r\n\r\n"
+    return (f"SIP/2.0 {status_code} {get_status_message(status_code)}\r\n"
+            f"Via: SIP/2.0/UDP {SIP_HOST};branch=z9hG4bK{call_id}\r\n"
+            f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: 1 INVITE\r\n"
+            f"Content-Length: 0\r\n\r\n").encode('utf-8')
+
+STATUS_MESSAGES = {
+    200: "OK",
+    404: "Not Found",
+    486: "Busy Here",
+    500: "Server Internal Error",
+    # Add more status codes as needed
+}
 
 def get_status_message(status_code):
     """
     Get the status message for a given SIP status code.
     """
-    status_messages = {
-        200: "OK",
-        404: "Not Found",
-        486: "Busy Here",
-        500: "Server Internal Error",
-        # Add more status codes as needed
-    }
-    return status_messages.get(status_code, "Unknown Status")
+    return STATUS_MESSAGES.get(status_code, "Unknown Status")
 
 def generate_sip_ack(call_id, to, from_):
     """
-    Generate a SIP ACK message.
+    Generate a SIP ACK message (bytes).
     """
-    return f"ACK sip:{to}@{LOCAL_IP}:{SIP_PORT} SIP/2.0\r\n" \
-           f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n" \
-           f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"Call-ID: {call_id}\r\n" \
-           f"CSeq: 2 ACK\r\n" \
-           f"Content-Length: 0\r\n\r\n"
+    return (f"ACK sip:{to}@{SIP_HOST} SIP/2.0\r\n"
+            f"Via: SIP/2.0/UDP {SIP_HOST};branch=z9hG4bK{call_id}\r\n"
+            f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: 2 ACK\r\n"
+            f"Content-Length: 0\r\n\r\n").encode('utf-8')
 
 def generate_sip_bye(call_id, to, from_):
     """
-    Generate a SIP BYE message.
+    Generate a SIP BYE message (bytes).
     """
-    return f"BYE sip:{to}@{LOCAL_IP}:{SIP_PORT} SIP/2.0\r\n" \
-           f"Via: SIP/2.0/UDP {LOCAL_IP}:{SIP_PORT};branch=z9hG4bK{call_id}\r\n" \
-           f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n" \
-           f"Call-ID: {call_id}\r\n" \
-           f"CSeq: 3 BYE\r\n" \
-           f"Content-Length: 0\r\n\r\n"
+    return (f"BYE sip:{to}@{SIP_HOST} SIP/2.0\r\n"
+            f"Via: SIP/2.0/UDP {SIP_HOST};branch=z9hG4bK{call_id}\r\n"
+            f"From: <sip:{from_}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"To: <sip:{to}@{LOCAL_IP}>;tag={call_id}\r\n"
+            f"Call-ID: {call_id}\r\n"
+            f"CSeq: 3 BYE\r\n"
+            f"Content-Length: 0\r\n\r\n").encode('utf-8')
 
 def log_sip_message(message):
     """
-    Save all SIP messages for debugging purposes.
+    Save all SIP messages for debugging purposes. The append happens in
+    batches on the log writer thread, not in the caller.
     """
-    with open("sip_log.txt", "a") as log_file:
-        log_file.write(message + "\n")
-    print(f"Logged SIP message: {message}")
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    metrics.get_log_writer("sip_log.txt").write(message + "\n")
+    if metrics.enabled:
+        SIP_MESSAGES_LOGGED.inc()
 
 def create_call_id():
     """
@@ -108,50 +122,66 @@ def create_call_id():
     """
     return str(uuid.uuid4())
 
-def sip_client(to, from_, call_id):
-    """
-    Main function to run the SIP client.
+def sip_client(to, from_, call_id, audio_file="audio.wav", duration=30, manager=None, scheduler=None,
+               media_pool=None):
     """
+    Main function to run the SIP client: place one call, stream audio_file
+    once it is answered and hang up when the stream ends (or after
+    duration seconds).
 
+    Args:
+        to (str): IP address of the callee.
+        from_ (str): Local user name.
+        call_id (str): Call-ID to use; a new one is generated if None.
+        audio_file (str): Audio to stream to the callee.
+        duration (float): Longest time to keep the call up.
+        manager (CallManager): Shared call manager; a private one is started
+            (and stopped again) if None.
+        scheduler (RtpScheduler): Shared RTP scheduler, likewise.
+        media_pool (MediaWorkerPool): Stream from the least-loaded media
+            worker process instead of a scheduler thread in this process.
+
+    Returns:
+        Dialog: The finished dialog.
+    """
     # Create a unique Call-ID for the session
-    call_id = create_call_id()
+    call_id = call_id or create_call_id()
     print(f"Generated Call-ID: {call_id}")
 
-    # Create a UDP socket
-    sock = create_udp_socket(SIP_PORT)
-
-    # Generate SDP body
-    sdp = generate_sdp_body()
-
-    # Generate SIP INVITE message
-    sip_invite = generate_sip_invite(to, from_, call_id, sdp).encode('utf-8')
-    send_udp_packet(to, SIP_PORT, sip_invite, sock)
-
-    # Wait for SIP response
-    addr, response = receive_udp_packet(sock, BUFFER_SIZE)
-    print(f"Received response: {response}")
-
-    response_str = response.decode('utf-8')
-
-    # Check for SIP response status
-    if "200 OK" in response_str:
-        print("Call established successfully.")
-        ack_message = generate_sip_ack(call_id, to, from_)
-        send_udp_packet(sock, ack_message, (to, SIP_PORT))
-
-        # Start RTP streaming in a separate thread
-        threading.Thread(target=send_rtp_stream, args=("audio.wav", RTP_PORT)).start()
-
-        # Wait for streaming to finish
-        threading.Event().wait(30)
-
-        # Generate SIP BYE message
-        bye_message = generate_sip_bye(call_id, to, from_)
-        send_udp_packet(sock, SIP_PORT, bye_message, (to, SIP_PORT))
-
-    elif response_str.split()[1].startswith(('4', '5')):
-        print(f"Error: {response}")
-        log_sip_message(response)
-
-    # Close the socket
-    sock.close()
\ No newline at end of file
+    own_manager = manager is None
+    if own_manager:
+        manager = CallManager()
+        manager.start()
+    own_scheduler = scheduler is None and media_pool is None
+    if own_scheduler:
+        scheduler = RtpScheduler()
+        scheduler.start()
+
+    def on_established(dialog):
+        print(f"Call established successfully in {dialog.setup_latency * 1000:.1f} ms.")
+        ip, port = sdp_media_address(dialog.remote_sdp) or (to, RTP_PORT)
+        # Hang up once the prompt has been sent
+        if media_pool is not None:
+            media_pool.start_send(audio_file, ip, port,
+                                  on_complete=lambda session: manager.hangup(dialog))
+            return
+        send_rtp_stream(audio_file, ip, port, scheduler=scheduler,
+                        on_complete=lambda handle: manager.hangup(dialog))
+
+    def on_ended(dialog):
+        if dialog.state == "failed":
+            print(f"Error: {dialog.status_code} {dialog.reason}")
+            log_sip_message(f"Call {dialog.call_id} failed: {dialog.status_code} {dialog.reason}")
+        else:
+            print("Call ended.")
+
+    dialog = manager.place_call(to, from_, (to, SIP_PORT), call_id=call_id, sdp=SDP_BODY,
+                                on_established=on_established, on_ended=on_ended,
+                                duration=duration)
+    dialog.wait()
+
+    if own_scheduler:
+        scheduler.stop()
+    if own_manager:
+        manager.stop()
+    return dialog
@@ -0,0 +1,259 @@
+'''
+Compact SIP message model and single-pass parser
+
+SipMessage.parse() walks the message once: it splits the start line, builds
+a case-insensitive header map (compact forms such as "i" and "v" are
+mapped to their full names) and keeps the body as raw bytes that are only
+decoded when .body is read.
+'''
+
+# RFC 3261 section 7.3.3 compact header forms
+COMPACT_FORMS = {
+    'i': 'call-id',
+    'm': 'contact',
+    'e': 'content-encoding',
+    'l': 'content-length',
+    'c': 'content-type',
+    'f': 'from',
+    's': 'subject',
+    'k': 'supported',
+    't': 'to',
+    'v': 'via',
+}
+
+# Header names whose canonical spelling isn't plain title case
+CANONICAL_NAMES = {
+    'call-id': 'Call-ID',
+    'cseq': 'CSeq',
+    'www-authenticate': 'WWW-Authenticate',
+}
+
+def canonical_name(name):
+    return CANONICAL_NAMES.get(name) or '-'.join(part.capitalize() for part in name.split('-'))
+
+class SipMessage:
+    """
+    A parsed SIP request or response. Header names are stored lower-case;
+    each maps to the list of its values in message order.
+    """
+    __slots__ = ('method', 'request_uri', 'status_code', 'reason', 'version',
+                 'headers', 'raw_body', '_body')
+
+    def __init__(self):
+        self.method = None
+        self.request_uri = None
+        self.status_code = None
+        self.reason = None
+        self.version = 'SIP/2.0'
+        self.headers = {}
+        self.raw_body = b''
+        self._body = None
+
+    @classmethod
+    def parse(cls, data):
+        """
+        Parse a SIP message from bytes (or str).
+
+        Raises:
+            ValueError: If the start line is malformed.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        msg = cls()
+
+        end = data.find(b'\r\n\r\n')
+        if end >= 0:
+            head, body = data[:end], data[end + 4:]
+            lines = head.decode('utf-8', 'replace').split('\r\n')
+        else:
+            # Tolerate bare LF line endings
+            end = data.find(b'\n\n')
+            head, body = (data[:end], data[end + 2:]) if end >= 0 else (data, b'')
+            lines = head.decode('utf-8', 'replace').splitlines()
+        if not lines or not lines[0]:
+            raise ValueError("Empty SIP message")
+
+        start = lines[0].split(' ', 2)
+        if len(start) < 2:
+            raise ValueError(f"Malformed SIP start line: {lines[0]!r}")
+        if start[0].startswith('SIP/'):
+            msg.version = start[0]
+            try:
+                msg.status_code = int(start[1])
+            except ValueError:
+                raise ValueError(f"Malformed SIP status line: {lines[0]!r}") from None
+            msg.reason = start[2] if len(start) > 2 else ''
+        else:
+            if len(start) < 3:
+                raise ValueError(f"Malformed SIP request line: {lines[0]!r}")
+            msg.method, msg.request_uri, msg.version = start
+
+        headers = msg.headers
+        values = None
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep or line[0] in ' \t':
+                # Folded continuation of the previous header
+                if values and line.strip():
+                    values[-1] = f"{values[-1]} {line.strip()}"
+                continue
+            name = name.rstrip().lower()
+            if len(name) == 1:
+                name = COMPACT_FORMS.get(name, name)
+            values = headers.get(name)
+            if values is None:
+                values = headers[name] = [value.strip()]
+            else:
+                values.append(value.strip())
+
+        content_length = headers.get('content-length')
+        if content_length and body:
+            try:
+                body = body[:int(content_length[0])]
+            except ValueError:
+                pass
+        msg.raw_body = body
+        return msg
+
+    @property
+    def is_request(self):
+        return self.method is not None
+
+    @property
+    def is_response(self):
+        return self.status_code is not None
+
+    @property
+    def body(self):
+        """
+        The body decoded as UTF-8 (on first access).
+        """
+        if self._body is None:
+            self._body = self.raw_body.decode('utf-8', 'replace')
+        return self._body
+
+    def get(self, name, default=None):
+        """
+        First value of a header (case-insensitive, compact forms accepted).
+        """
+        name = name.lower()
+        values = self.headers.get(COMPACT_FORMS.get(name, name))
+        return values[0] if values else default
+
+    def get_all(self, name):
+        name = name.lower()
+        return self.headers.get(COMPACT_FORMS.get(name, name), [])
+
+    @property
+    def call_id(self):
+        return self.get('call-id')
+
+    @property
+    def cseq(self):
+        """
+        (sequence number, method) from the CSeq header.
+        """
+        value = self.get('cseq')
+        if not value:
+            return None, None
+        number, _, method = value.partition(' ')
+        try:
+            return int(number), method.strip()
+        except ValueError:
+            return None, method.strip()
+
+    @property
+    def from_tag(self):
+        return header_param(self.get('from', ''), 'tag')
+
+    @property
+    def to_tag(self):
+        return header_param(self.get('to', ''), 'tag')
+
+    @property
+    def branch(self):
+        return header_param(self.get('via', ''), 'branch')
+
+    def to_bytes(self):
+        """
+        Serialize the message. Content-Length is recomputed from the body.
+        """
+        if self.is_request:
+            start = f"{self.method} {self.request_uri} {self.version}"
+        else:
+            start = f"{self.version} {self.status_code} {self.reason}"
+        lines = [start]
+        for name, values in self.headers.items():
+            if name == 'content-length':
+                continue
+            header = canonical_name(name)
+            lines.extend(f"{header}: {value}" for value in values)
+        lines.append(f"Content-Length: {len(self.raw_body)}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + self.raw_body
+
+def header_param(value, param):
+    """
+    Extract a ;param=value from a header value (e.g. tag, branch).
+    """
+    key = f";{param}="
+    start = value.find(key)
+    if start < 0:
+        return None
+    start += len(key)
+    end = len(value)
+    for sep in (';', ',', '>', ' '):
+        pos = value.find(sep, start)
+        if 0 <= pos < end:
+            end = pos
+    return value[start:end]
+
+def sdp_media_address(sdp):
+    """
+    Find the audio destination in an SDP body.
+
+    Returns:
+        tuple: (ip, port) from the c= and m=audio lines, or None.
+    """
+    if isinstance(sdp, bytes):
+        sdp = sdp.decode('utf-8', 'replace')
+    ip = port = None
+    for line in sdp.splitlines():
+        if line.startswith('c=') and ip is None:
+            ip = line.split()[-1]
+        elif line.startswith('m=audio '):
+            try:
+                port = int(line.split()[1])
+            except (IndexError, ValueError):
+                return None
+            break
+    if ip is None or port is None:
+        return None
+    return ip, port
+
+def sdp_rewrite_media_address(sdp, ip, port):
+    """
+    Point an SDP body at another media address, as a media relay does: every
+    c= line gets ip and the first m=audio line gets port. Everything else
+    (codecs, attributes) is kept.
+
+    Returns:
+        bytes | str: The rewritten body, of the same type as sdp.
+    """
+    is_bytes = isinstance(sdp, bytes)
+    if is_bytes:
+        sdp = sdp.decode('utf-8', 'replace')
+    lines = sdp.splitlines(True)
+    audio_done = False
+    for i, line in enumerate(lines):
+        text = line.rstrip('\r\n')
+        if text.startswith('c='):
+            fields = text.split()
+            fields[-1] = ip
+            lines[i] = ' '.join(fields) + line[len(text):]
+        elif text.startswith('m=audio ') and not audio_done:
+            fields = text.split(' ')
+            fields[1] = str(port)
+            lines[i] = ' '.join(fields) + line[len(text):]
+            audio_done = True
+    sdp = ''.join(lines)
+    return sdp.encode('utf-8') if is_bytes else sdp
@@ -0,0 +1,262 @@
+'''
+Voice activity detection and silence suppression for the send pipeline
+
+SilenceSuppressor is a stage between a frame source (read_and_encode_audio
+or a MediaCache entry) and the packetizer. It decodes frames a block at a
+time, measures every frame's level in dBov in one vectorized pass, and
+counts a frame as active if it is above the speech threshold or within the
+hangover after the last frame that was. For each frame it then yields:
+    - the payload itself, inside a talkspurt;
+    - (payload, payload_type, marker) for a special packet: the first frame
+      of a talkspurt (marker set, payload_type None for the stream's own) or
+      an RFC 3389 comfort-noise packet;
+    - None for a suppressed frame. No packet is sent, but the RTP timestamp
+      still advances, so the receiver sees the gap as silence, not loss.
+RtpScheduler and RtpSendSession accept all three.
+
+ComfortNoiseGenerator is the receiving side. It turns the level carried by
+a CN packet into frames of noise at that level, which RtpReceiveSession
+plays until the next talkspurt starts.
+'''
+
+import numpy as np
+import metrics
+from config import *
+from g711 import get_codec
+from rtp_packet import RTP_HEADER_SIZE
+
+FULL_SCALE = 32768.0
+MIN_LEVEL_DB = -127.0  # quietest level a CN packet can carry
+CN_LEVEL_STEP_DB = 3.0  # send a fresh CN packet when the noise level moves this much
+NOISE_FLOOR_RISE = 0.2  # per-block smoothing when the background gets louder
+SNR_MARGIN_DB = 9.0  # speech must be this far above the tracked noise floor
+
+# RFC 3389 payload: one byte of noise level in -dBov (no spectral information)
+CN_PAYLOADS = [bytes((level,)) for level in range(128)]
+
+FRAMES_SUPPRESSED = metrics.counter("vad.frames_suppressed")
+CN_PACKETS = metrics.counter("vad.cn_packets")
+BYTES_SAVED = metrics.counter("vad.bytes_saved")
+
+def frame_levels(pcm, frame_samples):
+    """
+    Level of each frame in dBov (0 dBov is a full-scale square wave).
+
+    Args:
+        pcm (np.ndarray): int16 samples, a whole number of frames long.
+        frame_samples (int): Samples per frame.
+
+    Returns:
+        np.ndarray: float64 level per frame, clipped to MIN_LEVEL_DB.
+    """
+    samples = pcm.reshape(-1, frame_samples).astype(np.float32)
+    power = np.einsum('ij,ij->i', samples, samples, dtype=np.float64) / (frame_samples * FULL_SCALE ** 2)
+    return np.maximum(10 * np.log10(np.maximum(power, 1e-13)), MIN_LEVEL_DB)
+
+class SilenceSuppressor:
+    def __init__(self, mode="cn", codec=AUDIO_CODEC, frame_duration=20, threshold_db=VAD_THRESHOLD_DB,
+                 hangover_ms=VAD_HANGOVER_MS, cn_refresh_ms=CN_REFRESH_MS, block_frames=50):
+        """
+        Args:
+            mode (str): "suppress" sends nothing during silence; "cn" sends
+                RFC 3389 comfort-noise packets instead.
+            codec (str): G.711 codec of the frames.
+            frame_duration (int): Duration of each frame in milliseconds.
+            threshold_db (float): Lowest level (dBov) that can count as speech.
+            hangover_ms (int): How long to keep sending after speech stops,
+                so word endings and short pauses are not clipped.
+            cn_refresh_ms (int): Longest gap between CN packets in "cn" mode.
+            block_frames (int): Frames classified per vectorized pass; this
+                is also how far the stage reads ahead of the sender.
+        """
+        if mode not in ("suppress", "cn"):
+            raise ValueError(f"Unknown silence suppression mode: {mode}")
+        self.mode = mode
+        self.codec = get_codec(codec)
+        self.frame_samples = frame_duration * 8
+        self.threshold_db = threshold_db
+        self.hangover_frames = hangover_ms // frame_duration
+        self.cn_refresh_frames = max(1, cn_refresh_ms // frame_duration)
+        self.block_frames = block_frames
+
+        self.noise_floor_db = None
+        self._frame_index = 0
+        self._last_speech = -(1 << 40)
+        self._in_talkspurt = False
+        self._since_cn = 0
+        self._cn_level = None
+
+        self.stats = {
+            "frames": 0,
+            "speech_frames": 0,
+            "silent_frames": 0,
+            "talkspurts": 0,
+            "cn_packets": 0,
+            "packets_suppressed": 0,
+            "bytes_saved": 0,
+        }
+
+    def classify(self, pcm):
+        """
+        Classify a block of frames.
+
+        Args:
+            pcm (np.ndarray): int16 samples, a whole number of frames long.
+
+        Returns:
+            tuple: (active, levels) arrays, one entry per frame.
+        """
+        levels = frame_levels(pcm, self.frame_samples)
+        threshold = self.threshold_db
+        if self.noise_floor_db is not None:
+            threshold = max(threshold, self.noise_floor_db + SNR_MARGIN_DB)
+        speech = levels > threshold
+
+        # Hangover: a frame is active if the last speech frame (carried over
+        # from earlier blocks) is at most hangover_frames behind it
+        n = len(levels)
+        index = np.arange(self._frame_index, self._frame_index + n, dtype=np.int64)
+        last_speech = np.where(speech, index, self._last_speech)
+        np.maximum.accumulate(last_speech, out=last_speech)
+        active = index - last_speech <= self.hangover_frames
+        self._frame_index += n
+        self._last_speech = int(last_speech[-1])
+
+        # Track the background: follow it down at once, up slowly
+        quiet = levels[~speech]
+        if len(quiet):
+            floor = float(np.percentile(quiet, 10))
+            if self.noise_floor_db is None or floor < self.noise_floor_db:
+                self.noise_floor_db = floor
+            else:
+                self.noise_floor_db += NOISE_FLOOR_RISE * (floor - self.noise_floor_db)
+        return active, levels
+
+    def process(self, frames):
+        """
+        Run encoded frames through the VAD.
+
+        Args:
+            frames (iterable): Encoded payloads, one per frame.
+
+        Yields:
+            bytes | memoryview | tuple | None: See the module docstring.
+        """
+        frames = iter(frames)
+        frame_bytes = self.frame_samples
+        while True:
+            block = []
+            for payload in frames:
+                block.append(payload)
+                if len(block) == self.block_frames:
+                    break
+            if not block:
+                return
+
+            encoded = b''.join(block)
+            if len(encoded) != frame_bytes * len(block):
+                # Odd-sized frame (a short last frame): classify padded
+                encoded = b''.join(bytes(payload).ljust(frame_bytes, bytes((self.codec.silence,)))
+                                   [:frame_bytes] for payload in block)
+            active, levels = self.classify(self.codec.decode(encoded))
+            yield from self._emit(block, active, levels)
+            if len(block) < self.block_frames:
+                return
+
+    def _emit(self, block, active, levels):
+        stats = self.stats
+        speech = int(np.count_nonzero(active))
+        stats["frames"] += len(block)
+        stats["speech_frames"] += speech
+        stats["silent_frames"] += len(block) - speech
+        cn = self.mode == "cn"
+        cn_packets = suppressed = bytes_saved = 0
+
+        for payload, is_active, level in zip(block, active.tolist(), levels.tolist()):
+            if is_active:
+                if self._in_talkspurt:
+                    yield payload
+                else:
+                    self._in_talkspurt = True
+                    stats["talkspurts"] += 1
+                    yield (payload, None, True)
+                continue
+
+            if self._in_talkspurt:
+                self._in_talkspurt = False
+                self._since_cn = self.cn_refresh_frames  # CN goes out on the first silent frame
+            self._since_cn += 1
+            if cn and (self._since_cn >= self.cn_refresh_frames or self._cn_level is None
+                       or abs(level - self._cn_level) >= CN_LEVEL_STEP_DB):
+                self._since_cn = 0
+                self._cn_level = level
+                cn_packets += 1
+                bytes_saved += len(payload) - 1
+                yield (CN_PAYLOADS[min(int(round(-level)), 127)], CN_PAYLOAD_TYPE, False)
+            else:
+                suppressed += 1
+                bytes_saved += len(payload) + RTP_HEADER_SIZE
+                yield None
+
+        stats["cn_packets"] += cn_packets
+        stats["packets_suppressed"] += suppressed
+        stats["bytes_saved"] += bytes_saved
+        if metrics.enabled:
+            CN_PACKETS.inc(cn_packets)
+            FRAMES_SUPPRESSED.inc(suppressed)
+            BYTES_SAVED.inc(bytes_saved)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        frames = stats["frames"]
+        stats["packets_saved_fraction"] = stats["packets_suppressed"] / frames if frames else 0.0
+        return stats
+
+class ComfortNoiseGenerator:
+    def __init__(self, frame_samples=160, timeout=COMFORT_NOISE_TIMEOUT, seed=None):
+        """
+        Args:
+            frame_samples (int): Samples per generated frame.
+            timeout (float): Stop generating noise this many seconds after
+                the last CN packet, so a dead stream falls silent.
+            seed (int): Seed for the noise source.
+        """
+        self.frame_samples = frame_samples
+        self.timeout = timeout
+        self._rng = np.random.default_rng(seed)
+        # Frames are random windows into one table of white noise
+        self._noise = self._rng.standard_normal(frame_samples * 64).astype(np.float32)
+        self._scaled = np.empty(frame_samples, dtype=np.float32)
+        self._gain = 0.0
+        self.level = None
+        self.updated = 0.0
+        self.frames_generated = 0
+
+    def update(self, payload, now):
+        """
+        Take the noise level from a CN payload and return the first frame of
+        noise at that level.
+        """
+        self.level = -(payload[0] & 0x7F) if len(payload) else MIN_LEVEL_DB
+        self._gain = FULL_SCALE * 10 ** (self.level / 20)
+        self.updated = now
+        return self.frame()
+
+    def stop(self):
+        """
+        A talkspurt started: no more noise until the next CN packet.
+        """
+        self.level = None
+
+    def active(self, now):
+        return self.level is not None and now - self.updated < self.timeout
+
+    def frame(self):
+        """
+        One frame of noise at the current level, as a new int16 array.
+        """
+        start = int(self._rng.integers(0, len(self._noise) - self.frame_samples))
+        scaled = np.multiply(self._noise[start:start + self.frame_samples], self._gain, out=self._scaled)
+        np.clip(scaled, -FULL_SCALE, FULL_SCALE - 1, out=scaled)
+        self.frames_generated += 1
+        return scaled.astype(np.int16)